@@ -73,6 +73,7 @@ from haystack.components.generators import OpenAIGenerator
 from haystack.components.converters import OutputAdapter
 from haystack.components.embedders import SentenceTransformersDocumentEmbedder, SentenceTransformersTextEmbedder
 from haystack_integrations.components.retrievers.pinecone import PineconeEmbeddingRetriever
+from embedding import CachedTextEmbedder
 
 query_rephrase_template = """
         Rewrite the question for search while keeping its meaning and key terms intact.
@@ -98,7 +99,8 @@ conversational_rag.add_component("list_to_str_adapter", OutputAdapter(template="
 
 # Create embedders for documents and queries
 # conversational_rag.add_component("document_embedder", SentenceTransformersDocumentEmbedder(model="sentence-transformers/all-MiniLM-L6-v2"))
-conversational_rag.add_component("text_embedder", SentenceTransformersTextEmbedder(model="sentence-transformers/all-MiniLM-L6-v2"))
+# Repeated questions reuse their query embedding instead of running the model again
+conversational_rag.add_component("text_embedder", CachedTextEmbedder(model="sentence-transformers/all-MiniLM-L6-v2"))
 
 # components for RAG with embedding retriever
 conversational_rag.add_component("retriever", PineconeEmbeddingRetriever(document_store=document_store, top_k=3))
@@ -140,4 +142,4 @@ while True:
     search_query = res['query_rephrase_llm']['replies'][0]
     print(f"   🔎 Search Query: {search_query}")
     assistant_resp = res['llm']['replies'][0]
-    print(f"🤖 {assistant_resp.text}")
\ No newline at end of file
+    print(f"🤖 {assistant_resp.text}")
\ No newline at end of file
@@ -0,0 +1,167 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from haystack import Document, component
+from haystack.dataclasses import ChatMessage
+
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95'))
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '3600'))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '2000'))
+
+
+class SemanticAnswerCache:
+  """
+  Answers keyed by the embedding of the query, the set of retrieved document ids and a fingerprint of the
+  conversation history the answer was generated with. A lookup hits when an entry with the same documents
+  and history has a query embedding with cosine similarity of at least `threshold`, so an answer that
+  depends on one session's history is never served to another.
+  Entries expire after `ttl` seconds, the least recently used go first when there are more than
+  `max_entries`, and everything is dropped when the document store reports a change.
+  """
+
+  def __init__(self, document_store=None, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: float = ANSWER_CACHE_TTL,
+               max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+    self.document_store = document_store
+    self.threshold = threshold
+    self.ttl = ttl
+    self.max_entries = max_entries
+    self.counts = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'invalidations': 0}
+    self._entries: 'OrderedDict[int, Dict[str, Any]]' = OrderedDict()
+    self._by_documents: Dict[Tuple[frozenset, str], List[int]] = {}
+    self._next_id = 0
+    self._store_version = None
+    self._lock = threading.Lock()
+
+  def _current_store_version(self):
+    if self.document_store is None:
+      return None
+    # IndexedInMemoryDocumentStore bumps `generation` on every write/delete, other stores only have a count
+    generation = getattr(self.document_store, 'generation', None)
+    return generation if generation is not None else self.document_store.count_documents()
+
+  def _check_store(self):
+    version = self._current_store_version()
+    if version != self._store_version:
+      if self._entries:
+        self.counts['invalidations'] += 1
+      self._entries.clear()
+      self._by_documents.clear()
+      self._store_version = version
+
+  def _drop(self, entry_id: int):
+    entry = self._entries.pop(entry_id)
+    ids = self._by_documents[entry['documents']]
+    ids.remove(entry_id)
+    if not ids:
+      del self._by_documents[entry['documents']]
+
+  def lookup(self, embedding: np.ndarray, document_ids: frozenset, history: str = '') -> Optional[List[ChatMessage]]:
+    with self._lock:
+      self._check_store()
+      now = time.monotonic()
+      best_id, best_score = None, self.threshold
+      for entry_id in list(self._by_documents.get((document_ids, history), ())):
+        entry = self._entries[entry_id]
+        if now - entry['created'] > self.ttl:
+          self._drop(entry_id)
+          self.counts['expired'] += 1
+          continue
+        score = float(entry['embedding'] @ embedding)
+        if score >= best_score:
+          best_id, best_score = entry_id, score
+      if best_id is None:
+        self.counts['misses'] += 1
+        return None
+      self.counts['hits'] += 1
+      self._entries.move_to_end(best_id)
+      return self._entries[best_id]['replies']
+
+  def store(self, embedding: np.ndarray, document_ids: frozenset, replies: List[ChatMessage], history: str = ''):
+    with self._lock:
+      self._check_store()
+      entry_id = self._next_id
+      self._next_id += 1
+      self._entries[entry_id] = {'embedding': embedding, 'documents': (document_ids, history), 'replies': replies,
+                                 'created': time.monotonic()}
+      self._by_documents.setdefault((document_ids, history), []).append(entry_id)
+      while len(self._entries) > self.max_entries:
+        self._drop(next(iter(self._entries)))
+        self.counts['evicted'] += 1
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self._by_documents.clear()
+
+  def stats(self) -> Dict[str, Any]:
+    with self._lock:
+      lookups = self.counts['hits'] + self.counts['misses']
+      return {**self.counts, 'entries': len(self._entries), 'hit_rate': self.counts['hits'] / lookups if lookups else 0.0}
+
+
+def _normalized(embedding: List[float]) -> np.ndarray:
+  vector = np.asarray(embedding, dtype=np.float32)
+  norm = np.linalg.norm(vector)
+  return vector / norm if norm else vector
+
+
+def history_fingerprint(memories: Optional[List[ChatMessage]]) -> str:
+  # Empty for a first turn, so questions without history can share answers across sessions
+  if not memories:
+    return ''
+  digest = hashlib.sha256()
+  for message in memories:
+    digest.update(f"{message.role.value}\x00{message.text or ''}\x01".encode('utf-8'))
+  return digest.hexdigest()
+
+
+@component
+class SemanticCacheLookup:
+  """
+  Looks the (rephrased) query, the retrieved documents and the `memories` that go into the prompt (after
+  MemoryBudget) up in a SemanticAnswerCache. On a hit the cached
+  answer goes out on `replies` and `documents` stays empty, so the prompt builder and the LLM never run.
+  On a miss the documents are passed on together with a `cache_key` for SemanticCacheWriter.
+  """
+
+  def __init__(self, cache: SemanticAnswerCache, text_embedder):
+    self.cache = cache
+    self.text_embedder = text_embedder
+
+  def warm_up(self):
+    if hasattr(self.text_embedder, 'warm_up'):
+      self.text_embedder.warm_up()
+
+  @component.output_types(replies=List[ChatMessage], documents=List[Document], cache_key=Dict[str, Any])
+  def run(self, query: str, documents: List[Document], memories: Optional[List[ChatMessage]] = None):
+    embedding = _normalized(self.text_embedder.run(text=query)['embedding'])
+    document_ids = frozenset(doc.id for doc in documents)
+    history = history_fingerprint(memories)
+    replies = self.cache.lookup(embedding, document_ids, history)
+    if replies is not None:
+      return {'replies': replies}
+    return {'documents': documents, 'cache_key': {'embedding': embedding, 'documents': document_ids, 'history': history}}
+
+
+@component
+class SemanticCacheWriter:
+  """
+  Stores the LLM replies under the key produced by SemanticCacheLookup on a miss.
+  """
+
+  def __init__(self, cache: SemanticAnswerCache):
+    self.cache = cache
+
+  @component.output_types(cached=bool)
+  def run(self, cache_key: Dict[str, Any], replies: List[ChatMessage]):
+    if not replies:
+      return {'cached': False}
+    self.cache.store(cache_key['embedding'], cache_key['documents'], replies, cache_key.get('history', ''))
+    return {'cached': True}
@@ -0,0 +1,235 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import List, Optional
+
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+
+import module
+
+# Chat turns running at once; each one is a pipeline run on its own thread, mostly waiting on the LLM
+MAX_CONCURRENT_CHATS = int(os.getenv('MAX_CONCURRENT_CHATS', '32'))
+# Requests allowed to wait for a free slot before new ones are turned away with 503
+MAX_QUEUED_REQUESTS = int(os.getenv('MAX_QUEUED_REQUESTS', '128'))
+CHAT_TIMEOUT = float(os.getenv('CHAT_TIMEOUT', '120'))
+INGEST_TIMEOUT = float(os.getenv('INGEST_TIMEOUT', '1800'))
+# Ingestion is CPU-bound (conversion and embedding), it gets its own small pool so it can't starve chat turns
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '1'))
+
+_chat_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CHATS, thread_name_prefix='api-chat')
+_ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix='api-ingest')
+
+
+class AdmissionQueue:
+  """
+  Lets `limit` requests run at once and up to `max_waiting` more wait their turn; beyond that requests are
+  rejected straight away instead of piling up until they time out.
+  """
+
+  def __init__(self, limit: int, max_waiting: int):
+    self.max_waiting = max_waiting
+    self.waiting = 0
+    self._semaphore = asyncio.Semaphore(limit)
+
+  def check(self):
+    if self._semaphore.locked() and self.waiting >= self.max_waiting:
+      raise HTTPException(status_code=503, detail="Server busy, try again shortly", headers={'Retry-After': '5'})
+
+  @asynccontextmanager
+  async def slot(self):
+    self.check()
+    self.waiting += 1
+    try:
+      await self._semaphore.acquire()
+    finally:
+      self.waiting -= 1
+    try:
+      yield
+    finally:
+      self._semaphore.release()
+
+
+class ChatRequest(BaseModel):
+  question: str
+  session_id: Optional[str] = None
+  stream: bool = True
+
+
+class BatchRequest(BaseModel):
+  questions: List[str]
+  session_ids: Optional[List[Optional[str]]] = None
+
+
+class _LoopQueue:
+  # module.chat puts tokens from a worker thread, this hands them to an asyncio.Queue on the event loop
+  def __init__(self, loop: asyncio.AbstractEventLoop):
+    self.loop = loop
+    self.queue: asyncio.Queue = asyncio.Queue()
+
+  def put(self, item):
+    self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+
+def _event(data: dict, event: Optional[str] = None) -> str:
+  return (f"event: {event}\n" if event else '') + f"data: {json.dumps(data)}\n\n"
+
+
+async def _stream(updates: _LoopQueue, future: asyncio.Future, timeout: float, summary):
+  # Relays what the worker thread puts on `updates` as server-sent events, then its result or error
+  loop = asyncio.get_running_loop()
+  deadline = loop.time() + timeout
+  while True:
+    try:
+      update = await asyncio.wait_for(updates.queue.get(), max(0.0, deadline - loop.time()))
+    except asyncio.TimeoutError:
+      yield _event({'error': f"Not finished within {timeout:.0f}s"}, 'error')
+      return
+    if update is None:
+      break
+    yield _event(update if isinstance(update, dict) else {'token': update})
+  try:
+    yield _event({'done': True, **summary(future.result())}, 'done')
+  except Exception as error:
+    yield _event({'error': f"{type(error).__name__}: {error}"}, 'error')
+
+
+def _summary(result: dict) -> dict:
+  rephrased = result.get('query_rephrase_llm', {}).get('replies')
+  return {'answer': result['llm']['replies'][0].text, 'query': rephrased[0] if rephrased else None}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  app.state.chats = AdmissionQueue(MAX_CONCURRENT_CHATS, MAX_QUEUED_REQUESTS)
+  app.state.ingests = AdmissionQueue(INGEST_WORKERS, MAX_QUEUED_REQUESTS)
+  if module.WARM_UP_ON_START:
+    module.start_warm_up()
+  yield
+  _chat_executor.shutdown(wait=False, cancel_futures=True)
+  _ingest_executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(title="RAG chatbot API", lifespan=lifespan)
+
+
+@app.get('/health')
+async def health():
+  return {'ready': module.is_ready(), 'error': module.warm_up_error(), 'waiting_chats': app.state.chats.waiting}
+
+
+@app.post('/chat')
+async def chat(request: ChatRequest):
+  loop = asyncio.get_running_loop()
+  if not request.stream:
+    async with app.state.chats.slot():
+      future = loop.run_in_executor(_chat_executor, module.chat, request.question, None, request.session_id)
+      try:
+        return _summary(await asyncio.wait_for(future, CHAT_TIMEOUT))
+      except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"No answer within {CHAT_TIMEOUT:.0f}s")
+
+  # A full queue is turned away with a plain 503 before the stream starts
+  app.state.chats.check()
+
+  async def events():
+    try:
+      async with app.state.chats.slot():
+        tokens = _LoopQueue(loop)
+        # A turn that times out or loses its client keeps its executor thread until the pipeline returns,
+        # the executor size is what bounds those
+        future = loop.run_in_executor(_chat_executor, module.chat, request.question, tokens, request.session_id)
+        future.add_done_callback(lambda _: tokens.put(None))
+        async for event in _stream(tokens, future, CHAT_TIMEOUT, _summary):
+          yield event
+    except HTTPException as error:
+      yield _event({'error': error.detail}, 'error')
+
+  return StreamingResponse(events(), media_type='text/event-stream')
+
+
+@app.post('/chat/batch')
+async def chat_batch(request: BatchRequest):
+  loop = asyncio.get_running_loop()
+  async with app.state.chats.slot():
+    future = loop.run_in_executor(_chat_executor, module.chat_batch, request.questions, request.session_ids)
+    try:
+      results = await asyncio.wait_for(future, CHAT_TIMEOUT * max(1, len(request.questions) // 8))
+    except asyncio.TimeoutError:
+      raise HTTPException(status_code=504, detail="Batch did not finish in time")
+    except ValueError as error:
+      raise HTTPException(status_code=422, detail=str(error))
+  return [{key: item[key] for key in ('question', 'session_id', 'query', 'answer', 'error')} for item in results]
+
+
+@app.delete('/sessions/{session_id}')
+async def clear_session(session_id: str):
+  module.clear_session(session_id)
+  return {'cleared': session_id}
+
+
+@app.post('/ingest')
+async def ingest(files: List[UploadFile] = File(...)):
+  # The async endpoint only keeps the event loop free: the whole synchronous preprocessing pipeline (conversion,
+  # embedding and the writes to the document store, I/O included) runs as one call on the ingest thread pool
+  from ingestion import stream_ingest
+
+  app.state.ingests.check()
+  loop = asyncio.get_running_loop()
+  directory = Path(tempfile.mkdtemp(prefix='ingest-'))
+  run_future = []
+
+  def cleanup():
+    # Once the run is submitted it may still be reading the files, so the directory goes when the run finishes;
+    # if the client left before the stream started nothing was submitted and it goes straight away
+    if run_future:
+      run_future[0].add_done_callback(lambda _: shutil.rmtree(directory, ignore_errors=True))
+    else:
+      shutil.rmtree(directory, ignore_errors=True)
+
+  paths = []
+  try:
+    for i, upload in enumerate(files):
+      # One subdirectory per upload, so files with the same name don't overwrite each other and keep their name
+      path = directory.joinpath(str(i), Path(upload.filename or f"upload_{i}").name)
+      path.parent.mkdir()
+      with open(path, 'wb') as handle:
+        await loop.run_in_executor(None, shutil.copyfileobj, upload.file, handle)
+      paths.append(str(path))
+  except BaseException:
+    shutil.rmtree(directory, ignore_errors=True)
+    raise
+
+  progress = _LoopQueue(loop)
+
+  def run():
+    counts = stream_ingest(module.get_preprocessing_pipeline(), paths,
+                           progress=lambda fraction, desc='': progress.put({'progress': round(fraction, 3), 'desc': desc}))
+    module.save_document_store()
+    return counts
+
+  async def events():
+    try:
+      async with app.state.ingests.slot():
+        future = loop.run_in_executor(_ingest_executor, run)
+        run_future.append(future)
+        future.add_done_callback(lambda _: progress.put(None))
+        async for event in _stream(progress, future, INGEST_TIMEOUT, dict):
+          yield event
+    except HTTPException as error:
+      yield _event({'error': error.detail}, 'error')
+
+  # The background task runs after the response ends, also when the client disconnected before the first event
+  return StreamingResponse(events(), media_type='text/event-stream', background=BackgroundTask(cleanup))
+
+
+if __name__ == '__main__':
+  import uvicorn
+  uvicorn.run(app, host='0.0.0.0', port=int(os.getenv('API_PORT', '8080')))
@@ -0,0 +1,170 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from haystack.components.builders import ChatPromptBuilder, PromptBuilder
+from haystack.dataclasses import ChatMessage
+
+from chat_memory import chat_session
+from components import DocumentBudget, MemoryBudget, is_self_contained
+from embedding import EMBEDDING_BACKEND, model_pool
+
+logger = logging.getLogger(__name__)
+
+BATCH_LLM_CONCURRENCY = int(os.getenv('BATCH_LLM_CONCURRENCY', '8'))
+BATCH_RETRIEVAL_WORKERS = int(os.getenv('BATCH_RETRIEVAL_WORKERS', '8'))
+BATCH_EMBEDDING_BATCH_SIZE = int(os.getenv('BATCH_EMBEDDING_BATCH_SIZE', '64'))
+
+
+class BatchQuestionAnswerer:
+  """
+  Answers a list of questions with the same steps as the conversational pipeline, but stage by stage for the
+  whole batch: rephrasing (only where there is history), one batched embedding forward pass, retrieval in
+  parallel (one matrix product when the store has `embedding_retrieval_batch`), then at most
+  `max_llm_concurrency` LLM calls at a time.
+
+  Questions that share a session id are answered in the order given, each one seeing the memory written by
+  the previous one, so a batch is processed in waves: the n-th question of every session goes in wave n.
+  Results come back in input order; a question that fails only fails its own item.
+  """
+
+  def __init__(self, retriever, llm, template: List[ChatMessage], memory_store=None, rephrase_llm=None,
+               rephrase_template: Optional[str] = None, embedding_model: Optional[str] = None,
+               normalize_embeddings: bool = False, embedding_backend: str = EMBEDDING_BACKEND, top_k: int = 3, max_llm_concurrency: int = BATCH_LLM_CONCURRENCY,
+               max_retrieval_workers: int = BATCH_RETRIEVAL_WORKERS, embedding_batch_size: int = BATCH_EMBEDDING_BATCH_SIZE,
+               document_budget: Optional[DocumentBudget] = None, memory_budget: Optional[MemoryBudget] = None):
+    self.retriever = retriever
+    self.llm = llm
+    self.template = template
+    self.memory_store = memory_store
+    self.rephrase_llm = rephrase_llm
+    self.rephrase_builder = PromptBuilder(rephrase_template, required_variables=['query']) if rephrase_template else None
+    self.embedding_model = embedding_model
+    self.normalize_embeddings = normalize_embeddings
+    self.embedding_backend = embedding_backend
+    self.top_k = top_k
+    self.embedding_batch_size = embedding_batch_size
+    self.document_budget = document_budget
+    self.memory_budget = memory_budget
+    self.prompt_builder = ChatPromptBuilder(variables=['query', 'documents', 'memories'], required_variables=['query', 'documents', 'memories'])
+    self._llm_pool = ThreadPoolExecutor(max_workers=max_llm_concurrency, thread_name_prefix='batch-llm')
+    self._retrieval_pool = ThreadPoolExecutor(max_workers=max_retrieval_workers, thread_name_prefix='batch-retrieval')
+
+  def _memories(self, session_id: Optional[str]) -> List[ChatMessage]:
+    if self.memory_store is None or session_id is None:
+      return []
+    with chat_session(session_id):
+      memories = self.memory_store.retrieve()
+    return self.memory_budget.run(memories=memories)['memories'] if self.memory_budget else memories
+
+  def _rephrase(self, item: Dict[str, Any]) -> str:
+    if not item['memories'] or self.rephrase_llm is None or is_self_contained(item['question']):
+      return item['question']
+    prompt = self.rephrase_builder.run(query=item['question'], memories=item['memories'])['prompt']
+    return self.rephrase_llm.run(prompt=prompt)['replies'][0]
+
+  def _embed(self, queries: List[str]) -> List[List[float]]:
+    return model_pool.get(self.embedding_model, backend=self.embedding_backend).encode(
+      queries, batch_size=self.embedding_batch_size, show_progress_bar=False, normalize_embeddings=self.normalize_embeddings).tolist()
+
+  def _retrieve(self, items: List[Dict[str, Any]]):
+    if self.embedding_model is None:
+      results = self._retrieval_pool.map(lambda item: self._guard(item, lambda: self.retriever.run(query=item['query'])['documents']), items)
+      for item, documents in zip(items, results):
+        item['documents'] = documents
+      return
+
+    try:
+      embeddings = self._embed([item['query'] for item in items])
+    except Exception as error:
+      for item in items:
+        item['error'] = f"embedding: {type(error).__name__}: {error}"
+      return
+
+    store = getattr(self.retriever, 'document_store', None)
+    if hasattr(store, 'embedding_retrieval_batch') and not getattr(self.retriever, 'filters', None):
+      try:
+        for item, documents in zip(items, store.embedding_retrieval_batch(embeddings, top_k=self.top_k)):
+          item['documents'] = documents
+        return
+      except Exception as error:
+        logger.warning("Batched retrieval failed, retrieving one query at a time: %s", error)
+    results = self._retrieval_pool.map(
+      lambda pair: self._guard(pair[0], lambda: self.retriever.run(query_embedding=pair[1])['documents']), zip(items, embeddings))
+    for item, documents in zip(items, results):
+      item['documents'] = documents
+
+  @staticmethod
+  def _guard(item: Dict[str, Any], step):
+    try:
+      return step()
+    except Exception as error:
+      item['error'] = f"{type(error).__name__}: {error}"
+      return None
+
+  def _generate(self, item: Dict[str, Any]) -> Optional[str]:
+    documents = item['documents']
+    if self.document_budget is not None:
+      documents = self.document_budget.run(documents=documents)['documents']
+    prompt = self.prompt_builder.run(template=self.template, query=item['question'], documents=documents,
+                                     memories=item['memories'])['prompt']
+    reply = self.llm.run(messages=prompt)['replies'][0]
+    if self.memory_store is not None and item['session_id'] is not None:
+      with chat_session(item['session_id']):
+        self.memory_store.write_messages([ChatMessage.from_user(item['question']), reply])
+    return reply.text
+
+  def _run_wave(self, items: List[Dict[str, Any]]):
+    for item in items:
+      item['memories'] = self._guard(item, lambda: self._memories(item['session_id'])) or []
+    rephrased = self._llm_pool.map(lambda item: self._guard(item, lambda: self._rephrase(item)), items)
+    for item, query in zip(items, rephrased):
+      item['query'] = query or item['question']
+
+    live = [item for item in items if item['error'] is None]
+    if live:
+      self._retrieve(live)
+    live = [item for item in items if item['error'] is None]
+    answers = self._llm_pool.map(lambda item: self._guard(item, lambda: self._generate(item)), live)
+    for item, answer in zip(live, answers):
+      item['answer'] = answer
+
+  def run(self, questions: List[str], session_ids: Optional[List[Optional[str]]] = None) -> List[Dict[str, Any]]:
+    if session_ids is not None and len(session_ids) != len(questions):
+      raise ValueError("session_ids must have one entry per question")
+    session_ids = session_ids or [None] * len(questions)
+    items = [{'question': question, 'session_id': session_id, 'query': None, 'documents': None, 'answer': None,
+              'error': None} for question, session_id in zip(questions, session_ids)]
+
+    waves: List[List[Dict[str, Any]]] = []
+    turns: Dict[str, int] = {}
+    for item in items:
+      turn = 0
+      if item['session_id'] is not None:
+        turn = turns.get(item['session_id'], 0)
+        turns[item['session_id']] = turn + 1
+      while len(waves) <= turn:
+        waves.append([])
+      waves[turn].append(item)
+
+    for wave in waves:
+      self._run_wave(wave)
+
+    for item in items:
+      item.pop('memories', None)
+    return items
+
+
+def pinecone_batch_answerer(index_name: str, model: str, model_dimension: int, template: List[ChatMessage],
+                            rephrase_template: Optional[str] = None, memory_store=None, **kwargs) -> BatchQuestionAnswerer:
+  # Same retrieval and generators as the Pinecone chatbot page, PINECONE_BACKEND=local works here too
+  from haystack_integrations.components.generators.cohere import CohereChatGenerator, CohereGenerator
+  from haystack_integrations.components.retrievers.pinecone import PineconeEmbeddingRetriever
+  from local_pinecone import pinecone_document_store
+
+  document_store = pinecone_document_store(index=index_name, namespace="default", dimension=model_dimension, metric="cosine",
+                                           spec={"serverless": {"region": "us-east-1", "cloud": "aws"}})
+  return BatchQuestionAnswerer(PineconeEmbeddingRetriever(document_store=document_store, top_k=3), CohereChatGenerator(),
+                               template, memory_store=memory_store, rephrase_llm=CohereGenerator() if rephrase_template else None,
+                               rephrase_template=rephrase_template, embedding_model=model, **kwargs)
@@ -0,0 +1,282 @@
+"""
+Per-stage benchmark of the ingestion pipeline (routing, conversion, cleaning, splitting, embedding, writing).
+
+Generates synthetic TXT/Markdown/PDF/DOCX corpora of the requested sizes, runs each stage on its own with
+the same components and settings as the preprocessing pipeline in module.py, and appends one JSON line per
+stage to the output file (bench_output.txt by default) so runs can be compared across commits:
+
+  python benchmark_ingestion.py --sizes 8,40,200 --repeat 3
+
+Every corpus size is measured in a process of its own, so its peak RSS is not inflated by the sizes before it.
+Runs offline (HF_HUB_OFFLINE=1) with a small sentence-transformers model, which must already be in the local
+Hugging Face cache or be given as a local path with --model.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+
+MIME_TYPES = ['text/plain', 'application/pdf', 'text/markdown', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document']
+STAGES = ['routing', 'conversion', 'cleaning', 'splitting', 'embedding', 'embedding_cached', 'writing']
+
+
+def make_vocabulary(rng: random.Random, size: int = 3000) -> List[str]:
+  letters = 'abcdefghijklmnopqrstuvwxyz'
+  return [''.join(rng.choice(letters) for _ in range(rng.randint(2, 10))) for _ in range(size)]
+
+
+def make_paragraphs(rng: random.Random, vocabulary: List[str], words: int) -> List[str]:
+  paragraphs, written = [], 0
+  while written < words:
+    sentences = []
+    for _ in range(rng.randint(3, 6)):
+      sentence = [rng.choice(vocabulary) for _ in range(rng.randint(8, 20))]
+      sentences.append(' '.join(sentence).capitalize() + '.')
+      written += len(sentence)
+    paragraphs.append(' '.join(sentences))
+  return paragraphs
+
+
+def write_txt(path: Path, paragraphs: List[str]):
+  path.write_text('\n\n'.join(paragraphs), encoding='utf-8')
+
+
+def write_markdown(path: Path, paragraphs: List[str]):
+  parts = [f"# {path.stem}"]
+  for i, paragraph in enumerate(paragraphs):
+    if i % 4 == 0:
+      parts.append(f"## Section {i // 4 + 1}")
+    parts.append(paragraph)
+  path.write_text('\n\n'.join(parts), encoding='utf-8')
+
+
+def write_docx(path: Path, paragraphs: List[str]):
+  import docx
+  document = docx.Document()
+  document.add_heading(path.stem, level=1)
+  for paragraph in paragraphs:
+    document.add_paragraph(paragraph)
+  document.save(str(path))
+
+
+def _pdf_escape(text: str) -> str:
+  return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_pdf(path: Path, paragraphs: List[str], chars_per_line: int = 90, lines_per_page: int = 60):
+  # Minimal text-only PDF (one Helvetica content stream per page), enough for pypdf's text extraction
+  lines = []
+  for paragraph in paragraphs:
+    line = ''
+    for word in paragraph.split():
+      if len(line) + len(word) + 1 > chars_per_line:
+        lines.append(line)
+        line = ''
+      line = f"{line} {word}" if line else word
+    lines.extend([line, ''])
+  pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+  objects = ['<< /Type /Catalog /Pages 2 0 R >>', None, '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+  page_ids = []
+  for page in pages:
+    text = ' '.join(f"({_pdf_escape(line)}) '" for line in page)
+    stream = f"BT /F1 10 Tf 12 TL 50 800 Td {text} ET".encode('latin-1', 'replace')
+    objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream.decode('latin-1')}\nendstream")
+    objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+    page_ids.append(len(objects))
+  objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+  output, offsets = bytearray(b'%PDF-1.4\n'), []
+  for number, body in enumerate(objects, start=1):
+    offsets.append(len(output))
+    output += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1')
+  xref = len(output)
+  output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+  output += ''.join(f"{offset:010d} 00000 n \n" for offset in offsets).encode('latin-1')
+  output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('latin-1')
+  path.write_bytes(bytes(output))
+
+
+WRITERS = [('txt', write_txt), ('md', write_markdown), ('pdf', write_pdf), ('docx', write_docx)]
+
+
+def make_corpus(directory: Path, files: int, words: int, seed: int) -> List[str]:
+  """
+  Writes `files` documents of about `words` words each, spread evenly over the four formats. The same seed
+  always gives the same corpus.
+  """
+  rng = random.Random(seed)
+  vocabulary = make_vocabulary(rng)
+  directory.mkdir(parents=True, exist_ok=True)
+  paths = []
+  for i in range(files):
+    extension, write = WRITERS[i % len(WRITERS)]
+    path = directory.joinpath(f"doc_{i:05d}.{extension}")
+    write(path, make_paragraphs(rng, vocabulary, words))
+    paths.append(str(path))
+  return paths
+
+
+def peak_rss_mb() -> Tuple[float, float]:
+  # ru_maxrss is in kilobytes on Linux and bytes on macOS, and is the peak over the whole process lifetime,
+  # which is why main() measures every corpus size in a process of its own
+  scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+  return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+          resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+def git_commit() -> str:
+  try:
+    return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                          cwd=Path(__file__).parent).stdout.strip()
+  except Exception:
+    return 'unknown'
+
+
+def build_components(args, cache_dir: str) -> Dict[str, Any]:
+  # Same components and settings as module._build_preprocessing_pipeline, built fresh for every run
+  from haystack.components.routers import FileTypeRouter
+  from haystack.components.preprocessors import DocumentCleaner, DocumentSplitter
+  from haystack.components.writers import DocumentWriter
+  from haystack.document_stores.types import DuplicatePolicy
+
+  from embedding import CachedDocumentEmbedder
+  from ingestion import ParallelFileConverter
+
+  if args.store == 'pinecone-local':
+    from local_pinecone import LocalPineconeDocumentStore
+    from pinecone_writer import PineconeBatchWriter
+    document_store = LocalPineconeDocumentStore(index=f"bench-{uuid.uuid4().hex[:8]}", namespace='default', dimension=args.dimension,
+                                                latency=args.latency_ms / 1000)
+    writer = PineconeBatchWriter(document_store)
+  else:
+    from vector_index import IndexedInMemoryDocumentStore
+    writer = DocumentWriter(IndexedInMemoryDocumentStore(), policy=DuplicatePolicy.OVERWRITE)
+
+  return {
+    'router': FileTypeRouter(mime_types=MIME_TYPES),
+    'converter': ParallelFileConverter(max_workers=args.workers),
+    'cleaner': DocumentCleaner(),
+    'splitter': DocumentSplitter(split_by='word', split_overlap=50),
+    'embedder': CachedDocumentEmbedder(model=args.model, cache_dir=cache_dir, batch_size=args.batch_size, backend=args.backend,
+                                       token_budget=args.token_budget),
+    'writer': writer,
+  }
+
+
+def timed(function: Callable[[], Any]) -> Tuple[Any, float]:
+  start = time.perf_counter()
+  result = function()
+  return result, time.perf_counter() - start
+
+
+def run_once(args, sources: List[str], cache_dir: str) -> Tuple[Dict[str, float], Dict[str, Any]]:
+  from haystack import Document
+  from ingestion import CONVERTER_INPUTS
+
+  components = build_components(args, cache_dir)
+  # Load the model before the clock starts, model loading is not part of the embedding throughput
+  from embedding import model_pool
+  model_pool.get(args.model, backend=args.backend)
+
+  seconds, sizes = {}, {}
+  routed, seconds['routing'] = timed(lambda: components['router'].run(sources=sources))
+  converter_inputs = {CONVERTER_INPUTS[mime]: routed[mime] for mime in CONVERTER_INPUTS if routed.get(mime)}
+  converted, seconds['conversion'] = timed(lambda: components['converter'].run(**converter_inputs))
+  documents = converted['documents']
+  sizes['documents'] = len(documents)
+  sizes['failed'] = len(converted['failed'])
+  cleaned, seconds['cleaning'] = timed(lambda: components['cleaner'].run(documents=documents))
+  split, seconds['splitting'] = timed(lambda: components['splitter'].run(documents=cleaned['documents']))
+  chunks = split['documents']
+  sizes['chunks'] = len(chunks)
+  embedded, seconds['embedding'] = timed(lambda: components['embedder'].run(documents=chunks))
+  sizes['padding_efficiency'] = components['embedder'].stats()['padding_efficiency']
+  # Second pass over the same chunks, all served from the embedding cache
+  _, seconds['embedding_cached'] = timed(lambda: components['embedder'].run(documents=[
+    Document(content=doc.content, meta=doc.meta) for doc in chunks]))
+  _, seconds['writing'] = timed(lambda: components['writer'].run(documents=embedded['documents']))
+  return seconds, sizes
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument('--sizes', default='8,40', help="Comma-separated corpus sizes, in files (spread over TXT/MD/PDF/DOCX)")
+  parser.add_argument('--words', type=int, default=800, help="Approximate words per file")
+  parser.add_argument('--repeat', type=int, default=3, help="Runs per size, the median time per stage is reported")
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--model', default='sentence-transformers/all-MiniLM-L6-v2', help="Model name or local path")
+  parser.add_argument('--dimension', type=int, default=384, help="Embedding dimension, for --store pinecone-local")
+  parser.add_argument('--batch-size', type=int, default=32, help="Chunks per embedding batch when --token-budget is 0")
+  parser.add_argument('--token-budget', type=int, default=8192, help="Padded tokens per embedding batch, 0 for fixed-size batches")
+  parser.add_argument('--backend', choices=['torch', 'onnx', 'onnx-int8'], default='torch', help="Embedding inference backend")
+  parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Conversion worker processes")
+  parser.add_argument('--store', choices=['memory', 'pinecone-local'], default='memory')
+  parser.add_argument('--latency-ms', type=float, default=0.0, help="Simulated round trip for --store pinecone-local")
+  parser.add_argument('--output', default=str(Path(__file__).parent.joinpath('bench_output.txt')), help="JSON lines, appended")
+  parser.add_argument('--corpus-dir', help="Keep the generated corpora here instead of a temporary directory")
+  parser.add_argument('--online', action='store_true', help="Allow downloading the model from the Hugging Face Hub")
+  parser.add_argument('--run-id', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if not args.online:
+    os.environ.setdefault('HF_HUB_OFFLINE', '1')
+    os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+
+  sizes = [int(size) for size in args.sizes.split(',')]
+  if len(sizes) > 1:
+    # One process per size, so the peak RSS of a size does not carry over into the next one
+    run_id = args.run_id or uuid.uuid4().hex[:12]
+    for files in sizes:
+      subprocess.run([sys.executable, __file__, *sys.argv[1:], '--sizes', str(files), '--run-id', run_id], check=True)
+    print(f"\nResults appended to {args.output}")
+    return
+
+  run = {'run_id': args.run_id or uuid.uuid4().hex[:12], 'commit': git_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+         'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count(), 'model': args.model,
+         'store': args.store, 'backend': args.backend, 'workers': args.workers, 'batch_size': args.batch_size, 'token_budget': args.token_budget, 'words_per_file': args.words}
+
+  files = sizes[0]
+  with tempfile.TemporaryDirectory(prefix='bench-') as scratch:
+    corpus_root = Path(args.corpus_dir or scratch)
+    with open(args.output, 'a', encoding='utf-8') as output:
+      sources = make_corpus(corpus_root.joinpath(f"corpus_{files}"), files, args.words, args.seed)
+      timings, counts = {stage: [] for stage in STAGES}, {}
+      for repeat in range(args.repeat):
+        # A fresh embedding cache per run, so 'embedding' always measures the model
+        seconds, counts = run_once(args, sources, str(Path(scratch).joinpath(f"cache_{files}_{repeat}")))
+        for stage in STAGES:
+          timings[stage].append(seconds[stage])
+      rss, rss_children = peak_rss_mb()
+
+      print(f"\n{files} files, {counts['documents']} documents, {counts['chunks']} chunks ({counts['failed']} failed)")
+      print(f"{'stage':<18}{'seconds':>10}{'docs/s':>12}{'chunks/s':>12}")
+      for stage in STAGES + ['total']:
+        seconds = sum(statistics.median(timings[s]) for s in STAGES if s != 'embedding_cached') if stage == 'total' \
+          else statistics.median(timings[stage])
+        record = {**run, 'files': files, 'documents': counts['documents'], 'chunks': counts['chunks'], 'failed': counts['failed'],
+                  'padding_efficiency': counts['padding_efficiency'], 'stage': stage, 'repeat': args.repeat, 'seconds': seconds,
+                  'docs_per_s': files / seconds if seconds else None, 'chunks_per_s': counts['chunks'] / seconds if seconds else None,
+                  'peak_rss_mb': round(rss, 1), 'peak_rss_children_mb': round(rss_children, 1)}
+        output.write(json.dumps(record) + '\n')
+        print(f"{stage:<18}{seconds:>10.3f}{record['docs_per_s'] or 0:>12.1f}{record['chunks_per_s'] or 0:>12.1f}")
+      if counts['padding_efficiency'] is not None:
+        print(f"embedding padding efficiency {counts['padding_efficiency']:.1%}")
+      print(f"peak RSS for this size {rss:.0f} MB, conversion workers {rss_children:.0f} MB")
+
+  print(f"\nResults appended to {args.output}")
+
+
+if __name__ == '__main__':
+  main()
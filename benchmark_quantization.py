@@ -0,0 +1,125 @@
+"""
+Recall versus memory of the quantized embedding indexes (int8 and binary codes with exact rescoring).
+
+Builds a corpus of normalized embeddings, answers the same queries with the exact float32 EmbeddingIndex and
+with QuantizedEmbeddingIndex at several rescore multipliers, and reports recall@k against the exact results,
+RAM per vector and query latency. One JSON line per configuration is appended to the output file
+(bench_output.txt by default):
+
+  python benchmark_quantization.py --vectors 100000 --top-k 10 --multipliers 1,4,10
+
+By default the embeddings are random clustered vectors; with --model the synthetic corpus of
+benchmark_ingestion.py is split into passages and embedded instead (offline, like that benchmark).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+from benchmark_ingestion import git_commit, make_paragraphs, make_vocabulary
+from vector_index import EmbeddingIndex, QuantizedEmbeddingIndex, normalize_rows
+
+
+def python_list_bytes(dim: int) -> int:
+  # What InMemoryDocumentStore keeps per Document.embedding: the list object plus one boxed float per value
+  return sys.getsizeof([0.0] * dim) + dim * sys.getsizeof(1.0)
+
+
+def clustered_vectors(count: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+  rng = np.random.default_rng(seed)
+  centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+  vectors = centers[rng.integers(0, clusters, count)] + 0.6 * rng.standard_normal((count, dim)).astype(np.float32)
+  return normalize_rows(vectors)
+
+
+def model_vectors(args) -> np.ndarray:
+  from embedding import model_pool
+
+  rng = random.Random(args.seed)
+  vocabulary = make_vocabulary(rng)
+  passages = make_paragraphs(rng, vocabulary, args.vectors * 60)[:args.vectors]
+  return np.asarray(model_pool.get(args.model).encode(passages, batch_size=64, show_progress_bar=False,
+                                                      normalize_embeddings=True), dtype=np.float32)
+
+
+def make_queries(vectors: np.ndarray, count: int, noise: float, seed: int) -> np.ndarray:
+  # Perturbed corpus vectors, so every query has a meaningful neighbourhood
+  rng = np.random.default_rng(seed + 1)
+  picked = vectors[rng.integers(0, len(vectors), count)]
+  return normalize_rows(picked + noise * rng.standard_normal(picked.shape).astype(np.float32) / np.sqrt(vectors.shape[1]))
+
+
+def timed_search(index, queries: np.ndarray, top_k: int) -> Tuple[List[List[str]], float]:
+  start = time.perf_counter()
+  hits = index.search(queries, top_k)
+  seconds = time.perf_counter() - start
+  return [[doc_id for doc_id, _ in query_hits] for query_hits in hits], seconds * 1000 / len(queries)
+
+
+def recall(found: List[List[str]], expected: List[List[str]]) -> float:
+  return float(np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found, expected) if b]))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument('--vectors', type=int, default=50000)
+  parser.add_argument('--dimension', type=int, default=384, help="For the random vectors, a --model sets its own")
+  parser.add_argument('--clusters', type=int, default=200)
+  parser.add_argument('--queries', type=int, default=200)
+  parser.add_argument('--noise', type=float, default=0.5, help="Query perturbation relative to a unit vector")
+  parser.add_argument('--top-k', type=int, default=10)
+  parser.add_argument('--multipliers', default='1,2,4,10', help="Comma-separated rescore multipliers to try")
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--model', help="Embed a synthetic text corpus with this model instead of random vectors")
+  parser.add_argument('--output', default=str(Path(__file__).parent.joinpath('bench_output.txt')), help="JSON lines, appended")
+  parser.add_argument('--online', action='store_true', help="Allow downloading the model from the Hugging Face Hub")
+  args = parser.parse_args()
+
+  if not args.online:
+    os.environ.setdefault('HF_HUB_OFFLINE', '1')
+    os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+
+  vectors = model_vectors(args) if args.model else clustered_vectors(args.vectors, args.dimension, args.clusters, args.seed)
+  queries = make_queries(vectors, args.queries, args.noise, args.seed)
+  ids = [str(i) for i in range(len(vectors))]
+  count, dim = vectors.shape
+  run = {'run_id': uuid.uuid4().hex[:12], 'commit': git_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+         'python': platform.python_version(), 'machine': platform.machine(), 'benchmark': 'quantization',
+         'vectors': count, 'dim': dim, 'queries': len(queries), 'top_k': args.top_k, 'source': args.model or 'clustered'}
+
+  exact = EmbeddingIndex(dim=dim)
+  exact.attach(ids, vectors.copy())
+  expected, exact_ms = timed_search(exact, queries, args.top_k)
+  rows = [('python lists', None, python_list_bytes(dim), None, None),
+          ('float32', None, vectors[0].nbytes, 1.0, exact_ms)]
+
+  for mode in ('int8', 'binary'):
+    index = QuantizedEmbeddingIndex(mode, dim=dim)
+    index.attach(ids, vectors)
+    for multiplier in (int(value) for value in args.multipliers.split(',')):
+      index.rescore_multiplier = multiplier
+      found, ms = timed_search(index, queries, args.top_k)
+      rows.append((mode, multiplier, index.memory_bytes() / count, recall(found, expected), ms))
+
+  print(f"\n{count} vectors of dimension {dim}, {len(queries)} queries, recall@{args.top_k} against exact float32 search")
+  print(f"{'storage':<14}{'rescore x':>10}{'bytes/vector':>14}{'RAM MB':>10}{'recall':>10}{'ms/query':>10}")
+  with open(args.output, 'a', encoding='utf-8') as output:
+    for storage, multiplier, per_vector, value, ms in rows:
+      record = {**run, 'storage': storage, 'rescore_multiplier': multiplier, 'bytes_per_vector': round(per_vector, 1),
+                'ram_mb': round(per_vector * count / 2 ** 20, 2), 'recall': value, 'ms_per_query': ms}
+      output.write(json.dumps(record) + '\n')
+      print(f"{storage:<14}{multiplier or '-':>10}{per_vector:>14.1f}{record['ram_mb']:>10.1f}"
+            f"{'-' if value is None else f'{value:.4f}':>10}{'-' if ms is None else f'{ms:.2f}':>10}")
+  print(f"\nResults appended to {args.output}")
+
+
+if __name__ == '__main__':
+  main()
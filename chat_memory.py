@@ -0,0 +1,115 @@
+import os
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Tuple
+
+from haystack import default_from_dict, default_to_dict
+from haystack.dataclasses import ChatMessage, ChatRole
+
+
+MEMORY_MAX_TURNS = int(os.getenv('MEMORY_MAX_TURNS', '10'))
+MEMORY_MAX_CHARS = int(os.getenv('MEMORY_MAX_CHARS', str(20 * 1024 * 1024)))
+MEMORY_MAX_SESSIONS = int(os.getenv('MEMORY_MAX_SESSIONS', '10000'))
+
+_session_id: ContextVar[str] = ContextVar('chat_session_id', default='default')
+
+
+@contextmanager
+def chat_session(session_id: str):
+  # Every memory read and write made by a pipeline run inside this block goes to `session_id`
+  token = _session_id.set(session_id or 'default')
+  try:
+    yield
+  finally:
+    _session_id.reset(token)
+
+
+def current_session() -> str:
+  return _session_id.get()
+
+
+class SessionChatMessageStore:
+  """
+  Chat message store with one bounded history per session, usable wherever InMemoryChatMessageStore is.
+  Each session keeps only the last `max_turns` user/assistant pairs as (role, text) tuples, and when there are
+  more than `max_sessions` sessions or all of them together hold more than `max_chars` characters the least
+  recently used sessions are dropped. Reading a session that has no messages does not create it.
+  """
+
+  def __init__(self, max_turns: int = MEMORY_MAX_TURNS, max_chars: int = MEMORY_MAX_CHARS,
+               max_sessions: int = MEMORY_MAX_SESSIONS):
+    self.max_turns = max_turns
+    self.max_chars = max_chars
+    self.max_sessions = max_sessions
+    self.evicted_sessions = 0
+    self._sessions: 'OrderedDict[str, Deque[Tuple[str, str]]]' = OrderedDict()
+    self._chars = 0
+    self._lock = threading.Lock()
+
+  def to_dict(self) -> Dict[str, Any]:
+    return default_to_dict(self, max_turns=self.max_turns, max_chars=self.max_chars, max_sessions=self.max_sessions)
+
+  @classmethod
+  def from_dict(cls, data: Dict[str, Any]) -> 'SessionChatMessageStore':
+    return default_from_dict(cls, data)
+
+  def _log(self, session_id: str) -> Deque[Tuple[str, str]]:
+    log = self._sessions.get(session_id)
+    if log is None:
+      log = self._sessions[session_id] = deque()
+    self._sessions.move_to_end(session_id)
+    return log
+
+  def count_messages(self) -> int:
+    with self._lock:
+      return len(self._sessions.get(current_session(), ()))
+
+  def write_messages(self, messages: List[ChatMessage]) -> int:
+    session_id = current_session()
+    with self._lock:
+      log = self._log(session_id)
+      for message in messages:
+        entry = (message.role.value, message.text or '')
+        log.append(entry)
+        self._chars += len(entry[1])
+      while len(log) > 2 * self.max_turns:
+        self._chars -= len(log.popleft()[1])
+      while (self._chars > self.max_chars or len(self._sessions) > self.max_sessions) and len(self._sessions) > 1:
+        _, evicted = self._sessions.popitem(last=False)
+        self._chars -= sum(len(text) for _, text in evicted)
+        self.evicted_sessions += 1
+    return len(messages)
+
+  def retrieve(self) -> List[ChatMessage]:
+    session_id = current_session()
+    with self._lock:
+      log = self._sessions.get(session_id)
+      if log is None:
+        return []
+      self._sessions.move_to_end(session_id)
+      log = list(log)
+    messages = []
+    for role, text in log:
+      if role == ChatRole.USER.value:
+        messages.append(ChatMessage.from_user(text))
+      elif role == ChatRole.SYSTEM.value:
+        messages.append(ChatMessage.from_system(text))
+      else:
+        messages.append(ChatMessage.from_assistant(text))
+    return messages
+
+  def delete_messages(self) -> None:
+    self.clear_session(current_session())
+
+  def clear_session(self, session_id: str):
+    with self._lock:
+      log = self._sessions.pop(session_id, None)
+      if log is not None:
+        self._chars -= sum(len(text) for _, text in log)
+
+  def stats(self) -> Dict[str, Any]:
+    with self._lock:
+      return {'sessions': len(self._sessions), 'max_sessions': self.max_sessions, 'chars': self._chars,
+              'max_chars': self.max_chars, 'evicted_sessions': self.evicted_sessions}
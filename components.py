@@ -0,0 +1,318 @@
+import logging
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from difflib import SequenceMatcher
+from itertools import chain
+from typing import Any, Dict, List, Optional
+
+from haystack import Document, component
+from haystack.core.component.types import Variadic
+from haystack.dataclasses import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+PROMPT_TOKENIZER = os.getenv('PROMPT_TOKENIZER', 'sentence-transformers/all-MiniLM-L12-v2')
+MEMORY_TOKEN_BUDGET = int(os.getenv('MEMORY_TOKEN_BUDGET', '1000'))
+DOCUMENT_TOKEN_BUDGET = int(os.getenv('DOCUMENT_TOKEN_BUDGET', '2000'))
+
+
+@component
+class ListJoiner:
+  def __init__(self, _type: Any):
+    component.set_output_types(self, values=_type)
+
+  def run(self, values:Variadic[Any]):
+    result = list(chain(*values))
+    return {'values':result}
+
+
+# Words and openings that usually point back at earlier turns ("what about its height?", "and the other one?")
+_REFERRING_WORDS = {'it', 'its', 'they', 'them', 'their', 'theirs', 'this', 'that', 'these', 'those', 'he', 'him', 'his',
+                    'she', 'her', 'hers', 'there', 'then', 'one', 'ones', 'former', 'latter', 'above', 'previous',
+                    'same', 'else', 'more', 'also', 'again', 'too', 'other', 'another'}
+_FOLLOW_UP_OPENINGS = ('and ', 'or ', 'but ', 'so ', 'what about', 'how about', 'why not', 'what else')
+
+
+def is_self_contained(query: str, min_words: int = 4) -> bool:
+  text = query.strip().lower()
+  words = re.findall(r"[a-z0-9']+", text)
+  if len(words) < min_words or text.startswith(_FOLLOW_UP_OPENINGS):
+    return False
+  return not any(word in _REFERRING_WORDS for word in words)
+
+
+@component
+class QueryRephraseRouter:
+  """
+  Sends the query to the rephrasing LLM only when it can help. With no conversation history, or when the
+  query reads as self-contained, it goes out on `query` straight to retrieval; otherwise on `rephrase`.
+  """
+
+  def __init__(self, use_heuristic: bool = True, min_words: int = 4):
+    self.use_heuristic = use_heuristic
+    self.min_words = min_words
+    self.counts = {'no_history': 0, 'self_contained': 0, 'rephrased': 0}
+    self._lock = threading.Lock()
+
+  def _count(self, reason: str):
+    with self._lock:
+      self.counts[reason] += 1
+
+  @component.output_types(query=str, rephrase=str)
+  def run(self, query: str, memories: List[ChatMessage]):
+    if not memories:
+      self._count('no_history')
+      return {'query': query}
+    if self.use_heuristic and is_self_contained(query, self.min_words):
+      self._count('self_contained')
+      return {'query': query}
+    self._count('rephrased')
+    return {'rephrase': query}
+
+  def stats(self) -> Dict[str, Any]:
+    with self._lock:
+      total = sum(self.counts.values())
+      skipped = total - self.counts['rephrased']
+      return {**self.counts, 'total': total, 'skipped': skipped, 'skip_rate': skipped / total if total else 0.0}
+
+
+@component
+class QueryJoiner:
+  """
+  Passes on whichever query arrives, the raw one from QueryRephraseRouter or the rewritten one.
+  """
+
+  @component.output_types(query=str)
+  def run(self, queries: Variadic[str]):
+    return {'query': list(queries)[0]}
+
+
+def query_similarity(a: str, b: str) -> float:
+  return SequenceMatcher(None, re.findall(r"\w+", a.lower()), re.findall(r"\w+", b.lower())).ratio()
+
+
+@component
+class RetrievalPrefetcher:
+  """
+  Starts retrieval (with query embedding first, if a text embedder is given) for the original user query on a
+  worker thread and passes the query on unchanged, so retrieval runs while the query is being rephrased.
+  SpeculativeRetriever picks up the result with the returned `ticket`. When disabled it only passes the query on.
+  """
+
+  def __init__(self, retriever, text_embedder=None, enabled: bool = True, max_workers: int = 4, max_pending: int = 256):
+    self.retriever = retriever
+    self.text_embedder = text_embedder
+    self.enabled = enabled
+    self.max_pending = max_pending
+    self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='retrieval-prefetch')
+    self._pending: 'OrderedDict[str, tuple]' = OrderedDict()
+    self._lock = threading.Lock()
+
+  def warm_up(self):
+    for part in (self.text_embedder, self.retriever):
+      if hasattr(part, 'warm_up'):
+        part.warm_up()
+
+  def retrieve(self, query: str) -> List[Document]:
+    if self.text_embedder is not None:
+      embedding = self.text_embedder.run(text=query)['embedding']
+      return self.retriever.run(query_embedding=embedding)['documents']
+    return self.retriever.run(query=query)['documents']
+
+  def take(self, ticket: str) -> Optional[tuple]:
+    with self._lock:
+      return self._pending.pop(ticket, None)
+
+  @component.output_types(query=str, ticket=str)
+  def run(self, query: str):
+    ticket = ''
+    if self.enabled:
+      ticket = uuid.uuid4().hex
+      future = self._executor.submit(self.retrieve, query)
+      with self._lock:
+        self._pending[ticket] = (query, future)
+        # Tickets of runs that failed before reaching SpeculativeRetriever are dropped once there are too many
+        while len(self._pending) > self.max_pending:
+          self._pending.popitem(last=False)[1][1].cancel()
+    return {'query': query, 'ticket': ticket}
+
+
+@component
+class SpeculativeRetriever:
+  """
+  Retrieves for the (rephrased) query, reusing the prefetched results for the original query when the two
+  are close enough (word-level similarity of at least `similarity_threshold`), and retrieving again otherwise.
+  """
+
+  def __init__(self, prefetcher: RetrievalPrefetcher, similarity_threshold: float = 0.9):
+    self.prefetcher = prefetcher
+    self.similarity_threshold = similarity_threshold
+    self.counts = {'prefetch_used': 0, 'prefetch_discarded': 0, 'not_prefetched': 0}
+    self._lock = threading.Lock()
+
+  def _count(self, outcome: str):
+    with self._lock:
+      self.counts[outcome] += 1
+
+  @component.output_types(documents=List[Document])
+  def run(self, query: str, ticket: str = ''):
+    pending = self.prefetcher.take(ticket) if ticket else None
+    if pending is None:
+      self._count('not_prefetched')
+      return {'documents': self.prefetcher.retrieve(query)}
+
+    original_query, future = pending
+    if query_similarity(original_query, query) >= self.similarity_threshold:
+      try:
+        documents = future.result()
+        self._count('prefetch_used')
+        return {'documents': documents}
+      except Exception as error:
+        logger.warning("Prefetched retrieval failed, retrieving again: %s", error)
+    future.cancel()
+    self._count('prefetch_discarded')
+    return {'documents': self.prefetcher.retrieve(query)}
+
+  def stats(self) -> Dict[str, Any]:
+    with self._lock:
+      return dict(self.counts)
+
+
+class TokenCounter:
+  """
+  Counts tokens with a local Hugging Face tokenizer, loaded once per name. If the tokenizer cannot be
+  loaded it falls back to an estimate of one token per four characters.
+  """
+
+  _tokenizers: Dict[str, Any] = {}
+  _lock = threading.Lock()
+
+  def __init__(self, tokenizer: str = PROMPT_TOKENIZER):
+    self.name = tokenizer
+
+  @property
+  def tokenizer(self):
+    with self._lock:
+      if self.name not in self._tokenizers:
+        try:
+          from transformers import AutoTokenizer
+          self._tokenizers[self.name] = AutoTokenizer.from_pretrained(self.name)
+        except Exception as error:
+          logger.warning("Could not load tokenizer %s, estimating token counts: %s", self.name, error)
+          self._tokenizers[self.name] = None
+      return self._tokenizers[self.name]
+
+  def count(self, text: str) -> int:
+    if not text:
+      return 0
+    if self.tokenizer is None:
+      return (len(text) + 3) // 4
+    return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+  def truncate(self, text: str, max_tokens: int) -> str:
+    if self.tokenizer is None:
+      return text[:max_tokens * 4]
+    ids = self.tokenizer.encode(text, add_special_tokens=False)[:max_tokens]
+    return self.tokenizer.decode(ids)
+
+
+def _with_text(message: ChatMessage, text: str) -> ChatMessage:
+  if message.role.value == 'user':
+    return ChatMessage.from_user(text)
+  if message.role.value == 'system':
+    return ChatMessage.from_system(text)
+  return ChatMessage.from_assistant(text)
+
+
+@component
+class MemoryBudget:
+  """
+  Keeps the most recent memories that fit in `budget` tokens. The newest message that no longer fits is
+  cut down to the tokens that are left (if at least `min_tokens`), everything older is dropped.
+  """
+
+  def __init__(self, budget: int = MEMORY_TOKEN_BUDGET, min_tokens: int = 32, tokenizer: str = PROMPT_TOKENIZER):
+    self.budget = budget
+    self.min_tokens = min_tokens
+    self.counter = TokenCounter(tokenizer)
+
+  @component.output_types(memories=List[ChatMessage], token_count=int)
+  def run(self, memories: List[ChatMessage]):
+    kept, used = [], 0
+    for message in reversed(memories):
+      text = message.text or ''
+      tokens = self.counter.count(text)
+      if used + tokens <= self.budget:
+        kept.append(message)
+        used += tokens
+        continue
+      left = self.budget - used
+      if left >= self.min_tokens:
+        kept.append(_with_text(message, self.counter.truncate(text, left)))
+        used += left
+      break
+    return {'memories': kept[::-1], 'token_count': used}
+
+
+@component
+class DocumentBudget:
+  """
+  Keeps the highest-scored documents that fit in `budget` tokens, in their original order. The best document
+  that no longer fits is cut down to the tokens that are left (if at least `min_tokens`), the rest are dropped.
+  """
+
+  def __init__(self, budget: int = DOCUMENT_TOKEN_BUDGET, min_tokens: int = 64, tokenizer: str = PROMPT_TOKENIZER):
+    self.budget = budget
+    self.min_tokens = min_tokens
+    self.counter = TokenCounter(tokenizer)
+
+  @component.output_types(documents=List[Document], token_count=int)
+  def run(self, documents: List[Document]):
+    ranked = sorted(range(len(documents)), key=lambda i: documents[i].score if documents[i].score is not None else float('-inf'), reverse=True)
+    kept, used = {}, 0
+    for i in ranked:
+      tokens = self.counter.count(documents[i].content or '')
+      if used + tokens <= self.budget:
+        kept[i] = documents[i]
+        used += tokens
+        continue
+      left = self.budget - used
+      if left >= self.min_tokens:
+        kept[i] = replace(documents[i], content=self.counter.truncate(documents[i].content, left))
+        used += left
+      break
+    return {'documents': [kept[i] for i in sorted(kept)], 'token_count': used}
+
+
+@component
+class PromptTokenCounter:
+  """
+  Passes the rendered chat prompt on to the LLM and reports how many tokens it has.
+  """
+
+  def __init__(self, tokenizer: str = PROMPT_TOKENIZER):
+    self.counter = TokenCounter(tokenizer)
+    self.calls = 0
+    self.total_tokens = 0
+    self.last_token_count = 0
+    self._lock = threading.Lock()
+
+  @component.output_types(prompt=List[ChatMessage], token_count=int)
+  def run(self, prompt: List[ChatMessage]):
+    token_count = sum(self.counter.count(message.text or '') for message in prompt)
+    with self._lock:
+      self.calls += 1
+      self.total_tokens += token_count
+      self.last_token_count = token_count
+    logger.debug("Prompt has %d tokens", token_count)
+    return {'prompt': prompt, 'token_count': token_count}
+
+  def stats(self) -> Dict[str, Any]:
+    with self._lock:
+      return {'calls': self.calls, 'last_token_count': self.last_token_count,
+              'average_token_count': self.total_tokens / self.calls if self.calls else 0.0}
@@ -0,0 +1,717 @@
+import atexit
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import platform
+import re
+import threading
+import unicodedata
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from haystack import Document, component
+
+try:
+  import fcntl
+except ImportError:
+  # Windows, caches are then only safe to share between threads of one process
+  fcntl = None
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_DIR = os.getenv('EMBEDDING_CACHE_DIR', str(Path(__file__).parent.joinpath('.embedding_cache')))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '200000'))
+MODEL_POOL_MAX_BYTES = int(os.getenv('MODEL_POOL_MAX_BYTES', str(4 * 1024 ** 3)))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv('QUERY_CACHE_MAX_ENTRIES', '4096'))
+QUERY_CACHE_DISK_ENTRIES = int(os.getenv('QUERY_CACHE_DISK_ENTRIES', '20000'))
+# 'torch' runs the models as published, 'onnx' a graph-optimized ONNX export and 'onnx-int8' that export with int8
+# dynamic quantization, both through onnxruntime on the CPU (needs optimum[onnxruntime])
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')
+EMBEDDING_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+ONNX_EXPORT_DIR = os.getenv('ONNX_EXPORT_DIR', str(Path(__file__).parent.joinpath('.onnx_models')))
+# An export whose embeddings fall below this cosine similarity to the PyTorch model's is not used
+ONNX_MIN_AGREEMENT = float(os.getenv('ONNX_MIN_AGREEMENT', '0.98'))
+# Padded tokens per document embedding batch: short chunks share large batches, long ones get small ones. 0 keeps
+# fixed batches of `batch_size` chunks
+EMBEDDING_TOKEN_BUDGET = int(os.getenv('EMBEDDING_TOKEN_BUDGET', '8192'))
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv('EMBEDDING_MAX_BATCH_SIZE', '256'))
+ONNX_QUANTIZATION_CONFIG = os.getenv('ONNX_QUANTIZATION_CONFIG',
+                                     'arm64' if platform.machine().lower() in ('arm64', 'aarch64') else 'avx2')
+
+# Short and long, English and not, so the check covers what the multilingual models see as well
+AGREEMENT_SENTENCES = [
+  "What were the seven wonders of the ancient world?",
+  "query: how tall was the lighthouse of Alexandria",
+  "passage: The Great Pyramid of Giza is the oldest of the Seven Wonders and the only one to remain largely intact. "
+  "It was built as a tomb for the pharaoh Khufu around 2560 BC and stood about 146 metres tall.",
+  "Die Hängenden Gärten von Babylon sind das einzige Weltwunder, dessen Existenz nicht nachgewiesen ist.",
+  "Le colosse de Rhodes était une statue du dieu Hélios, érigée en 280 av. J.-C.",
+  "Invoice 2024-118: 3 items, total EUR 1,249.00, due within 30 days.",
+  "ok",
+  "The statue of Zeus at Olympia was made of ivory and gold plates on a wooden frame, " * 8,
+]
+
+
+def normalize_text(text: str) -> str:
+  return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text or '')).strip()
+
+
+def text_key(text: str) -> str:
+  return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()[:32]
+
+
+def path_slug(name: str) -> str:
+  slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_')
+  return f"{slug}-{hashlib.sha256(name.encode('utf-8')).hexdigest()[:8]}"
+
+
+def backend_namespace(model: str, prefix: str, suffix: str, normalize_embeddings: bool, backend: str) -> str:
+  # PyTorch keeps the namespace it always had, so existing caches stay valid
+  namespace = f"{model}|{prefix}|{suffix}|{normalize_embeddings}"
+  return namespace if backend == 'torch' else f"{namespace}|{backend}"
+
+
+@contextlib.contextmanager
+def file_lock(path: Path, exclusive: bool = True):
+  if fcntl is None:
+    yield
+    return
+  with open(path, 'a+b') as handle:
+    fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    try:
+      yield
+    finally:
+      fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+# Entries of the slot log and of the recency snapshot: a text key (text_key, 32 hex characters) and its row
+SLOT_RECORD = np.dtype([('key', 'S32'), ('slot', '<u4')])
+
+
+class EmbeddingCache:
+  """
+  On-disk embedding cache for one model. Vectors live in a memory-mapped float32 array of fixed capacity
+  (`vectors.f32`). Which text key sits in which row is kept in two binary files: `entries.bin`, a snapshot of
+  all entries in least-recently-used order, and `slots.log`, to which every write appends its (key, row)
+  records. The log is folded into a new snapshot once it holds `capacity` records and on `flush()`, which is also
+  the only time the recency order of reads is saved. When the cache is full the oldest rows are reused.
+  `index.json` only holds the model, dimension and capacity.
+
+  Processes sharing the directory coordinate through a lock file: rows are allocated and the log appended under
+  an exclusive lock, reads take a shared one, and both first replay what other processes appended since. Within
+  a process use `shared_embedding_cache`, so there is one instance per directory.
+  """
+
+  def __init__(self, cache_dir: str, model: str, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+    self.path = Path(cache_dir).joinpath(path_slug(model))
+    self.model = model
+    self.capacity = max_entries
+    self.dim: Optional[int] = None
+    self.hits = 0
+    self.misses = 0
+    self._entries: 'OrderedDict[str, int]' = OrderedDict()
+    self._owners: Dict[int, str] = {}
+    self._vectors = None
+    self._snapshot_version = None
+    self._log_offset = 0
+    self._order_changed = False
+    self._lock = threading.Lock()
+    self._load()
+
+  def _meta_file(self) -> Path:
+    return self.path.joinpath('index.json')
+
+  def _snapshot_file(self) -> Path:
+    return self.path.joinpath('entries.bin')
+
+  def _log_file(self) -> Path:
+    return self.path.joinpath('slots.log')
+
+  def _version(self):
+    # A compaction replaces the snapshot file, so a new inode means another process folded the log
+    try:
+      stat = os.stat(self._snapshot_file())
+    except FileNotFoundError:
+      return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+  def _log_size(self) -> int:
+    try:
+      return os.path.getsize(self._log_file())
+    except FileNotFoundError:
+      return 0
+
+  def _load(self):
+    if not self._meta_file().exists():
+      return
+    with open(self._meta_file(), 'r', encoding='utf-8') as handle:
+      meta = json.load(handle)
+    # The vector file was sized when it was created, so its capacity wins over the configured one
+    self.capacity = meta['capacity']
+    self.dim = meta['dim']
+    self._vectors = np.memmap(self.path.joinpath('vectors.f32'), dtype=np.float32, mode='r+', shape=(self.capacity, self.dim))
+    self._entries, self._owners = OrderedDict(), {}
+    self._snapshot_version = self._version()
+    if self._snapshot_version is not None:
+      self._replay(np.fromfile(self._snapshot_file(), dtype=SLOT_RECORD))
+    else:
+      # Caches written before the slot log kept their entries in index.json
+      self._replay(np.array([tuple(entry) for entry in meta.get('entries', [])], dtype=SLOT_RECORD))
+    self._log_offset = 0
+    self._read_log()
+    self._order_changed = False
+
+  def _replay(self, records: np.ndarray):
+    for raw_key, slot in zip(records['key'].tolist(), records['slot'].tolist()):
+      key = raw_key.decode('ascii')
+      previous = self._owners.get(slot)
+      if previous is not None and previous != key:
+        # The row was reused for another key
+        self._entries.pop(previous, None)
+      old_slot = self._entries.get(key)
+      if old_slot is not None and old_slot != slot:
+        self._owners.pop(old_slot, None)
+      self._entries[key] = slot
+      self._entries.move_to_end(key)
+      self._owners[slot] = key
+
+  def _read_log(self):
+    if self._log_size() <= self._log_offset:
+      return
+    with open(self._log_file(), 'rb') as handle:
+      handle.seek(self._log_offset)
+      data = handle.read()
+    complete = len(data) - len(data) % SLOT_RECORD.itemsize
+    self._replay(np.frombuffer(data[:complete], dtype=SLOT_RECORD))
+    self._log_offset += complete
+
+  def _refresh(self):
+    # Picks up what other processes wrote since: a new snapshot means reloading, a longer log replaying its tail
+    if self._vectors is None or self._version() != self._snapshot_version or self._log_size() < self._log_offset:
+      self._load()
+    else:
+      self._read_log()
+
+  def _create(self, dim: int):
+    self.dim = dim
+    self._vectors = np.memmap(self.path.joinpath('vectors.f32'), dtype=np.float32, mode='w+', shape=(self.capacity, self.dim))
+    for stale in (self._snapshot_file(), self._log_file()):
+      stale.unlink(missing_ok=True)
+    self._snapshot_version, self._log_offset = None, 0
+    tmp_file = self.path.joinpath('index.json.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as handle:
+      json.dump({'model': self.model, 'dim': self.dim, 'capacity': self.capacity}, handle)
+    os.replace(tmp_file, self._meta_file())
+
+  def _append(self, records: np.ndarray):
+    with open(self._log_file(), 'ab') as handle:
+      handle.write(records.tobytes())
+    self._log_offset += records.nbytes
+
+  def _compact(self):
+    # Folds the log into a new snapshot in the current recency order, and starts an empty log
+    self._vectors.flush()
+    records = np.array(list(self._entries.items()), dtype=SLOT_RECORD)
+    tmp_file = self.path.joinpath('entries.bin.tmp')
+    records.tofile(tmp_file)
+    os.replace(tmp_file, self._snapshot_file())
+    open(self._log_file(), 'wb').close()
+    self._snapshot_version, self._log_offset = self._version(), 0
+    self._order_changed = False
+
+  def _file_lock(self, exclusive: bool):
+    self.path.mkdir(parents=True, exist_ok=True)
+    return file_lock(self.path.joinpath('.lock'), exclusive)
+
+  def flush(self):
+    # Saves the recency order of the reads since the last snapshot, rows themselves are on disk after put_many
+    with self._lock:
+      if self._vectors is None or not (self._order_changed or self._log_offset):
+        return
+      with self._file_lock(exclusive=True):
+        if self._version() != self._snapshot_version:
+          # Another process compacted since, its order wins
+          self._load()
+          return
+        self._read_log()
+        self._compact()
+
+  def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+    vectors = []
+    with self._lock:
+      if self._vectors is None and not self._meta_file().exists():
+        self.misses += len(keys)
+        return [None] * len(keys)
+      with self._file_lock(exclusive=False):
+        self._refresh()
+        for key in keys:
+          slot = self._entries.get(key)
+          if slot is None:
+            self.misses += 1
+            vectors.append(None)
+            continue
+          self.hits += 1
+          self._entries.move_to_end(key)
+          self._order_changed = True
+          vectors.append(np.array(self._vectors[slot]))
+    return vectors
+
+  def put_many(self, keys: List[str], vectors: List[List[float]]):
+    if not keys:
+      return
+    with self._lock, self._file_lock(exclusive=True):
+      self._refresh()
+      if self._vectors is None:
+        self._create(len(vectors[0]))
+      records = np.empty(len(keys), dtype=SLOT_RECORD)
+      for i, (key, vector) in enumerate(zip(keys, vectors)):
+        slot = self._entries.get(key)
+        if slot is None:
+          if len(self._entries) < self.capacity:
+            slot = len(self._entries)
+          else:
+            _, slot = self._entries.popitem(last=False)
+          self._entries[key] = slot
+          self._owners[slot] = key
+        self._entries.move_to_end(key)
+        self._vectors[slot] = np.asarray(vector, dtype=np.float32)
+        records[i] = (key, slot)
+      # Appended before the lock is released, so no other process allocates from an outdated view
+      self._append(records)
+      if self._log_offset >= self.capacity * SLOT_RECORD.itemsize:
+        self._compact()
+
+  def stats(self) -> Dict[str, Any]:
+    total = self.hits + self.misses
+    return {'model': self.model, 'entries': len(self._entries), 'capacity': self.capacity, 'hits': self.hits,
+            'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+
+def _onnx_file(backend: str) -> str:
+  return 'onnx/model_O2.onnx' if backend == 'onnx' else f"onnx/model_qint8_{ONNX_QUANTIZATION_CONFIG}.onnx"
+
+
+def export_onnx_model(model: str, backend: str, export_dir: str = ONNX_EXPORT_DIR) -> Path:
+  """
+  Exports `model` to ONNX under `export_dir` once, then writes the graph-optimized ('onnx') or int8 dynamically
+  quantized ('onnx-int8') variant next to it. Returns the export directory.
+  """
+  from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model, export_optimized_onnx_model
+
+  path = Path(export_dir).joinpath(path_slug(model))
+  if not any(path.joinpath(name).exists() for name in ('onnx/model.onnx', 'model.onnx')):
+    SentenceTransformer(model, backend='onnx', device='cpu').save_pretrained(str(path))
+  if not path.joinpath(_onnx_file(backend)).exists():
+    exported = SentenceTransformer(str(path), backend='onnx', device='cpu')
+    if backend == 'onnx':
+      # O2 only fuses operators, unlike O3/O4 it keeps the exact GELU and full precision
+      export_optimized_onnx_model(exported, 'O2', str(path))
+    else:
+      export_dynamic_quantized_onnx_model(exported, ONNX_QUANTIZATION_CONFIG, str(path))
+  return path
+
+
+def check_agreement(model: str, backend: str, path: Path, candidate) -> Dict[str, float]:
+  """
+  Cosine similarity between the embeddings of `candidate` and of the PyTorch model on AGREEMENT_SENTENCES. The
+  result is stored next to the export, so the reference model is only loaded the first time.
+  """
+  result_file = path.joinpath(f"agreement-{Path(_onnx_file(backend)).stem}.json")
+  if result_file.exists():
+    with open(result_file, 'r', encoding='utf-8') as handle:
+      return json.load(handle)
+
+  from sentence_transformers import SentenceTransformer
+  reference = SentenceTransformer(model, device='cpu').encode(AGREEMENT_SENTENCES, normalize_embeddings=True)
+  exported = candidate.encode(AGREEMENT_SENTENCES, normalize_embeddings=True)
+  cosines = np.sum(reference * exported, axis=1)
+  result = {'model': model, 'backend': backend, 'file': _onnx_file(backend), 'min_cosine': float(cosines.min()),
+            'mean_cosine': float(cosines.mean())}
+  with open(result_file, 'w', encoding='utf-8') as handle:
+    json.dump(result, handle)
+  return result
+
+
+def load_sentence_transformer(model: str, device: Optional[str] = None, backend: str = 'torch'):
+  """
+  Loads `model` for the given inference backend. ONNX exports that do not reach ONNX_MIN_AGREEMENT with the
+  PyTorch model are logged and replaced by the PyTorch model.
+  """
+  from sentence_transformers import SentenceTransformer
+
+  if backend not in EMBEDDING_BACKENDS:
+    raise ValueError(f"Unknown embedding backend {backend}, use one of {', '.join(EMBEDDING_BACKENDS)}")
+  if backend == 'torch':
+    return SentenceTransformer(model, device=device)
+
+  path = export_onnx_model(model, backend)
+  candidate = SentenceTransformer(str(path), backend='onnx', device=device, model_kwargs={'file_name': _onnx_file(backend)})
+  agreement = check_agreement(model, backend, path, candidate)
+  if agreement['min_cosine'] < ONNX_MIN_AGREEMENT:
+    logger.warning("The %s export of %s only reaches a cosine similarity of %.4f with the PyTorch model (below %.4f), "
+                   "using PyTorch instead", backend, model, agreement['min_cosine'], ONNX_MIN_AGREEMENT)
+    return SentenceTransformer(model, device=device)
+  logger.info("Using the %s export of %s, cosine similarity with PyTorch %.4f (min) %.4f (mean)", backend, model,
+              agreement['min_cosine'], agreement['mean_cosine'])
+  return candidate
+
+
+def model_bytes(instance) -> int:
+  size = sum(param.numel() * param.element_size() for param in instance.parameters())
+  if size == 0:
+    # ONNX weights live in the onnxruntime session, the model file is the closest measure
+    model_path = getattr(getattr(instance[0], 'auto_model', None), 'model_path', None)
+    size = os.path.getsize(model_path) if model_path and os.path.exists(model_path) else 0
+  return size
+
+
+def tokenize_unpadded(model, texts: List[str]) -> Dict[str, List[List[int]]]:
+  # Same as SentenceTransformer.tokenize (stripped, lower-cased if the Transformer module has do_lower_case, truncated
+  # at the maximum sequence length) but without padding, so the lengths can drive the batching and the ids are
+  # padded per batch instead of tokenized again
+  texts = [text.strip() for text in texts]
+  if getattr(model[0], 'do_lower_case', False):
+    texts = [text.lower() for text in texts]
+  return dict(model.tokenizer(texts, add_special_tokens=True, truncation='longest_first', max_length=model.max_seq_length))
+
+
+def encode_tokenized(model, encoded: Dict[str, List[List[int]]], batch: List[int], normalize_embeddings: bool) -> np.ndarray:
+  import torch
+
+  features = model.tokenizer.pad({key: [values[i] for i in batch] for key, values in encoded.items()}, return_tensors='pt')
+  features = {key: value.to(model.device) for key, value in features.items()}
+  with torch.inference_mode():
+    embeddings = model(features)['sentence_embedding']
+    if normalize_embeddings:
+      embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
+  return embeddings.float().cpu().numpy()
+
+
+def token_budget_batches(lengths: List[int], token_budget: int, max_batch_size: int) -> List[List[int]]:
+  """
+  Groups the indices of `lengths` into batches of similar length, longest first, such that every batch padded
+  to its longest member stays within `token_budget` tokens. A text longer than the budget gets a batch of its own.
+  """
+  batches: List[List[int]] = []
+  batch: List[int] = []
+  for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+    # The first member of a batch is its longest, it sets the padded length
+    if batch and (len(batch) >= max_batch_size or (len(batch) + 1) * lengths[batch[0]] > token_budget):
+      batches.append(batch)
+      batch = []
+    batch.append(i)
+  if batch:
+    batches.append(batch)
+  return batches
+
+
+def padded_tokens(lengths: List[int], batches: List[List[int]]) -> int:
+  return sum(len(batch) * max(lengths[i] for i in batch) for batch in batches)
+
+
+def encode_batches(texts: List[str], batch_size: int) -> List[List[int]]:
+  # How SentenceTransformer.encode batches: sorted by character length, longest first, `batch_size` at a time
+  order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+  return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+_shared_caches: Dict[Path, EmbeddingCache] = {}
+_shared_caches_lock = threading.Lock()
+
+
+def shared_embedding_cache(cache_dir: str, model: str, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES) -> EmbeddingCache:
+  # One instance per cache directory in the process, two instances would hand out the same slots
+  path = Path(cache_dir).joinpath(path_slug(model)).resolve()
+  with _shared_caches_lock:
+    if path not in _shared_caches:
+      _shared_caches[path] = EmbeddingCache(cache_dir, model, max_entries)
+      # Registered once per cache, however many embedders and page rebuilds share it
+      atexit.register(_shared_caches[path].flush)
+    return _shared_caches[path]
+
+
+class ModelPool:
+  """
+  Process-wide pool of loaded SentenceTransformer models, shared by every pipeline, page and session.
+  Models are loaded once per (model, device, backend) and the least recently used ones are dropped when the
+  pool goes over `max_bytes`.
+  """
+
+  def __init__(self, max_bytes: int = MODEL_POOL_MAX_BYTES):
+    self.max_bytes = max_bytes
+    self.loads = 0
+    self.evictions = 0
+    self._models: 'OrderedDict[Tuple[str, Optional[str], str], Tuple[Any, int]]' = OrderedDict()
+    self._lock = threading.Lock()
+    self._loading: Dict[Tuple[str, Optional[str], str], threading.Lock] = {}
+
+  def get(self, model: str, device: Optional[str] = None, backend: str = 'torch'):
+    key = (model, device, backend)
+    with self._lock:
+      if key in self._models:
+        self._models.move_to_end(key)
+        return self._models[key][0]
+      loading = self._loading.setdefault(key, threading.Lock())
+
+    # Load outside the pool lock so sessions using other models are not blocked, but only once per model
+    with loading:
+      with self._lock:
+        if key in self._models:
+          self._models.move_to_end(key)
+          return self._models[key][0]
+      instance = load_sentence_transformer(model, device, backend)
+      size = model_bytes(instance)
+      with self._lock:
+        self._models[key] = (instance, size)
+        self.loads += 1
+        self._evict()
+        self._loading.pop(key, None)
+    return instance
+
+  def _evict(self):
+    while len(self._models) > 1 and self.memory_used() > self.max_bytes:
+      self._models.popitem(last=False)
+      self.evictions += 1
+
+  def memory_used(self) -> int:
+    return sum(size for _, size in self._models.values())
+
+  def stats(self) -> Dict[str, Any]:
+    with self._lock:
+      return {'models': [f"{model} ({backend})" for model, _, backend in self._models], 'memory_used': self.memory_used(),
+              'max_bytes': self.max_bytes, 'loads': self.loads, 'evictions': self.evictions}
+
+
+model_pool = ModelPool()
+
+
+class EmbeddingLRU:
+  """
+  Fixed-capacity in-process LRU of embeddings. Keys carry the model namespace, so one instance can be shared
+  by every text embedder in the process.
+  """
+
+  def __init__(self, max_entries: int = QUERY_CACHE_MAX_ENTRIES):
+    self.max_entries = max_entries
+    self._entries: 'OrderedDict[Tuple[str, str], List[float]]' = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key: Tuple[str, str]) -> Optional[List[float]]:
+    with self._lock:
+      embedding = self._entries.get(key)
+      if embedding is not None:
+        self._entries.move_to_end(key)
+      return embedding
+
+  def put(self, key: Tuple[str, str], embedding: List[float]):
+    with self._lock:
+      self._entries[key] = embedding
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+
+query_embedding_lru = EmbeddingLRU()
+
+
+@component
+class CachedDocumentEmbedder:
+  """
+  Drop-in replacement for SentenceTransformersDocumentEmbedder that looks every chunk up in an EmbeddingCache
+  first. Only the misses are batched through the model, which comes from the shared model pool and is not
+  even loaded if everything hits.
+
+  With a `token_budget` the misses are sorted by token length and batched so each batch, padded to its longest
+  chunk, holds at most that many tokens; embeddings are returned in the original order. Each chunk is tokenized
+  once. `stats()` reports the padding efficiency (real tokens over padded tokens) next to the one the fixed-size,
+  character-length sorted batches of SentenceTransformer.encode would have had.
+  """
+
+  def __init__(self, model: str = 'sentence-transformers/all-mpnet-base-v2', cache_dir: str = EMBEDDING_CACHE_DIR,
+               max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES, device: Optional[str] = None, prefix: str = '',
+               suffix: str = '', batch_size: int = 32, progress_bar: bool = False, normalize_embeddings: bool = False,
+               meta_fields_to_embed: Optional[List[str]] = None, embedding_separator: str = '\n',
+               backend: str = EMBEDDING_BACKEND, token_budget: int = EMBEDDING_TOKEN_BUDGET,
+               max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE):
+    self.model = model
+    self.device = device
+    self.backend = backend
+    self.prefix = prefix
+    self.suffix = suffix
+    self.batch_size = batch_size
+    self.token_budget = token_budget
+    self.max_batch_size = max_batch_size
+    self.padding = {'batches': 0, 'tokens': 0, 'padded_tokens': 0, 'encode_padded_tokens': 0}
+    self._lock = threading.Lock()
+    self.progress_bar = progress_bar
+    self.normalize_embeddings = normalize_embeddings
+    self.meta_fields_to_embed = meta_fields_to_embed or []
+    self.embedding_separator = embedding_separator
+    # Anything that changes the vector for the same chunk text is part of the cache namespace
+    self.cache = shared_embedding_cache(cache_dir, backend_namespace(model, prefix, suffix, normalize_embeddings, backend), max_entries)
+
+  def warm_up(self):
+    # Deferred to the first cache miss so fully cached runs never load the model
+    pass
+
+  def _text_to_embed(self, doc: Document) -> str:
+    meta_values = [str(doc.meta[key]) for key in self.meta_fields_to_embed if doc.meta.get(key) is not None]
+    return self.embedding_separator.join(meta_values + [doc.content or ''])
+
+  def embed(self, texts: List[str]) -> List[List[float]]:
+    model = model_pool.get(self.model, self.device, self.backend)
+    texts = [self.prefix + text + self.suffix for text in texts]
+    if not self.token_budget:
+      return model.encode(texts, batch_size=self.batch_size, show_progress_bar=self.progress_bar,
+                          normalize_embeddings=self.normalize_embeddings).tolist()
+
+    encoded = tokenize_unpadded(model, texts)
+    lengths = [len(ids) for ids in encoded['input_ids']]
+    batches = token_budget_batches(lengths, self.token_budget, self.max_batch_size)
+    with self._lock:
+      self.padding['batches'] += len(batches)
+      self.padding['tokens'] += sum(lengths)
+      self.padding['padded_tokens'] += padded_tokens(lengths, batches)
+      self.padding['encode_padded_tokens'] += padded_tokens(lengths, encode_batches(texts, self.batch_size))
+
+    embeddings: List[Optional[List[float]]] = [None] * len(texts)
+    if self.progress_bar:
+      from tqdm import tqdm
+      batches = tqdm(batches, desc='Embedding batches')
+    model.eval()
+    for batch in batches:
+      vectors = encode_tokenized(model, encoded, batch, self.normalize_embeddings)
+      for i, vector in zip(batch, vectors.tolist()):
+        embeddings[i] = vector
+    return embeddings
+
+  def stats(self) -> Dict[str, Any]:
+    with self._lock:
+      padding = dict(self.padding)
+    return {**padding, 'padding_efficiency': padding['tokens'] / padding['padded_tokens'] if padding['padded_tokens'] else None,
+            'encode_padding_efficiency': padding['tokens'] / padding['encode_padded_tokens']
+            if padding['encode_padded_tokens'] else None, 'cache': self.cache.stats()}
+
+  @component.output_types(documents=List[Document])
+  def run(self, documents: List[Document]):
+    texts = [self._text_to_embed(doc) for doc in documents]
+    keys = [text_key(text) for text in texts]
+    cached = self.cache.get_many(keys)
+
+    missing = [i for i, vector in enumerate(cached) if vector is None]
+    for doc, vector in zip(documents, cached):
+      if vector is not None:
+        doc.embedding = vector.tolist()
+
+    if missing:
+      embeddings = self.embed([texts[i] for i in missing])
+      for i, embedding in zip(missing, embeddings):
+        documents[i].embedding = embedding
+      self.cache.put_many([keys[i] for i in missing], embeddings)
+
+    return {'documents': documents}
+
+
+@component
+class CachedTextEmbedder:
+  """
+  Drop-in replacement for SentenceTransformersTextEmbedder that remembers query embeddings, keyed by the model
+  settings and the normalized text. Lookups go to the process-wide EmbeddingLRU first and, when `cache_dir`
+  is given, to an on-disk EmbeddingCache shared with other runs; only misses reach the pooled model. New
+  embeddings are written to disk `flush_every` at a time (and on `flush()` or exit), not on every query.
+  """
+
+  def __init__(self, model: str = 'sentence-transformers/all-mpnet-base-v2', device: Optional[str] = None,
+               prefix: str = '', suffix: str = '', normalize_embeddings: bool = False, cache_dir: Optional[str] = None,
+               max_disk_entries: int = QUERY_CACHE_DISK_ENTRIES, lru: Optional[EmbeddingLRU] = None,
+               flush_every: int = 32, backend: str = EMBEDDING_BACKEND):
+    self.model = model
+    self.device = device
+    self.backend = backend
+    self.prefix = prefix
+    self.suffix = suffix
+    self.normalize_embeddings = normalize_embeddings
+    self.namespace = backend_namespace(model, prefix, suffix, normalize_embeddings, backend)
+    self.lru = lru if lru is not None else query_embedding_lru
+    self.disk = shared_embedding_cache(cache_dir, f"{self.namespace}|query", max_disk_entries) if cache_dir else None
+    self.flush_every = flush_every
+    self.counts = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+    self._pending: Dict[str, List[float]] = {}
+    self._lock = threading.Lock()
+    if self.disk is not None:
+      _text_embedders.add(self)
+
+  def warm_up(self):
+    model_pool.get(self.model, self.device, self.backend)
+
+  def _count(self, outcome: str):
+    with self._lock:
+      self.counts[outcome] += 1
+
+  @component.output_types(embedding=List[float])
+  def run(self, text: str):
+    key = (self.namespace, text_key(text))
+    embedding = self.lru.get(key)
+    if embedding is not None:
+      self._count('memory_hits')
+      return {'embedding': embedding}
+
+    if self.disk is not None:
+      vector = self.disk.get_many([key[1]])[0]
+      if vector is not None:
+        embedding = vector.tolist()
+        self.lru.put(key, embedding)
+        self._count('disk_hits')
+        return {'embedding': embedding}
+
+    embedding = model_pool.get(self.model, self.device, self.backend).encode(
+      self.prefix + normalize_text(text) + self.suffix, show_progress_bar=False,
+      normalize_embeddings=self.normalize_embeddings).tolist()
+    self.lru.put(key, embedding)
+    self._count('misses')
+    if self.disk is not None:
+      with self._lock:
+        self._pending[key[1]] = embedding
+        write = len(self._pending) >= self.flush_every
+      if write:
+        self._write_pending()
+    return {'embedding': embedding}
+
+  def _write_pending(self):
+    with self._lock:
+      pending, self._pending = self._pending, {}
+    if pending:
+      self.disk.put_many(list(pending), list(pending.values()))
+
+  def flush(self):
+    if self.disk is not None:
+      self._write_pending()
+      self.disk.flush()
+
+  def stats(self) -> Dict[str, Any]:
+    with self._lock:
+      total = sum(self.counts.values())
+      hits = total - self.counts['misses']
+      return {**self.counts, 'lru_entries': len(self.lru), 'lru_capacity': self.lru.max_entries,
+              'hit_rate': hits / total if total else 0.0}
+
+
+# Query embedders with a disk tier, so the misses they still hold in memory are written at exit
+_text_embedders: 'weakref.WeakSet[CachedTextEmbedder]' = weakref.WeakSet()
+
+
+def _flush_text_embedders():
+  for embedder in list(_text_embedders):
+    embedder.flush()
+
+
+atexit.register(_flush_text_embedders)
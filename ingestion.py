@@ -0,0 +1,267 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+from haystack import Document, component
+from haystack.components.converters import PyPDFToDocument, MarkdownToDocument, TextFileToDocument, DOCXToDocument
+from haystack.dataclasses import ByteStream
+
+logger = logging.getLogger(__name__)
+
+
+def file_fingerprint(source: Union[str, Path, ByteStream]) -> str:
+  hasher = hashlib.sha256()
+  if isinstance(source, ByteStream):
+    hasher.update(source.data)
+  else:
+    with open(source, 'rb') as handle:
+      for block in iter(lambda: handle.read(1 << 20), b''):
+        hasher.update(block)
+  return hasher.hexdigest()
+
+
+def chunk_fingerprint(content: str) -> str:
+  return hashlib.sha256((content or '').encode('utf-8')).hexdigest()
+
+
+def chunk_id(source_file: str, chunk_hash: str) -> str:
+  # Same file + same chunk text always maps to the same id, so re-runs overwrite instead of duplicating
+  return hashlib.sha256(f"{source_file}\x00{chunk_hash}".encode('utf-8')).hexdigest()
+
+
+def source_name(source: Union[str, Path, ByteStream]) -> str:
+  if isinstance(source, ByteStream):
+    return Path(str(source.meta.get('file_path', ''))).name
+  return Path(source).name
+
+
+# PineconeDocumentStore.filter_documents returns at most this many documents
+FILTER_PAGE_SIZE = 1000
+
+
+def existing_chunks(document_store, source_file: str) -> List[Document]:
+  # A full page may hide more chunks, so the next page excludes the chunk hashes already seen. Pinecone takes at
+  # most 10,000 values in one `not in`, so a file with more chunks than that fails loudly instead of partially
+  by_source = {'field': 'meta.source_file', 'operator': '==', 'value': source_file}
+  chunks: Dict[str, Document] = {}
+  filters = by_source
+  while True:
+    page = document_store.filter_documents(filters=filters)
+    new = [doc for doc in page if doc.id not in chunks]
+    chunks.update((doc.id, doc) for doc in new)
+    if len(page) < FILTER_PAGE_SIZE:
+      return list(chunks.values())
+    if not new:
+      logger.warning("Could not read past %d chunks of %s, chunks without a chunk_hash can not be paged", len(chunks), source_file)
+      return list(chunks.values())
+    seen = [doc.meta['chunk_hash'] for doc in chunks.values() if doc.meta.get('chunk_hash')]
+    filters = {'operator': 'AND', 'conditions': [by_source, {'field': 'meta.chunk_hash', 'operator': 'not in', 'value': seen}]}
+
+
+@component
+class SourceFingerprinter:
+  """
+  Hashes every source file and drops the ones whose chunks in the document store already carry the same hash.
+  Feed its outputs into FileTypeRouter's `sources` and `meta` so the fingerprint travels with each chunk.
+  """
+
+  def __init__(self, document_store):
+    self.document_store = document_store
+
+  @component.output_types(sources=List[Union[str, Path, ByteStream]], meta=List[Dict[str, Any]], skipped=List[str])
+  def run(self, sources: List[Union[str, Path, ByteStream]]):
+    changed, meta, skipped = [], [], []
+    for source in sources:
+      name = source_name(source)
+      source_hash = file_fingerprint(source)
+      stored = existing_chunks(self.document_store, name)
+      if stored and all(doc.meta.get('source_hash') == source_hash for doc in stored):
+        skipped.append(name)
+        continue
+      changed.append(source)
+      meta.append({'source_file': name, 'source_hash': source_hash})
+    return {'sources': changed, 'meta': meta, 'skipped': skipped}
+
+
+@component
+class IncrementalDocumentFilter:
+  """
+  Gives every chunk a deterministic id and compares the chunks of each changed file against the document store.
+  Only new chunk texts are sent on to be embedded; chunks that are still present keep their stored embedding
+  and are only rewritten to pick up the new file hash; chunks that disappeared are reported for deletion.
+  """
+
+  def __init__(self, document_store):
+    self.document_store = document_store
+
+  @component.output_types(documents=List[Document], unchanged=List[Document], stale_ids=List[str])
+  def run(self, documents: List[Document]):
+    by_source: Dict[str, Dict[str, Document]] = {}
+    for doc in documents:
+      source_file = doc.meta.get('source_file') or source_name(doc.meta.get('file_path', ''))
+      chunk_hash = chunk_fingerprint(doc.content)
+      doc_id = chunk_id(source_file, chunk_hash)
+      chunks = by_source.setdefault(source_file, {})
+      if doc_id in chunks:
+        continue
+      chunks[doc_id] = Document(id=doc_id, content=doc.content, meta={**doc.meta, 'source_file': source_file, 'chunk_hash': chunk_hash})
+
+    new_documents, unchanged, stale_ids = [], [], []
+    for source_file, chunks in by_source.items():
+      stored = {doc.id: doc for doc in existing_chunks(self.document_store, source_file)}
+      for doc_id, doc in chunks.items():
+        previous = stored.get(doc_id)
+        if previous is None or previous.embedding is None:
+          new_documents.append(doc)
+        elif previous.meta.get('source_hash') != doc.meta.get('source_hash'):
+          doc.embedding = previous.embedding
+          unchanged.append(doc)
+      stale_ids.extend(doc_id for doc_id in stored if doc_id not in chunks)
+    return {'documents': new_documents, 'unchanged': unchanged, 'stale_ids': stale_ids}
+
+
+@component
+class StaleDocumentRemover:
+  """
+  Deletes the chunks of changed files that are no longer produced. It waits for the writer so that
+  the index never loses a file's old chunks before the new ones are in.
+  """
+
+  def __init__(self, document_store):
+    self.document_store = document_store
+
+  @component.output_types(documents_deleted=int)
+  def run(self, document_ids: List[str], documents_written: int):
+    if document_ids:
+      self.document_store.delete_documents(document_ids=document_ids)
+    return {'documents_deleted': len(document_ids)}
+
+
+CONVERSION_WORKERS = int(os.getenv('CONVERSION_WORKERS', str(os.cpu_count() or 1)))
+# Workers are not forked from the app process, which has torch, the warm-up thread and upsert pools running
+CONVERSION_START_METHOD = os.getenv('CONVERSION_START_METHOD',
+                                    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+_converters = {}
+
+
+def _get_converter(kind: str):
+  # One converter per kind per worker process, built on first use
+  if kind not in _converters:
+    _converters[kind] = {'text': TextFileToDocument, 'markdown': MarkdownToDocument, 'pdf': PyPDFToDocument, 'docx': DOCXToDocument}[kind]()
+  return _converters[kind]
+
+
+def _convert_source(kind: str, source: Union[str, Path, ByteStream]):
+  try:
+    return _get_converter(kind).run(sources=[source])['documents'], None
+  except Exception as error:
+    return [], f"{type(error).__name__}: {error}"
+
+
+@component
+class ParallelFileConverter:
+  """
+  Converts the sources routed by FileTypeRouter in a process pool instead of one converter after the other.
+  Documents come out in a fixed order (text, markdown, pdf, docx, each in routed order) whatever order the
+  workers finish in, and a file that fails to convert is reported in `failed` instead of stopping the run.
+  The pool is shut down by `close()`, or when the converter is garbage collected or the process exits.
+  """
+
+  def __init__(self, max_workers: int = CONVERSION_WORKERS, mp_context: Optional[str] = CONVERSION_START_METHOD):
+    self.max_workers = max(1, max_workers)
+    self.mp_context = mp_context
+    self._executor = None
+    self._shutdown = None
+
+  def _pool(self):
+    if self._executor is None:
+      context = multiprocessing.get_context(self.mp_context) if self.mp_context else None
+      self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+      self._shutdown = weakref.finalize(self, self._executor.shutdown, wait=False, cancel_futures=True)
+    return self._executor
+
+  def close(self):
+    if self._shutdown is not None:
+      self._shutdown()
+    self._executor = self._shutdown = None
+
+  @component.output_types(documents=List[Document], failed=List[str])
+  def run(self, text_sources: Optional[List[Union[str, Path, ByteStream]]] = None,
+          markdown_sources: Optional[List[Union[str, Path, ByteStream]]] = None,
+          pdf_sources: Optional[List[Union[str, Path, ByteStream]]] = None,
+          docx_sources: Optional[List[Union[str, Path, ByteStream]]] = None):
+    jobs = [(kind, source) for kind, sources in (('text', text_sources), ('markdown', markdown_sources),
+                                                 ('pdf', pdf_sources), ('docx', docx_sources)) for source in sources or []]
+    if self.max_workers == 1 or len(jobs) < 2:
+      results = [_convert_source(kind, source) for kind, source in jobs]
+    else:
+      results = self._pool().map(_convert_source, [kind for kind, _ in jobs], [source for _, source in jobs])
+
+    documents, failed = [], []
+    for (kind, source), (docs, error) in zip(jobs, results):
+      if error is not None:
+        logger.warning("Could not convert %s: %s", source_name(source), error)
+        failed.append(source_name(source))
+      documents.extend(docs)
+    return {'documents': documents, 'failed': failed}
+
+
+INGEST_FILES_PER_BATCH = int(os.getenv('INGEST_FILES_PER_BATCH', '4'))
+INGEST_CHUNKS_PER_BATCH = int(os.getenv('INGEST_CHUNKS_PER_BATCH', '64'))
+
+CONVERTER_INPUTS = {'text/plain': 'text_sources', 'text/markdown': 'markdown_sources', 'application/pdf': 'pdf_sources',
+                    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'docx_sources'}
+
+
+def iter_batches(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+  iterator = iter(items)
+  while batch := list(islice(iterator, size)):
+    yield batch
+
+
+def stream_ingest(pipeline, sources: List[Union[str, Path, ByteStream]], files_per_batch: int = INGEST_FILES_PER_BATCH,
+                  chunks_per_batch: int = INGEST_CHUNKS_PER_BATCH, progress: Optional[Callable[..., Any]] = None) -> Dict[str, int]:
+  """
+  Runs the components of a preprocessing pipeline (router, parallel converter, cleaner, splitter, embedder, writer)
+  as a chain of generators. Files are pulled a few at a time and chunks are embedded and written in small batches,
+  and nothing is converted until the writer has caught up, so memory stays flat however many files are passed.
+  `progress` is called as progress(fraction, desc=...), which is what gr.Progress expects.
+  """
+  if not sources:
+    return {'files': 0, 'chunks': 0, 'documents_written': 0}
+  pipeline.warm_up()
+  router = pipeline.get_component('file_type_router')
+  converter = pipeline.get_component('parallel_converter')
+  cleaner = pipeline.get_component('document_cleaner')
+  splitter = pipeline.get_component('document_splitter')
+  embedder = pipeline.get_component('document_embedder')
+  writer = pipeline.get_component('document_writer')
+  counts = {'files': 0, 'chunks': 0, 'documents_written': 0}
+
+  def converted():
+    for batch in iter_batches(sources, files_per_batch):
+      routed = router.run(sources=batch)
+      inputs = {CONVERTER_INPUTS[mime]: routed_sources for mime, routed_sources in routed.items() if mime in CONVERTER_INPUTS}
+      documents = converter.run(**inputs)['documents']
+      counts['files'] += len(batch)
+      yield documents
+
+  def chunks():
+    for documents in converted():
+      if documents:
+        yield from splitter.run(documents=cleaner.run(documents=documents)['documents'])['documents']
+      if progress is not None:
+        progress(counts['files'] / len(sources), desc=f"Processed {counts['files']}/{len(sources)} files, {counts['chunks']} chunks")
+
+  for chunk_batch in iter_batches(chunks(), chunks_per_batch):
+    embedded = embedder.run(documents=chunk_batch)['documents']
+    counts['documents_written'] += writer.run(documents=embedded)['documents_written']
+    counts['chunks'] += len(chunk_batch)
+  return counts
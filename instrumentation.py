@@ -0,0 +1,263 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from haystack import tracing
+from haystack.tracing import Span, Tracer
+
+logger = logging.getLogger('pipeline_trace')
+
+# Off by default: without it no tracer is installed and pipelines run exactly as before
+PIPELINE_TRACING = os.getenv('PIPELINE_TRACING', 'false').lower() == 'true'
+# Prometheus metrics are served on http://0.0.0.0:METRICS_PORT/metrics, 0 keeps only the structured logs
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+  def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+    self.buckets = buckets
+    self.counts = [0] * len(buckets)
+    self.total = 0.0
+    self.count = 0
+
+  def observe(self, value: float):
+    for i, bound in enumerate(self.buckets):
+      if value <= bound:
+        self.counts[i] += 1
+    self.total += value
+    self.count += 1
+
+
+def _label(value: Any) -> str:
+  return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class PipelineMetrics:
+  """
+  Latency histograms and run, error and token counters per pipeline and component, rendered in the
+  Prometheus text exposition format.
+  """
+
+  def __init__(self):
+    self.component_latency: Dict[Tuple[str, str], Histogram] = {}
+    self.pipeline_latency: Dict[str, Histogram] = {}
+    self.errors: Dict[Tuple[str, str], int] = {}
+    self.tokens: Dict[Tuple[str, str, str], int] = {}
+    self._lock = threading.Lock()
+
+  def observe_component(self, pipeline: str, component: str, seconds: float, error: bool, tokens: Dict[str, int]):
+    key = (pipeline, component)
+    with self._lock:
+      self.component_latency.setdefault(key, Histogram()).observe(seconds)
+      if error:
+        self.errors[key] = self.errors.get(key, 0) + 1
+      for kind, count in tokens.items():
+        self.tokens[key + (kind,)] = self.tokens.get(key + (kind,), 0) + count
+
+  def observe_pipeline(self, pipeline: str, seconds: float):
+    with self._lock:
+      self.pipeline_latency.setdefault(pipeline, Histogram()).observe(seconds)
+
+  @staticmethod
+  def _histogram(name: str, labels: str, histogram: Histogram) -> List[str]:
+    lines = [f'{name}_bucket{{{labels},le="{bound}"}} {count}' for bound, count in zip(histogram.buckets, histogram.counts)]
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f'{name}_sum{{{labels}}} {histogram.total}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+    return lines
+
+  def render(self) -> str:
+    with self._lock:
+      lines = ['# HELP haystack_pipeline_duration_seconds Wall time of pipeline runs.',
+               '# TYPE haystack_pipeline_duration_seconds histogram']
+      for pipeline, histogram in sorted(self.pipeline_latency.items()):
+        lines += self._histogram('haystack_pipeline_duration_seconds', f'pipeline="{_label(pipeline)}"', histogram)
+      lines += ['# HELP haystack_component_duration_seconds Wall time of component runs.',
+                '# TYPE haystack_component_duration_seconds histogram']
+      for (pipeline, component), histogram in sorted(self.component_latency.items()):
+        lines += self._histogram('haystack_component_duration_seconds',
+                                 f'pipeline="{_label(pipeline)}",component="{_label(component)}"', histogram)
+      lines += ['# HELP haystack_component_errors_total Component runs that raised.',
+                '# TYPE haystack_component_errors_total counter']
+      for (pipeline, component), count in sorted(self.errors.items()):
+        lines.append(f'haystack_component_errors_total{{pipeline="{_label(pipeline)}",component="{_label(component)}"}} {count}')
+      lines += ['# HELP haystack_component_tokens_total Prompt and reply tokens reported by generators.',
+                '# TYPE haystack_component_tokens_total counter']
+      for (pipeline, component, kind), count in sorted(self.tokens.items()):
+        lines.append(f'haystack_component_tokens_total{{pipeline="{_label(pipeline)}",component="{_label(component)}",kind="{kind}"}} {count}')
+      return '\n'.join(lines) + '\n'
+
+
+metrics = PipelineMetrics()
+
+
+def sizes(data: Optional[Dict[str, Any]]) -> Dict[str, int]:
+  # Lists count their items (documents, messages, replies), strings their characters, ints are kept as they are
+  result = {}
+  for key, value in (data or {}).items():
+    if isinstance(value, bool):
+      continue
+    if isinstance(value, int):
+      result[key] = value
+    elif isinstance(value, (list, tuple, dict, str)):
+      result[key] = len(value)
+  return result
+
+
+def token_usage(outputs: Optional[Dict[str, Any]]) -> Dict[str, int]:
+  """
+  Prompt and reply tokens from the usage the generators report, either in a `meta` output (text generators)
+  or in the meta of the returned ChatMessages.
+  """
+  usages = []
+  for meta in (outputs or {}).get('meta') or []:
+    if isinstance(meta, dict):
+      usages.append(meta.get('usage'))
+  for reply in (outputs or {}).get('replies') or []:
+    usages.append(getattr(reply, 'meta', {}).get('usage') if hasattr(reply, 'meta') else None)
+
+  tokens = {}
+  for usage in usages:
+    if not isinstance(usage, dict):
+      continue
+    for kind, keys in (('prompt', ('prompt_tokens', 'input_tokens')), ('reply', ('completion_tokens', 'output_tokens'))):
+      count = next((usage[key] for key in keys if isinstance(usage.get(key), (int, float))), None)
+      if count is not None:
+        tokens[kind] = tokens.get(kind, 0) + int(count)
+  return tokens
+
+
+class TimedSpan(Span):
+  def __init__(self, operation_name: str, tags: Optional[Dict[str, Any]], parent: Optional['TimedSpan']):
+    self.operation_name = operation_name
+    self.tags = dict(tags or {})
+    self.parent = parent
+    self.inputs: Dict[str, int] = {}
+    self.outputs: Dict[str, int] = {}
+    self.tokens: Dict[str, int] = {}
+    metadata = self.tags.get('haystack.pipeline.metadata') or {}
+    self.pipeline = metadata.get('name') if isinstance(metadata, dict) and metadata.get('name') else \
+      (parent.pipeline if parent is not None else 'pipeline')
+    self.run_id = parent.run_id if parent is not None else uuid.uuid4().hex[:12]
+
+  def set_tag(self, key: str, value: Any) -> None:
+    self.tags[key] = value
+
+  def set_content_tag(self, key: str, value: Any) -> None:
+    # Only sizes and token usage are kept, never the content itself
+    if key == 'haystack.component.input':
+      self.inputs = sizes(value)
+    elif key == 'haystack.component.output':
+      self.outputs = sizes(value)
+      self.tokens = token_usage(value)
+
+  def raw_span(self) -> Any:
+    return self
+
+
+class PipelineTracer(Tracer):
+  """
+  Haystack tracer that times every pipeline and component run. Each run is logged as one JSON line on the
+  `pipeline_trace` logger (wall time, input/output sizes, token usage, error) and recorded in `metrics`.
+  """
+
+  def __init__(self, pipeline_metrics: PipelineMetrics = metrics):
+    self.metrics = pipeline_metrics
+    self._current: ContextVar[Optional[TimedSpan]] = ContextVar('pipeline_trace_span', default=None)
+
+  @contextlib.contextmanager
+  def trace(self, operation_name: str, tags: Optional[Dict[str, Any]] = None,
+            parent_span: Optional[Span] = None) -> Iterator[Span]:
+    parent = parent_span if isinstance(parent_span, TimedSpan) else self._current.get()
+    span = TimedSpan(operation_name, tags, parent)
+    token = self._current.set(span)
+    error = None
+    start = time.perf_counter()
+    try:
+      yield span
+    except Exception as exception:
+      error = f"{type(exception).__name__}: {exception}"
+      raise
+    finally:
+      seconds = time.perf_counter() - start
+      self._current.reset(token)
+      self._record(span, seconds, error)
+
+  def _record(self, span: TimedSpan, seconds: float, error: Optional[str]):
+    if span.operation_name == 'haystack.component.run':
+      component = span.tags.get('haystack.component.name', 'unknown')
+      self.metrics.observe_component(span.pipeline, component, seconds, error is not None, span.tokens)
+      record = {'event': 'component_run', 'pipeline': span.pipeline, 'run_id': span.run_id, 'component': component,
+                'type': span.tags.get('haystack.component.type'), 'seconds': round(seconds, 6),
+                'inputs': span.inputs, 'outputs': span.outputs, 'tokens': span.tokens, 'error': error}
+    elif span.operation_name == 'haystack.pipeline.run':
+      self.metrics.observe_pipeline(span.pipeline, seconds)
+      record = {'event': 'pipeline_run', 'pipeline': span.pipeline, 'run_id': span.run_id,
+                'seconds': round(seconds, 6), 'error': error}
+    else:
+      return
+    if error is not None:
+      logger.warning(json.dumps(record))
+    elif logger.isEnabledFor(logging.INFO):
+      logger.info(json.dumps(record))
+
+  def current_span(self) -> Optional[Span]:
+    return self._current.get()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path.split('?')[0] != '/metrics':
+      self.send_error(404)
+      return
+    body = metrics.render().encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+_enabled = False
+_enable_lock = threading.Lock()
+
+
+def enable(port: int = METRICS_PORT) -> bool:
+  """
+  Installs the PipelineTracer for every Haystack pipeline in the process and starts the metrics endpoint.
+  Safe to call more than once, e.g. from Streamlit pages that are re-run on every interaction.
+  """
+  global _enabled
+  with _enable_lock:
+    if _enabled:
+      return False
+    tracing.enable_tracing(PipelineTracer())
+    if not logger.handlers:
+      handler = logging.StreamHandler()
+      handler.setFormatter(logging.Formatter('%(message)s'))
+      logger.addHandler(handler)
+      logger.setLevel(logging.INFO)
+    if port:
+      try:
+        server = ThreadingHTTPServer(('0.0.0.0', port), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+      except OSError as error:
+        logger.warning("Could not serve metrics on port %d: %s", port, error)
+    _enabled = True
+    return True
+
+
+def enable_from_env() -> bool:
+  return enable() if PIPELINE_TRACING else False
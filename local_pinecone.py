@@ -0,0 +1,270 @@
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from haystack.utils import Secret
+from haystack_integrations.document_stores.pinecone import PineconeDocumentStore
+
+from vector_index import EmbeddingIndex
+
+
+# 'pinecone' for the hosted service, 'local' for the in-process NumPy stand-in (no account or network needed)
+PINECONE_BACKEND = os.getenv('PINECONE_BACKEND', 'pinecone')
+# Simulated round trip per request, to make local runs behave like the remote service
+PINECONE_LOCAL_LATENCY_MS = float(os.getenv('PINECONE_LOCAL_LATENCY_MS', '0'))
+
+
+class Record(dict):
+  # Pinecone responses can be read both as dicts and through attributes, so can these
+  def __getattr__(self, name):
+    try:
+      return self[name]
+    except KeyError:
+      raise AttributeError(name) from None
+
+
+def _compare(value, operator: str, operand) -> bool:
+  values = value if isinstance(value, list) else [value]
+  if operator == '$eq':
+    return operand in values
+  if operator == '$ne':
+    return operand not in values
+  if operator == '$in':
+    return any(item in operand for item in values)
+  if operator == '$nin':
+    return not any(item in operand for item in values)
+  if operator == '$exists':
+    return (value is not None) == operand
+  if value is None or isinstance(value, list):
+    return False
+  if operator == '$gt':
+    return value > operand
+  if operator == '$gte':
+    return value >= operand
+  if operator == '$lt':
+    return value < operand
+  if operator == '$lte':
+    return value <= operand
+  raise ValueError(f"Unsupported filter operator {operator}")
+
+
+def matches_filter(metadata: Dict[str, Any], filter: Optional[Dict[str, Any]]) -> bool:
+  """
+  Evaluates a Pinecone metadata filter, e.g. {"$and": [{"genre": {"$in": ["a", "b"]}}, {"year": {"$gte": 2020}}]}.
+  A bare value is shorthand for $eq, and list-valued metadata matches when any of its items does.
+  """
+  for key, condition in (filter or {}).items():
+    if key == '$and':
+      if not all(matches_filter(metadata, part) for part in condition):
+        return False
+    elif key == '$or':
+      if not any(matches_filter(metadata, part) for part in condition):
+        return False
+    elif isinstance(condition, dict):
+      if not all(_compare(metadata.get(key), operator, operand) for operator, operand in condition.items()):
+        return False
+    elif not _compare(metadata.get(key), '$eq', condition):
+      return False
+  return True
+
+
+def _as_vector(item) -> tuple:
+  if isinstance(item, dict):
+    return item['id'], item['values'], item.get('metadata') or {}
+  return item[0], item[1], (item[2] if len(item) > 2 else {}) or {}
+
+
+class LocalPineconeIndex:
+  """
+  In-process stand-in for a Pinecone index with the data-plane calls the app uses: upsert, query, fetch,
+  delete and describe_index_stats. Each namespace keeps its vectors in an EmbeddingIndex (cosine only) and
+  the raw values and metadata in a dict. Every request first sleeps `latency` seconds, +/- `jitter`.
+  """
+
+  def __init__(self, name: str, dimension: int, metric: str = 'cosine', latency: float = 0.0, jitter: float = 0.2):
+    if metric != 'cosine':
+      raise ValueError(f"The local Pinecone backend only supports the cosine metric, not {metric}")
+    self.name = name
+    self.dimension = dimension
+    self.metric = metric
+    self.latency = latency
+    self.jitter = jitter
+    self.requests = 0
+    self._namespaces: Dict[str, tuple] = {}
+    self._lock = threading.RLock()
+
+  def _round_trip(self):
+    with self._lock:
+      self.requests += 1
+    if self.latency > 0:
+      time.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+  def _namespace(self, namespace: Optional[str], create: bool = False):
+    namespace = namespace or ''
+    with self._lock:
+      if namespace not in self._namespaces and create:
+        self._namespaces[namespace] = (EmbeddingIndex(dim=self.dimension), {})
+      return self._namespaces.get(namespace)
+
+  def upsert(self, vectors: List[Any], namespace: Optional[str] = None, batch_size: Optional[int] = None, **kwargs):
+    vectors = [_as_vector(item) for item in vectors]
+    batch_size = batch_size or len(vectors) or 1
+    upserted = 0
+    for start in range(0, len(vectors), batch_size):
+      batch = vectors[start:start + batch_size]
+      self._round_trip()
+      for _, values, _ in batch:
+        if len(values) != self.dimension:
+          raise ValueError(f"Vector dimension {len(values)} does not match the dimension of the index {self.dimension}")
+      with self._lock:
+        embeddings, records = self._namespace(namespace, create=True)
+        embeddings.add([doc_id for doc_id, _, _ in batch], [values for _, values, _ in batch])
+        for doc_id, values, metadata in batch:
+          records[doc_id] = (list(values), dict(metadata))
+      upserted += len(batch)
+    return Record(upserted_count=upserted)
+
+  def _matches(self, records, hits, include_values: bool, include_metadata: bool) -> List[Record]:
+    return [Record(id=doc_id, score=score, values=list(records[doc_id][0]) if include_values else [],
+                   metadata=dict(records[doc_id][1]) if include_metadata else None) for doc_id, score in hits]
+
+  def query(self, vector: Optional[List[float]] = None, id: Optional[str] = None, top_k: int = 10,
+            namespace: Optional[str] = None, filter: Optional[Dict[str, Any]] = None, include_values: bool = False,
+            include_metadata: bool = False, **kwargs):
+    return self.query_many([vector], top_k=top_k, namespace=namespace, filter=filter, include_values=include_values,
+                           include_metadata=include_metadata, ids=[id] if id else None)[0]
+
+  def query_many(self, vectors: List[List[float]], top_k: int = 10, namespace: Optional[str] = None,
+                 filter: Optional[Dict[str, Any]] = None, include_values: bool = False, include_metadata: bool = False,
+                 ids: Optional[List[Optional[str]]] = None) -> List[Record]:
+    """
+    Answers several queries in one round trip and, without a filter, one matrix product.
+    """
+    self._round_trip()
+    with self._lock:
+      found = self._namespace(namespace)
+      if found is None:
+        return [Record(matches=[], namespace=namespace or '') for _ in vectors]
+      embeddings, records = found
+      if ids and any(ids):
+        vectors = [records[doc_id][0] if doc_id in records else vector for doc_id, vector in zip(ids, vectors)]
+      if filter:
+        candidates = [doc_id for doc_id, (_, metadata) in records.items() if matches_filter(metadata, filter)]
+        hits = [embeddings.search_ids(vector, candidates, top_k) for vector in vectors]
+      else:
+        hits = embeddings.search(vectors, top_k)
+      return [Record(matches=self._matches(records, query_hits, include_values, include_metadata), namespace=namespace or '')
+              for query_hits in hits]
+
+  def fetch(self, ids: List[str], namespace: Optional[str] = None, **kwargs):
+    self._round_trip()
+    with self._lock:
+      found = self._namespace(namespace)
+      records = found[1] if found else {}
+      vectors = {doc_id: Record(id=doc_id, values=list(records[doc_id][0]), metadata=dict(records[doc_id][1]))
+                 for doc_id in ids if doc_id in records}
+    return Record(vectors=vectors, namespace=namespace or '')
+
+  def delete(self, ids: Optional[Iterable[str]] = None, delete_all: bool = False, namespace: Optional[str] = None,
+             filter: Optional[Dict[str, Any]] = None, **kwargs):
+    self._round_trip()
+    with self._lock:
+      found = self._namespace(namespace)
+      if found is None:
+        return Record()
+      embeddings, records = found
+      if delete_all:
+        del self._namespaces[namespace or '']
+        return Record()
+      if filter:
+        ids = [doc_id for doc_id, (_, metadata) in records.items() if matches_filter(metadata, filter)]
+      ids = list(ids or [])
+      embeddings.remove(ids)
+      for doc_id in ids:
+        records.pop(doc_id, None)
+    return Record()
+
+  def describe_index_stats(self, **kwargs):
+    self._round_trip()
+    with self._lock:
+      namespaces = Record({name: Record(vector_count=len(records)) for name, (_, records) in self._namespaces.items()})
+    return Record(dimension=self.dimension, index_fullness=0.0, namespaces=namespaces,
+                  total_vector_count=sum(summary.vector_count for summary in namespaces.values()))
+
+
+class IndexList(list):
+  def names(self) -> List[str]:
+    return [item['name'] for item in self]
+
+
+class LocalPinecone:
+  """
+  Stand-in for the Pinecone client: indexes live in this process and are shared by every caller.
+  """
+
+  _indexes: Dict[str, LocalPineconeIndex] = {}
+  _lock = threading.Lock()
+
+  def __init__(self, api_key: Optional[str] = None, latency: float = PINECONE_LOCAL_LATENCY_MS / 1000, **kwargs):
+    self.latency = latency
+
+  def create_index(self, name: str, dimension: int, metric: str = 'cosine', spec=None, **kwargs) -> LocalPineconeIndex:
+    with self._lock:
+      if name not in self._indexes:
+        self._indexes[name] = LocalPineconeIndex(name, dimension, metric, latency=self.latency)
+      return self._indexes[name]
+
+  def delete_index(self, name: str, **kwargs):
+    with self._lock:
+      self._indexes.pop(name, None)
+
+  def has_index(self, name: str) -> bool:
+    return name in self._indexes
+
+  def list_indexes(self) -> IndexList:
+    with self._lock:
+      return IndexList(Record(name=index.name, dimension=index.dimension, metric=index.metric, host=f"local://{index.name}")
+                       for index in self._indexes.values())
+
+  def Index(self, name: Optional[str] = None, host: Optional[str] = None, **kwargs) -> LocalPineconeIndex:
+    name = name or (host or '').replace('local://', '')
+    if name not in self._indexes:
+      raise KeyError(f"Index {name} does not exist")
+    return self._indexes[name]
+
+
+class LocalPineconeDocumentStore(PineconeDocumentStore):
+  """
+  PineconeDocumentStore backed by a LocalPineconeIndex, so the Pinecone pipelines and retrievers run unchanged
+  without an account or network. The index is created on first use, like the hosted one.
+  """
+
+  is_local = True
+
+  def __init__(self, *, latency: float = PINECONE_LOCAL_LATENCY_MS / 1000, **kwargs):
+    kwargs.setdefault('api_key', Secret.from_env_var('PINECONE_API_KEY', strict=False))
+    super().__init__(**kwargs)
+    self.latency = latency
+
+  @property
+  def index(self):
+    if self._index is None:
+      self._index = LocalPinecone(latency=self.latency).create_index(self.index_name, self.dimension, self.metric)
+      self._dummy_vector = [-10.0] * self.dimension
+    return self._index
+
+
+def pinecone_client(api_key: Optional[str] = None):
+  if PINECONE_BACKEND == 'local':
+    return LocalPinecone()
+  from pinecone.grpc import PineconeGRPC
+  return PineconeGRPC(api_key=api_key or os.getenv('PINECONE_API_KEY'))
+
+
+def pinecone_document_store(**kwargs) -> PineconeDocumentStore:
+  # PINECONE_BACKEND picks the hosted service or the local stand-in, the arguments are the same
+  if PINECONE_BACKEND == 'local':
+    return LocalPineconeDocumentStore(**kwargs)
+  return PineconeDocumentStore(**kwargs)
@@ -1,33 +1,66 @@
 import gradio as gr
-from module import preprocessing_pipeline, conversational_rag
-from module import system_message, user_message
-from haystack.dataclasses import ChatMessage
-import time
+import module
+import queue
+import threading
+import os
+
+# Streaming ingestion keeps memory flat on large uploads, set STREAMING_INGESTION=false for a single pipeline run
+STREAMING_INGESTION = os.getenv('STREAMING_INGESTION', 'true').lower() == 'true'
 
 
 def process_files_into_docs(pdf_files,progress=gr.Progress()):
-  preprocessing_pipeline.run({'file_type_router': {'sources': pdf_files}})
+  from ingestion import stream_ingest
+
+  preprocessing_pipeline = module.get_preprocessing_pipeline()
+  if STREAMING_INGESTION:
+    stream_ingest(preprocessing_pipeline, pdf_files, progress=progress)
+  else:
+    preprocessing_pipeline.run({'file_type_router': {'sources': pdf_files}})
+  module.save_document_store()
   return "Database created🤗🤗"
 
 
-def rag(history,question):
+def model_status():
+  if module.is_ready():
+    return "Models loaded ✅"
+  error = module.warm_up_error()
+  return f"Loading models failed ❌ ({error})" if error else "Loading models... ⏳"
+
+
+def clear_memory(request: gr.Request):
+  if request:
+    module.clear_session(request.session_hash)
+
+
+def rag(history,question,request: gr.Request):
 
   if history is None:
     history=[]
-  messages = [system_message, user_message]
-  res = conversational_rag.run(
-      data = {'query_rephrase_prompt_builder' : {'query': question},
-              'prompt_builder': {'template': messages, 'query': question},
-              'memory_joiner': {'values': [ChatMessage.from_user(question)]}},
-      include_outputs_from=['llm','query_rephrase_llm'])
+  # Each browser session gets its own chat memory
+  session_id = request.session_hash if request else None
+
+  # The pipeline runs on a worker thread and the LLM's streaming callback feeds token_queue, None marks the end
+  token_queue = queue.Queue()
+  result = {}
 
-  bot_message = res['llm']['replies'][0].text
+  def run():
+    try:
+      result['res'] = module.chat(question, token_queue, session_id)
+    except Exception as error:
+      result['error'] = error
+    finally:
+      token_queue.put(None)
+
+  threading.Thread(target=run, daemon=True).start()
 
   streamed_message = ""
-  for token in bot_message.split():
-    streamed_message += f"{token} "
-    yield history + [(question, streamed_message.strip())], " " 
-    time.sleep(0.05)
+  while (token := token_queue.get()) is not None:
+    streamed_message += token
+    yield history + [(question, streamed_message)], " "
+
+  if 'error' in result:
+    raise result['error']
+  bot_message = result['res']['llm']['replies'][0].text
 
   history.append((question,bot_message))
 
@@ -37,6 +70,7 @@ def rag(history,question):
 with gr.Blocks(theme=gr.themes.Soft(font=gr.themes.GoogleFont('Open Sans')))as demo:
   
   gr.HTML("<center><h1>TalkToFiles - Query your documents! 📂📄</h1><center>") 
+  status = gr.Markdown(model_status, every=2)
   gr.Markdown("""##### This AI chatbot🤖 can help you chat with your documents. Can upload <b>Text(.txt), PDF(.pdf) and Markdown(.md)</b> files.\
               <b>Please do not upload confidential documents.</b>""")
   with gr.Row():
@@ -62,9 +96,14 @@ with gr.Blocks(theme=gr.themes.Soft(font=gr.themes.GoogleFont('Open Sans')))as d
         submit_button = gr.Button("Submit")
         clear_btn = gr.ClearButton([user_input, chatbot], value='Clear')
         submit_button.click(rag, inputs=[chatbot, user_input], outputs=[chatbot, user_input])
+        clear_btn.click(clear_memory, inputs=None, outputs=None)
 
 
-demo.launch()
+# Guarded, the conversion workers import this module again when they start
+if __name__ == '__main__':
+  if module.WARM_UP_ON_START:
+    module.start_warm_up()
+  demo.launch()
 
 
 
@@ -1,95 +1,41 @@
-
-from itertools import chain
-from typing import Any, List
-
-from haystack.components.converters import PyPDFToDocument, MarkdownToDocument, TextFileToDocument, OutputAdapter, DOCXToDocument
-from haystack.components.routers import FileTypeRouter
-from haystack.components.joiners import DocumentJoiner
-from haystack.components.preprocessors import DocumentCleaner, DocumentSplitter
-from haystack.components.embedders import SentenceTransformersDocumentEmbedder
-from haystack.components.writers import DocumentWriter
-from haystack.components.builders import ChatPromptBuilder, PromptBuilder
-from haystack.components.retrievers.in_memory import InMemoryBM25Retriever
-from haystack.document_stores.in_memory import InMemoryDocumentStore
-from haystack.core.component.types import Variadic
-
-from haystack_experimental.chat_message_stores.in_memory import InMemoryChatMessageStore
-from haystack_experimental.components.retrievers import ChatMessageRetriever
-from haystack_experimental.components.writers import ChatMessageWriter
-from haystack_integrations.components.generators.cohere import CohereChatGenerator, CohereGenerator
-
-
-from haystack.dataclasses import ChatMessage
-from haystack import Pipeline
-from haystack import component
-
+import logging
 import os
+import threading
 from dotenv import load_dotenv
 
 # Load .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Access the API key
 os.environ["COHERE_API_KEY"] = os.getenv('COHERE_API_KEY')
 
-
-document_store = InMemoryDocumentStore()
-file_type_router = FileTypeRouter(mime_types=['text/plain','application/pdf','text/markdown', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'])
-pdf_converter = PyPDFToDocument()
-text_file_converter = TextFileToDocument()
-markdown_converter = MarkdownToDocument()
-docx_converter = DOCXToDocument()
-document_joiner = DocumentJoiner()
-document_cleaner = DocumentCleaner()
-document_splitter = DocumentSplitter(split_by='word', split_overlap=50)
-document_embedder = SentenceTransformersDocumentEmbedder(model="sentence-transformers/all-MiniLM-L12-v2")
-document_writer = DocumentWriter(document_store)
-
-
-preprocessing_pipeline = Pipeline()
-
-
-# Adding Componenets
-preprocessing_pipeline.add_component('file_type_router', file_type_router)
-preprocessing_pipeline.add_component('text_file_converter', text_file_converter)
-preprocessing_pipeline.add_component('markdown_converter', markdown_converter)
-preprocessing_pipeline.add_component('pdf_converter', pdf_converter)
-preprocessing_pipeline.add_component('docx_converter', docx_converter)
-preprocessing_pipeline.add_component('document_joiner', document_joiner)
-preprocessing_pipeline.add_component('document_cleaner', document_cleaner)
-preprocessing_pipeline.add_component('document_splitter', document_splitter)
-preprocessing_pipeline.add_component('document_embedder', document_embedder)
-preprocessing_pipeline.add_component('document_writer', document_writer)
-
-
-# Connections
-
-preprocessing_pipeline.connect('file_type_router.text/plain', 'text_file_converter.sources')
-preprocessing_pipeline.connect('file_type_router.application/pdf', 'pdf_converter.sources')
-preprocessing_pipeline.connect('file_type_router.text/markdown', 'markdown_converter.sources')
-preprocessing_pipeline.connect('file_type_router.application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'docx_converter.sources')
-preprocessing_pipeline.connect('text_file_converter', 'document_joiner')
-preprocessing_pipeline.connect('markdown_converter', 'document_joiner')
-preprocessing_pipeline.connect('pdf_converter', 'document_joiner')
-preprocessing_pipeline.connect('docx_converter', 'document_joiner')
-preprocessing_pipeline.connect('document_joiner', 'document_cleaner')
-preprocessing_pipeline.connect('document_cleaner', 'document_splitter')
-preprocessing_pipeline.connect('document_splitter', 'document_embedder')
-preprocessing_pipeline.connect('document_embedder', 'document_writer')
+# Haystack, the Cohere integrations and sentence-transformers are only imported when a pipeline is first needed,
+# so importing this module is cheap and the UI can come up before the models are loaded.
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L12-v2"
+WARM_UP_ON_START = os.getenv('WARM_UP_ON_START', 'true').lower() == 'true'
+# Retrieve for the original query while it is being rephrased, and keep the result if the rewrite barely changed it
+SPECULATIVE_RETRIEVAL = os.getenv('SPECULATIVE_RETRIEVAL', 'false').lower() == 'true'
+# 'bm25' or 'embedding', the latter searches the chunk embeddings through the store's NumPy index
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'bm25')
+# Approximate (IVF) search once the store holds IVF_MIN_SIZE embeddings
+APPROXIMATE_SEARCH = os.getenv('APPROXIMATE_SEARCH', 'false').lower() == 'true'
+# 'int8' or 'binary' keeps only quantized codes in RAM and rescores a shortlist exactly, empty for float32
+EMBEDDING_QUANTIZATION = os.getenv('EMBEDDING_QUANTIZATION') or None
+# Shortlist size for the exact rescoring, times top_k; unset uses 4 for int8 and 10 for binary (see vector_index.py)
+EMBEDDING_RESCORE_MULTIPLIER = int(os.getenv('EMBEDDING_RESCORE_MULTIPLIER', '0')) or None
+# Embedding inference per pipeline: 'torch', 'onnx' or 'onnx-int8' (see embedding.py), EMBEDDING_BACKEND sets both
+INGEST_EMBEDDING_BACKEND = os.getenv('INGEST_EMBEDDING_BACKEND', os.getenv('EMBEDDING_BACKEND', 'torch'))
+QUERY_EMBEDDING_BACKEND = os.getenv('QUERY_EMBEDDING_BACKEND', os.getenv('EMBEDDING_BACKEND', 'torch'))
+# The document store is restored from here on start and saved here after every ingestion
+STORE_SNAPSHOT_DIR = os.getenv('STORE_SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.store_snapshot'))
+STORE_SNAPSHOT_DTYPE = os.getenv('STORE_SNAPSHOT_DTYPE', 'float32')
+# Reuse the answer to an earlier, near-identical question over the same documents and history instead of calling
+# the LLM. Off by default, a hit returns an earlier answer rather than a fresh one
+ANSWER_CACHE = os.getenv('ANSWER_CACHE', 'false').lower() == 'true'
 
 
-@component
-class ListJoiner:
-  def __init__(self, _type: Any):
-    component.set_output_types(self, values=_type)
-
-  def run(self, values:Variadic[Any]):
-    result = list(chain(*values))
-    return {'values':result}
-  
-
-memory_store = InMemoryChatMessageStore()
-
 query_rephrase_template="""
         Rewrite the question for search while keeping its meaning and key terms intact.
         If the conversation history is empty, DO NOT change the query.
@@ -105,44 +51,9 @@ query_rephrase_template="""
         Rewritten Query:
 """
 
-
-conversational_rag = Pipeline()
-
-#Query rephrasing components
-conversational_rag.add_component("query_rephrase_prompt_builder",PromptBuilder(query_rephrase_template))
-conversational_rag.add_component('query_rephrase_llm',CohereGenerator())
-conversational_rag.add_component('list_to_str_adapter', OutputAdapter(template="{{ replies[0] }}", output_type=str))
-
-#RAG components
-conversational_rag.add_component('retriever', InMemoryBM25Retriever(document_store=document_store, top_k=3))
-conversational_rag.add_component('prompt_builder', ChatPromptBuilder(variables=["query", "documents", "memories"],required_variables=['query', 'documents', 'memories']))
-conversational_rag.add_component('llm', CohereChatGenerator())
-
-#Memory components
-conversational_rag.add_component('memory_retriever',ChatMessageRetriever(memory_store))
-conversational_rag.add_component('memory_writer', ChatMessageWriter(memory_store))
-conversational_rag.add_component('memory_joiner', ListJoiner(List[ChatMessage]))
-
-
-#Query Rephrasing Connections
-conversational_rag.connect('memory_retriever', 'query_rephrase_prompt_builder.memories')
-conversational_rag.connect('query_rephrase_prompt_builder.prompt', 'query_rephrase_llm' )
-conversational_rag.connect('query_rephrase_llm.replies', 'list_to_str_adapter')
-conversational_rag.connect('list_to_str_adapter', 'retriever.query')
-
-#RAG connections
-conversational_rag.connect('retriever.documents', 'prompt_builder.documents')
-conversational_rag.connect('prompt_builder.prompt', 'llm.messages')
-conversational_rag.connect('llm.replies', 'memory_joiner')
-
-#Memory Connections
-conversational_rag.connect('memory_joiner','memory_writer')
-conversational_rag.connect('memory_retriever','prompt_builder.memories')
-
-
-system_message = ChatMessage.from_system("""You are an intelligent and cheerful AI assistant specialized in assisting humans with queries based on provided supporting documents and conversation history. 
+system_prompt = """You are an intelligent and cheerful AI assistant specialized in assisting humans with queries based on provided supporting documents and conversation history. 
                                          Always prioritize accurate and concise answers derived from the documents, and offer contextually relevant follow-up questions to maintain an engaging and helpful conversation. 
-                                         If the answer is not present in the documents, politely inform the user while suggesting alternative ways to help""")
+                                         If the answer is not present in the documents, politely inform the user while suggesting alternative ways to help"""
 
 user_message_template ="""Based on the conversation history and the provided supporting documents, provide a brief and accurate answer to the question.
                           Make the conversation feel more natural and engaging
@@ -165,5 +76,359 @@ Question: {{ query }}
 Answer:
 
 """
-user_message = ChatMessage.from_user(user_message_template)
 
+
+_lock = threading.RLock()
+_ready = threading.Event()
+# Set when the warm-up has finished, whether it succeeded or not; a failure is kept in _warm_up_error
+_warmed_up = threading.Event()
+_warm_up_error = None
+_built = {}
+_streams = threading.local()
+
+
+def _stream_token(chunk):
+  # The chat generator is built once, so tokens are routed to whichever queue the running thread registered
+  token_queue = getattr(_streams, 'queue', None)
+  if token_queue is not None:
+    token_queue.put(chunk.content)
+
+
+def _get(name, build):
+  # Build each shared object once, even when the warm-up thread and a request ask for it at the same time
+  if name not in _built:
+    with _lock:
+      if name not in _built:
+        _built[name] = build()
+  return _built[name]
+
+
+def _instrument():
+  # Installs the pipeline tracer once, a no-op unless PIPELINE_TRACING=true
+  from instrumentation import enable_from_env
+  enable_from_env()
+
+
+def _build_preprocessing_pipeline():
+  from haystack.components.routers import FileTypeRouter
+  from haystack.components.joiners import DocumentJoiner
+  from haystack.components.preprocessors import DocumentCleaner, DocumentSplitter
+  from haystack.components.writers import DocumentWriter
+  from haystack.document_stores.types import DuplicatePolicy
+  from haystack import Pipeline
+
+  from embedding import CachedDocumentEmbedder
+  from ingestion import ParallelFileConverter
+
+  _instrument()
+  document_store = get_document_store()
+  file_type_router = FileTypeRouter(mime_types=['text/plain','application/pdf','text/markdown', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'])
+  parallel_converter = ParallelFileConverter()
+  document_joiner = DocumentJoiner()
+  document_cleaner = DocumentCleaner()
+  document_splitter = DocumentSplitter(split_by='word', split_overlap=50)
+  document_embedder = CachedDocumentEmbedder(model=EMBEDDING_MODEL, backend=INGEST_EMBEDDING_BACKEND)
+  # The store may be restored from a snapshot that already holds these chunks, re-uploads replace them
+  document_writer = DocumentWriter(document_store, policy=DuplicatePolicy.OVERWRITE)
+
+
+  preprocessing_pipeline = Pipeline(metadata={'name': 'preprocessing'})
+
+
+  # Adding Componenets
+  preprocessing_pipeline.add_component('file_type_router', file_type_router)
+  preprocessing_pipeline.add_component('parallel_converter', parallel_converter)
+  preprocessing_pipeline.add_component('document_joiner', document_joiner)
+  preprocessing_pipeline.add_component('document_cleaner', document_cleaner)
+  preprocessing_pipeline.add_component('document_splitter', document_splitter)
+  preprocessing_pipeline.add_component('document_embedder', document_embedder)
+  preprocessing_pipeline.add_component('document_writer', document_writer)
+
+
+  # Connections
+
+  preprocessing_pipeline.connect('file_type_router.text/plain', 'parallel_converter.text_sources')
+  preprocessing_pipeline.connect('file_type_router.application/pdf', 'parallel_converter.pdf_sources')
+  preprocessing_pipeline.connect('file_type_router.text/markdown', 'parallel_converter.markdown_sources')
+  preprocessing_pipeline.connect('file_type_router.application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'parallel_converter.docx_sources')
+  preprocessing_pipeline.connect('parallel_converter.documents', 'document_joiner')
+  preprocessing_pipeline.connect('document_joiner', 'document_cleaner')
+  preprocessing_pipeline.connect('document_cleaner', 'document_splitter')
+  preprocessing_pipeline.connect('document_splitter', 'document_embedder')
+  preprocessing_pipeline.connect('document_embedder', 'document_writer')
+
+  return preprocessing_pipeline
+
+
+def _build_conversational_rag():
+  from typing import List
+
+  from haystack.components.converters import OutputAdapter
+  from haystack.components.builders import ChatPromptBuilder, PromptBuilder
+  from haystack.components.retrievers.in_memory import InMemoryBM25Retriever, InMemoryEmbeddingRetriever
+  from haystack_experimental.components.retrievers import ChatMessageRetriever
+  from haystack_experimental.components.writers import ChatMessageWriter
+  from haystack_integrations.components.generators.cohere import CohereChatGenerator, CohereGenerator
+  from haystack.dataclasses import ChatMessage
+  from haystack import Pipeline
+
+  from components import ListJoiner, QueryRephraseRouter, QueryJoiner, RetrievalPrefetcher, SpeculativeRetriever
+  from components import MemoryBudget, DocumentBudget, PromptTokenCounter
+  from embedding import CachedTextEmbedder
+  from answer_cache import SemanticAnswerCache, SemanticCacheLookup, SemanticCacheWriter
+
+  _instrument()
+  document_store = get_document_store()
+  memory_store = get_memory_store()
+
+  conversational_rag = Pipeline(metadata={'name': 'conversational_rag'})
+
+  if RETRIEVAL_MODE == 'embedding':
+    retrieval_prefetcher = RetrievalPrefetcher(InMemoryEmbeddingRetriever(document_store=document_store, top_k=3),
+                                               text_embedder=CachedTextEmbedder(model=EMBEDDING_MODEL, backend=QUERY_EMBEDDING_BACKEND), enabled=SPECULATIVE_RETRIEVAL)
+  else:
+    retrieval_prefetcher = RetrievalPrefetcher(InMemoryBM25Retriever(document_store=document_store, top_k=3), enabled=SPECULATIVE_RETRIEVAL)
+
+  #Query rephrasing components
+  conversational_rag.add_component('retrieval_prefetcher', retrieval_prefetcher)
+  conversational_rag.add_component('query_rephrase_router', QueryRephraseRouter())
+  conversational_rag.add_component("query_rephrase_prompt_builder",PromptBuilder(query_rephrase_template, required_variables=['query']))
+  conversational_rag.add_component('query_rephrase_llm',CohereGenerator())
+  conversational_rag.add_component('list_to_str_adapter', OutputAdapter(template="{{ replies[0] }}", output_type=str))
+  conversational_rag.add_component('query_joiner', QueryJoiner())
+
+  #RAG components
+  conversational_rag.add_component('retriever', SpeculativeRetriever(retrieval_prefetcher))
+  conversational_rag.add_component('document_budget', DocumentBudget())
+  if ANSWER_CACHE:
+    answer_cache = SemanticAnswerCache(document_store)
+    conversational_rag.add_component('answer_cache', SemanticCacheLookup(answer_cache, CachedTextEmbedder(model=EMBEDDING_MODEL, backend=QUERY_EMBEDDING_BACKEND)))
+    conversational_rag.add_component('answer_cache_writer', SemanticCacheWriter(answer_cache))
+  conversational_rag.add_component('prompt_builder', ChatPromptBuilder(variables=["query", "documents", "memories"],required_variables=['query', 'documents', 'memories']))
+  conversational_rag.add_component('prompt_token_counter', PromptTokenCounter())
+  conversational_rag.add_component('llm', CohereChatGenerator(streaming_callback=_stream_token))
+
+  #Memory components
+  conversational_rag.add_component('memory_retriever',ChatMessageRetriever(memory_store))
+  conversational_rag.add_component('memory_budget', MemoryBudget())
+  conversational_rag.add_component('memory_writer', ChatMessageWriter(memory_store))
+  conversational_rag.add_component('memory_joiner', ListJoiner(List[ChatMessage]))
+
+
+  #Query Rephrasing Connections
+  conversational_rag.connect('retrieval_prefetcher.query', 'query_rephrase_router.query')
+  conversational_rag.connect('retrieval_prefetcher.ticket', 'retriever.ticket')
+  conversational_rag.connect('memory_retriever', 'memory_budget')
+  conversational_rag.connect('memory_budget.memories', 'query_rephrase_router.memories')
+  conversational_rag.connect('memory_budget.memories', 'query_rephrase_prompt_builder.memories')
+  conversational_rag.connect('query_rephrase_router.rephrase', 'query_rephrase_prompt_builder.query')
+  conversational_rag.connect('query_rephrase_prompt_builder.prompt', 'query_rephrase_llm' )
+  conversational_rag.connect('query_rephrase_llm.replies', 'list_to_str_adapter')
+  conversational_rag.connect('list_to_str_adapter', 'query_joiner')
+  conversational_rag.connect('query_rephrase_router.query', 'query_joiner')
+  conversational_rag.connect('query_joiner', 'retriever.query')
+
+  #RAG connections
+  conversational_rag.connect('retriever.documents', 'document_budget')
+  if ANSWER_CACHE:
+    # On a hit the cached replies go straight to memory, prompt_builder gets no documents and the LLM is skipped
+    conversational_rag.connect('query_joiner', 'answer_cache.query')
+    conversational_rag.connect('document_budget.documents', 'answer_cache.documents')
+    conversational_rag.connect('memory_budget.memories', 'answer_cache.memories')
+    conversational_rag.connect('answer_cache.documents', 'prompt_builder.documents')
+    conversational_rag.connect('answer_cache.replies', 'memory_joiner')
+    conversational_rag.connect('answer_cache.cache_key', 'answer_cache_writer.cache_key')
+    conversational_rag.connect('llm.replies', 'answer_cache_writer.replies')
+  else:
+    conversational_rag.connect('document_budget.documents', 'prompt_builder.documents')
+  conversational_rag.connect('prompt_builder.prompt', 'prompt_token_counter')
+  conversational_rag.connect('prompt_token_counter.prompt', 'llm.messages')
+  conversational_rag.connect('llm.replies', 'memory_joiner')
+
+  #Memory Connections
+  conversational_rag.connect('memory_joiner','memory_writer')
+  conversational_rag.connect('memory_budget.memories','prompt_builder.memories')
+
+  return conversational_rag
+
+
+def _build_batch_answerer():
+  from haystack.components.retrievers.in_memory import InMemoryBM25Retriever, InMemoryEmbeddingRetriever
+  from haystack_integrations.components.generators.cohere import CohereChatGenerator, CohereGenerator
+
+  from batch_qa import BatchQuestionAnswerer
+  from components import MemoryBudget, DocumentBudget
+
+  _instrument()
+  document_store = get_document_store()
+  if RETRIEVAL_MODE == 'embedding':
+    retriever, embedding_model = InMemoryEmbeddingRetriever(document_store=document_store, top_k=3), EMBEDDING_MODEL
+  else:
+    retriever, embedding_model = InMemoryBM25Retriever(document_store=document_store, top_k=3), None
+  return BatchQuestionAnswerer(retriever, CohereChatGenerator(), get_messages(), memory_store=get_memory_store(),
+                               rephrase_llm=CohereGenerator(), rephrase_template=query_rephrase_template,
+                               embedding_model=embedding_model, embedding_backend=QUERY_EMBEDDING_BACKEND, document_budget=DocumentBudget(), memory_budget=MemoryBudget())
+
+
+def _build_document_store():
+  from vector_index import IndexedInMemoryDocumentStore
+  if os.path.exists(os.path.join(STORE_SNAPSHOT_DIR, 'store.json')):
+    return IndexedInMemoryDocumentStore.load(STORE_SNAPSHOT_DIR, approximate=APPROXIMATE_SEARCH, quantization=EMBEDDING_QUANTIZATION,
+                                             rescore_multiplier=EMBEDDING_RESCORE_MULTIPLIER)
+  return IndexedInMemoryDocumentStore(approximate=APPROXIMATE_SEARCH, quantization=EMBEDDING_QUANTIZATION,
+                                      rescore_multiplier=EMBEDDING_RESCORE_MULTIPLIER)
+
+
+def _build_memory_store():
+  from chat_memory import SessionChatMessageStore
+  return SessionChatMessageStore()
+
+
+def _build_messages():
+  from haystack.dataclasses import ChatMessage
+  return [ChatMessage.from_system(system_prompt), ChatMessage.from_user(user_message_template)]
+
+
+def get_document_store():
+  return _get('document_store', _build_document_store)
+
+
+def get_memory_store():
+  return _get('memory_store', _build_memory_store)
+
+
+def clear_session(session_id):
+  get_memory_store().clear_session(session_id)
+
+
+def save_document_store():
+  get_document_store().save(STORE_SNAPSHOT_DIR, dtype=STORE_SNAPSHOT_DTYPE)
+
+
+def get_preprocessing_pipeline():
+  return _get('preprocessing_pipeline', _build_preprocessing_pipeline)
+
+
+def get_conversational_rag():
+  return _get('conversational_rag', _build_conversational_rag)
+
+
+def get_messages():
+  return list(_get('messages', _build_messages))
+
+
+def chat(question, token_queue=None, session_id=None):
+  """
+  Runs one turn through the conversational pipeline, reading and writing the chat memory of `session_id`.
+  When `token_queue` is given, the answer tokens are put on it as the LLM produces them; the full reply is
+  still written to the memory store once the answer is complete. A cached answer is put on the queue whole,
+  and returned under 'llm' like a generated one.
+  """
+  from haystack.dataclasses import ChatMessage
+  from chat_memory import chat_session
+
+  _streams.queue = token_queue
+  try:
+    with chat_session(session_id):
+      result = get_conversational_rag().run(
+          data = {'retrieval_prefetcher' : {'query': question},
+                  'prompt_builder': {'template': get_messages(), 'query': question},
+                  'memory_joiner': {'values': [ChatMessage.from_user(question)]}},
+          include_outputs_from=['llm','query_rephrase_llm','prompt_token_counter','answer_cache'])
+    cached = result.get('answer_cache', {}).get('replies')
+    if cached and 'llm' not in result:
+      result['llm'] = {'replies': cached}
+      if token_queue is not None:
+        token_queue.put(cached[0].text)
+    return result
+  finally:
+    _streams.queue = None
+
+
+def chat_batch(questions, session_ids=None):
+  """
+  Answers many questions at once: one batched embedding pass, parallel retrieval and a bounded number of
+  concurrent LLM calls. Returns one dict per question, in order, with 'query', 'answer', 'documents' and
+  'error'. Questions with a session id read and write that session's memory, in the order given.
+  """
+  return _get('batch_answerer', _build_batch_answerer).run(questions, session_ids)
+
+
+def get_prompt_stats():
+  # Token counts of the final chat prompts sent to the LLM
+  return get_conversational_rag().get_component('prompt_token_counter').stats()
+
+
+def get_rephrase_stats():
+  # How often the query rephrasing LLM call was skipped, and why
+  return get_conversational_rag().get_component('query_rephrase_router').stats()
+
+
+def get_answer_cache_stats():
+  # Hits, misses and evictions of the semantic answer cache in front of the LLM
+  if not ANSWER_CACHE:
+    return {}
+  return get_conversational_rag().get_component('answer_cache').cache.stats()
+
+
+def warm_up():
+  # Builds both pipelines and loads the embedding model for queries and for ingestion, then flips the readiness
+  # signal. A failure is logged and reported by warm_up_error() instead of leaving the app loading forever
+  global _warm_up_error
+  try:
+    from embedding import model_pool
+
+    get_preprocessing_pipeline().warm_up()
+    get_conversational_rag().warm_up()
+    get_messages()
+    model_pool.get(EMBEDDING_MODEL, backend=QUERY_EMBEDDING_BACKEND)
+    model_pool.get(EMBEDDING_MODEL, backend=INGEST_EMBEDDING_BACKEND)
+  except Exception as error:
+    logger.exception("Warm-up failed")
+    _warm_up_error = f"{type(error).__name__}: {error}"
+  else:
+    _warm_up_error = None
+    _ready.set()
+  finally:
+    _warmed_up.set()
+
+
+def start_warm_up() -> threading.Thread:
+  thread = threading.Thread(target=warm_up, name='module-warm-up', daemon=True)
+  thread.start()
+  return thread
+
+
+def is_ready() -> bool:
+  return _ready.is_set()
+
+
+def warm_up_error():
+  # Why the last warm-up failed, None while it runs or once it succeeded
+  return _warm_up_error
+
+
+def wait_until_ready(timeout=None) -> bool:
+  # Returns as soon as the warm-up has finished, False if it failed
+  _warmed_up.wait(timeout)
+  return _ready.is_set()
+
+
+_lazy_attributes = {
+  'document_store': get_document_store,
+  'memory_store': get_memory_store,
+  'preprocessing_pipeline': get_preprocessing_pipeline,
+  'conversational_rag': get_conversational_rag,
+  'system_message': lambda: get_messages()[0],
+  'user_message': lambda: get_messages()[1],
+}
+
+
+def __getattr__(name):
+  # Keeps `from module import conversational_rag` working, at the price of building it on import
+  if name in _lazy_attributes:
+    return _lazy_attributes[name]()
+  if name == 'ListJoiner':
+    from components import ListJoiner
+    return ListJoiner
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
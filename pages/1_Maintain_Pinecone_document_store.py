@@ -1,37 +1,53 @@
 
-from haystack.components.converters import PyPDFToDocument, MarkdownToDocument, TextFileToDocument, DOCXToDocument
 from haystack.components.routers import FileTypeRouter
 from haystack.components.joiners import DocumentJoiner
 from haystack.components.preprocessors import DocumentCleaner, DocumentSplitter
-from haystack.components.embedders import SentenceTransformersDocumentEmbedder
-from haystack.components.writers import DocumentWriter
-from haystack_integrations.document_stores.pinecone import PineconeDocumentStore
 from haystack import Pipeline
 import streamlit as st
 import pandas as pd
 import os, pathlib
-from pinecone.grpc import PineconeGRPC as Pinecone
+from concurrent.futures import ThreadPoolExecutor
+from ingestion import SourceFingerprinter, IncrementalDocumentFilter, StaleDocumentRemover, ParallelFileConverter
+from embedding import CachedDocumentEmbedder, EMBEDDING_BACKEND, EMBEDDING_BACKENDS
+from pinecone_writer import PineconeBatchWriter
+from local_pinecone import pinecone_client as make_pinecone_client, pinecone_document_store
+from instrumentation import enable_from_env
 from dotenv import load_dotenv
 load_dotenv()
+enable_from_env()
 
 st.set_page_config(page_title="Hello", page_icon="foaroedweb.png")
 
 container1 = st.container(border=True)
 container2 = st.container(border=True)
 
-def count_documents(index):
-	document_store = PineconeDocumentStore(index=index)
-	return document_store.count_documents()
+# Index statistics are reused for this many seconds, and dropped as soon as this page writes to an index
+INDEX_STATS_TTL = int(os.getenv('INDEX_STATS_TTL', '30'))
 
-def show_indexes():
-	pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
-	index_list = pc.list_indexes()
+@st.cache_resource(show_spinner=False)
+def pinecone_client():
+	# The gRPC client, or the local stand-in when PINECONE_BACKEND=local
+	return make_pinecone_client(os.getenv('PINECONE_API_KEY'))
+
+def count_documents(host, namespace="default"):
+	# Data-plane stats call on the index host, no control-plane lookup per index
+	stats = pinecone_client().Index(host=host).describe_index_stats()
+	summary = stats.namespaces.get(namespace)
+	return summary.vector_count if summary else 0
+
+@st.cache_data(ttl=INDEX_STATS_TTL, show_spinner=False)
+def index_statistics():
+	index_list = pinecone_client().list_indexes()
 	index_names = [item['name'] for item in index_list]
 	index_dimensions = [item['dimension'] for item in index_list]
-	index_documents = [count_documents(index) for index in index_names]
-	df = pd.DataFrame.from_dict({'Index name': index_names, 'Dimension': index_dimensions, 'Number of chunks': index_documents})
+	index_hosts = [item['host'] for item in index_list]
+	with ThreadPoolExecutor(max_workers=max(1, min(16, len(index_hosts)))) as executor:
+		index_documents = list(executor.map(count_documents, index_hosts))
+	return pd.DataFrame.from_dict({'Index name': index_names, 'Dimension': index_dimensions, 'Number of chunks': index_documents})
+
+def show_indexes():
 	container2.write("Indexes available in your Pinecone instance")
-	container2.write(df)
+	container2.write(index_statistics())
 
 with container1:
 	st.write("Click button to see which indexes are available in your Pinecone instance")
@@ -45,21 +61,14 @@ with st.form("inputform", clear_on_submit=True, enter_to_submit=False):
 	model_dimension_dict = {"all-MiniLM-L12-v2": 384, "multilingual-e5-large-instruct": 1024}
 	model_dimension = model_dimension_dict[model]
 	model = model_dict[model]
+	backend = st.selectbox("Select the inference backend", EMBEDDING_BACKENDS, index=EMBEDDING_BACKENDS.index(EMBEDDING_BACKEND),
+		help="The ONNX backends run an exported copy of the model on the CPU, 'onnx-int8' with int8 weights")
 	submit_button = st.form_submit_button("Submit")
 
-if files:
-
-	os.makedirs(pathlib.Path(__file__).parent.parent.joinpath('sources'), exist_ok=True)
-	os.chdir(pathlib.Path(__file__).parent.parent.joinpath('sources'))
-
-	for file in files:
-		with open(file.name, 'wb') as handle:
-			handle.write(file.getvalue())
-
-	files = os.listdir()
-
+@st.cache_resource(max_entries=8, show_spinner=False)
+def build_preprocessing_pipeline(index_name, model, model_dimension, backend):
 	# Make sure you have the PINECONE_API_KEY environment variable set
-	document_store = PineconeDocumentStore(
+	document_store = pinecone_document_store(
 			index=index_name,
 			namespace="default",
 			dimension=model_dimension,
@@ -67,48 +76,90 @@ if files:
 		spec={"serverless": {"region": "us-east-1", "cloud": "aws"}}
 	)
 
+	source_fingerprinter = SourceFingerprinter(document_store)
 	file_type_router = FileTypeRouter(mime_types=['text/plain','application/pdf','text/markdown', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'])
-	pdf_converter = PyPDFToDocument()
-	text_file_converter = TextFileToDocument()
-	markdown_converter = MarkdownToDocument()
-	docx_converter = DOCXToDocument()
+	parallel_converter = ParallelFileConverter()
 	document_joiner = DocumentJoiner()
 	document_cleaner = DocumentCleaner()
 	document_splitter = DocumentSplitter(split_by='word', split_overlap=50)
-	document_embedder = SentenceTransformersDocumentEmbedder(model = model)
-	document_writer = DocumentWriter(document_store)
+	incremental_filter = IncrementalDocumentFilter(document_store)
+	document_embedder = CachedDocumentEmbedder(model = model, backend = backend)
+	chunk_joiner = DocumentJoiner()
+	# Batched, concurrent upserts over gRPC, overwriting chunks that already exist
+	document_writer = PineconeBatchWriter(document_store)
+	stale_remover = StaleDocumentRemover(document_store)
 
-	preprocessing_pipeline = Pipeline()
+	preprocessing_pipeline = Pipeline(metadata={'name': 'pinecone_preprocessing'})
 
 	# Adding Componenets
+	preprocessing_pipeline.add_component('source_fingerprinter', source_fingerprinter)
 	preprocessing_pipeline.add_component('file_type_router', file_type_router)
-	preprocessing_pipeline.add_component('text_file_converter', text_file_converter)
-	preprocessing_pipeline.add_component('markdown_converter', markdown_converter)
-	preprocessing_pipeline.add_component('pdf_converter', pdf_converter)
-	preprocessing_pipeline.add_component('docx_converter', docx_converter)
+	preprocessing_pipeline.add_component('parallel_converter', parallel_converter)
 	preprocessing_pipeline.add_component('document_joiner', document_joiner)
 	preprocessing_pipeline.add_component('document_cleaner', document_cleaner)
 	preprocessing_pipeline.add_component('document_splitter', document_splitter)
+	preprocessing_pipeline.add_component('incremental_filter', incremental_filter)
 	preprocessing_pipeline.add_component('document_embedder', document_embedder)
+	preprocessing_pipeline.add_component('chunk_joiner', chunk_joiner)
 	preprocessing_pipeline.add_component('document_writer', document_writer)
+	preprocessing_pipeline.add_component('stale_remover', stale_remover)
 
 	# Connections
 
-	preprocessing_pipeline.connect('file_type_router.text/plain', 'text_file_converter.sources')
-	preprocessing_pipeline.connect('file_type_router.application/pdf', 'pdf_converter.sources')
-	preprocessing_pipeline.connect('file_type_router.text/markdown', 'markdown_converter.sources')
-	preprocessing_pipeline.connect('file_type_router.application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'docx_converter.sources')
-	preprocessing_pipeline.connect('text_file_converter', 'document_joiner')
-	preprocessing_pipeline.connect('markdown_converter', 'document_joiner')
-	preprocessing_pipeline.connect('pdf_converter', 'document_joiner')
-	preprocessing_pipeline.connect('docx_converter', 'document_joiner')
+	preprocessing_pipeline.connect('source_fingerprinter.sources', 'file_type_router.sources')
+	preprocessing_pipeline.connect('source_fingerprinter.meta', 'file_type_router.meta')
+	preprocessing_pipeline.connect('file_type_router.text/plain', 'parallel_converter.text_sources')
+	preprocessing_pipeline.connect('file_type_router.application/pdf', 'parallel_converter.pdf_sources')
+	preprocessing_pipeline.connect('file_type_router.text/markdown', 'parallel_converter.markdown_sources')
+	preprocessing_pipeline.connect('file_type_router.application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'parallel_converter.docx_sources')
+	preprocessing_pipeline.connect('parallel_converter.documents', 'document_joiner')
 	preprocessing_pipeline.connect('document_joiner', 'document_cleaner')
 	preprocessing_pipeline.connect('document_cleaner', 'document_splitter')
-	preprocessing_pipeline.connect('document_splitter', 'document_embedder')
-	preprocessing_pipeline.connect('document_embedder', 'document_writer')
+	preprocessing_pipeline.connect('document_splitter', 'incremental_filter')
+	preprocessing_pipeline.connect('incremental_filter.documents', 'document_embedder')
+	preprocessing_pipeline.connect('document_embedder', 'chunk_joiner')
+	preprocessing_pipeline.connect('incremental_filter.unchanged', 'chunk_joiner')
+	preprocessing_pipeline.connect('chunk_joiner', 'document_writer')
+	preprocessing_pipeline.connect('document_writer.documents_written', 'stale_remover.documents_written')
+	preprocessing_pipeline.connect('incremental_filter.stale_ids', 'stale_remover.document_ids')
+
+	return preprocessing_pipeline
+
+if files:
+
+	os.makedirs(pathlib.Path(__file__).parent.parent.joinpath('sources'), exist_ok=True)
+	os.chdir(pathlib.Path(__file__).parent.parent.joinpath('sources'))
+
+	for file in files:
+		with open(file.name, 'wb') as handle:
+			handle.write(file.getvalue())
+
+	files = os.listdir()
 
-	a = preprocessing_pipeline.run({'file_type_router': {'sources': files}})['document_writer']['documents_written']
-	st.write(f"Uploaded {len(files)} files in {a} chunks to the index {index_name}")
+	# Built once per index/model and shared by all sessions, the embedding model itself comes from the shared model pool
+	preprocessing_pipeline = build_preprocessing_pipeline(index_name, model, model_dimension, backend)
+	document_embedder = preprocessing_pipeline.get_component('document_embedder')
+
+	res = preprocessing_pipeline.run({'source_fingerprinter': {'sources': files}}, include_outputs_from=['source_fingerprinter', 'parallel_converter', 'document_writer', 'stale_remover'])
+	skipped = res['source_fingerprinter']['skipped']
+	failed = res.get('parallel_converter', {}).get('failed', [])
+	# When every file is unchanged nothing reaches the writer or the stale remover, so neither shows up in the result
+	a = res.get('document_writer', {}).get('documents_written', 0)
+	deleted = res.get('stale_remover', {}).get('documents_deleted', 0)
+	if a or deleted:
+		index_statistics.clear()
+	st.write(f"Uploaded {len(files) - len(skipped)} changed files in {a} chunks to the index {index_name}, removed {deleted} stale chunks")
+	if a:
+		st.write(f"Upsert throughput: {res['document_writer']['chunks_per_second']:.0f} chunks/s")
+	if skipped:
+		st.write(f"Skipped {len(skipped)} unchanged files: {', '.join(skipped)}")
+	if failed:
+		st.write(f"Could not convert {len(failed)} files: {', '.join(failed)}")
+	cache_stats = document_embedder.cache.stats()
+	st.write(f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+	padding_efficiency = document_embedder.stats()['padding_efficiency']
+	if padding_efficiency is not None:
+		st.write(f"Embedding padding efficiency: {padding_efficiency:.0%} of the batched tokens are real tokens")
 
 	for file in files:
 		os.remove(file)
\ No newline at end of file
@@ -6,13 +6,11 @@ from haystack.components.converters import PyPDFToDocument, MarkdownToDocument,
 from haystack.components.routers import FileTypeRouter
 from haystack.components.joiners import DocumentJoiner
 from haystack.components.preprocessors import DocumentCleaner, DocumentSplitter
-from haystack.components.embedders import SentenceTransformersTextEmbedder
 from haystack.components.builders import ChatPromptBuilder, PromptBuilder
-from haystack_integrations.document_stores.pinecone import PineconeDocumentStore
+from local_pinecone import pinecone_document_store
 from haystack_integrations.components.retrievers.pinecone import PineconeEmbeddingRetriever
 from haystack.core.component.types import Variadic
 
-from haystack_experimental.chat_message_stores.in_memory import InMemoryChatMessageStore
 from haystack_experimental.components.retrievers import ChatMessageRetriever
 from haystack_experimental.components.writers import ChatMessageWriter
 from haystack_integrations.components.generators.cohere import CohereChatGenerator, CohereGenerator
@@ -23,22 +21,22 @@ from haystack import Pipeline
 from haystack import component
 
 import os
+import streamlit as st
 from dotenv import load_dotenv
 
+from embedding import CachedTextEmbedder, EMBEDDING_BACKEND, EMBEDDING_CACHE_DIR
+from components import RetrievalPrefetcher, SpeculativeRetriever
+from chat_memory import SessionChatMessageStore, chat_session
+from instrumentation import enable_from_env
+import uuid
+
 # Load .env file
 load_dotenv()
+enable_from_env()
 
 # Access the API key
 os.environ["COHERE_API_KEY"] = os.getenv('COHERE_API_KEY')
 
-# Make sure you have the PINECONE_API_KEY environment variable set
-document_store = PineconeDocumentStore(
-        index='seven-wonders',
-        namespace="default",
-        dimension=384,
-    metric="cosine",
-    spec={"serverless": {"region": "us-east-1", "cloud": "aws"}}
-)
 # file_type_router = FileTypeRouter(mime_types=['text/plain','application/pdf','text/markdown', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'])
 # pdf_converter = PyPDFToDocument()
 # text_file_converter = TextFileToDocument()
@@ -64,8 +62,6 @@ class ListJoiner:
     return {'values':result}
   
 
-memory_store = InMemoryChatMessageStore()
-
 query_rephrase_template="""
         Rewrite the question for search while keeping its meaning and key terms intact.
         If the conversation history is empty, DO NOT change the query.
@@ -82,40 +78,64 @@ query_rephrase_template="""
 """
 
 
-conversational_rag = Pipeline()
+# Built once per index/model and reused across reruns and sessions, the embedding model comes from the shared model pool
+# and repeated questions are answered from the query embedding cache
+@st.cache_resource(show_spinner=False)
+def build_conversational_rag(index_name, model, model_dimension, backend=EMBEDDING_BACKEND):
+  # Make sure you have the PINECONE_API_KEY environment variable set
+  document_store = pinecone_document_store(
+    index=index_name,
+    namespace="default",
+    dimension=model_dimension,
+    metric="cosine",
+    spec={"serverless": {"region": "us-east-1", "cloud": "aws"}}
+  )
+  # Shared by all sessions, but every session only sees its own bounded history
+  memory_store = SessionChatMessageStore()
+
+  conversational_rag = Pipeline(metadata={'name': 'pinecone_conversational_rag'})
+
+  # Query embedding and retrieval for the original question start while the question is being rephrased
+  retrieval_prefetcher = RetrievalPrefetcher(PineconeEmbeddingRetriever(document_store=document_store, top_k=3), text_embedder=CachedTextEmbedder(model=model, cache_dir=EMBEDDING_CACHE_DIR, backend=backend))
+
+  #Query rephrasing components
+  conversational_rag.add_component('retrieval_prefetcher', retrieval_prefetcher)
+  conversational_rag.add_component("query_rephrase_prompt_builder",PromptBuilder(query_rephrase_template))
+  conversational_rag.add_component('query_rephrase_llm',CohereGenerator())
+  conversational_rag.add_component('list_to_str_adapter', OutputAdapter(template="{{ replies[0] }}", output_type=str))
 
-#Query rephrasing components
-conversational_rag.add_component("query_rephrase_prompt_builder",PromptBuilder(query_rephrase_template))
-conversational_rag.add_component('query_rephrase_llm',CohereGenerator())
-conversational_rag.add_component('list_to_str_adapter', OutputAdapter(template="{{ replies[0] }}", output_type=List[float]))
+  #RAG components
+  conversational_rag.add_component('retriever', SpeculativeRetriever(retrieval_prefetcher))
+  conversational_rag.add_component('prompt_builder', ChatPromptBuilder(variables=["query", "documents", "memories"],required_variables=['query', 'documents', 'memories']))
+  conversational_rag.add_component('llm', CohereChatGenerator())
 
-#RAG components
-conversational_rag.add_component("text_embedder", SentenceTransformersTextEmbedder(model="sentence-transformers/all-MiniLM-L6-v2"))
-conversational_rag.add_component('retriever', PineconeEmbeddingRetriever(document_store=document_store, top_k=3))
-conversational_rag.add_component('prompt_builder', ChatPromptBuilder(variables=["query", "documents", "memories"],required_variables=['query', 'documents', 'memories']))
-conversational_rag.add_component('llm', CohereChatGenerator())
+  #Memory components
+  conversational_rag.add_component('memory_retriever',ChatMessageRetriever(memory_store))
+  conversational_rag.add_component('memory_writer', ChatMessageWriter(memory_store))
+  conversational_rag.add_component('memory_joiner', ListJoiner(List[ChatMessage]))
 
-#Memory components
-conversational_rag.add_component('memory_retriever',ChatMessageRetriever(memory_store))
-conversational_rag.add_component('memory_writer', ChatMessageWriter(memory_store))
-conversational_rag.add_component('memory_joiner', ListJoiner(List[ChatMessage]))
 
+  #Query Rephrasing Connections
+  conversational_rag.connect('retrieval_prefetcher.query', 'query_rephrase_prompt_builder.query')
+  conversational_rag.connect('retrieval_prefetcher.ticket', 'retriever.ticket')
+  conversational_rag.connect('memory_retriever', 'query_rephrase_prompt_builder.memories')
+  conversational_rag.connect('query_rephrase_prompt_builder.prompt', 'query_rephrase_llm' )
+  conversational_rag.connect('query_rephrase_llm.replies', 'list_to_str_adapter')
+  conversational_rag.connect('list_to_str_adapter', 'retriever.query')
 
-#Query Rephrasing Connections
-conversational_rag.connect('memory_retriever', 'query_rephrase_prompt_builder.memories')
-conversational_rag.connect('query_rephrase_prompt_builder.prompt', 'query_rephrase_llm' )
-conversational_rag.connect('query_rephrase_llm.replies', 'list_to_str_adapter')
-# conversational_rag.connect('list_to_str_adapter', 'retriever.query_embedding')
+  #RAG connections
+  conversational_rag.connect('retriever.documents', 'prompt_builder.documents')
+  conversational_rag.connect('prompt_builder.prompt', 'llm.messages')
+  conversational_rag.connect('llm.replies', 'memory_joiner')
 
-#RAG connections
-conversational_rag.connect('text_embedder.embedding', 'retriever.query_embedding')
-conversational_rag.connect('retriever.documents', 'prompt_builder.documents')
-conversational_rag.connect('prompt_builder.prompt', 'llm.messages')
-conversational_rag.connect('llm.replies', 'memory_joiner')
+  #Memory Connections
+  conversational_rag.connect('memory_joiner','memory_writer')
+  conversational_rag.connect('memory_retriever','prompt_builder.memories')
 
-#Memory Connections
-conversational_rag.connect('memory_joiner','memory_writer')
-conversational_rag.connect('memory_retriever','prompt_builder.memories')
+  return conversational_rag
+
+
+conversational_rag = build_conversational_rag('seven-wonders', "sentence-transformers/all-MiniLM-L6-v2", 384)
 
 
 system_message = ChatMessage.from_system("""You are an intelligent and cheerful AI assistant specialized in assisting humans with queries based on provided supporting documents and conversation history. 
@@ -146,10 +166,12 @@ Answer:
 user_message = ChatMessage.from_user(user_message_template)
 messages = [system_message, user_message]
 question = "When was the Colossum of Rhodes built?"
-res = conversational_rag.run(
-    data = {'query_rephrase_prompt_builder' : {'query': question},
-            'prompt_builder': {'template': messages, 'query': question},
-            'memory_joiner': {'values': [ChatMessage.from_user(question)]}},
-    include_outputs_from=['llm','query_rephrase_llm'])
-
-bot_message = res['llm']['replies'][0].text
\ No newline at end of file
+session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+with chat_session(session_id):
+  res = conversational_rag.run(
+      data = {'retrieval_prefetcher' : {'query': question},
+              'prompt_builder': {'template': messages, 'query': question},
+              'memory_joiner': {'values': [ChatMessage.from_user(question)]}},
+      include_outputs_from=['llm','query_rephrase_llm'])
+
+bot_message = res['llm']['replies'][0].text
\ No newline at end of file
@@ -8,14 +8,15 @@ load_dotenv()
 from haystack import Pipeline
 from haystack.components.converters import MarkdownToDocument, PyPDFToDocument, TextFileToDocument, DOCXToDocument
 from haystack.components.routers import FileTypeRouter
-from haystack.components.writers import DocumentWriter
+from pinecone_writer import PineconeBatchWriter
 from haystack.components.embedders import SentenceTransformersDocumentEmbedder
 from haystack.components.joiners import DocumentJoiner
 from haystack.components.preprocessors import DocumentCleaner, DocumentSplitter
 from haystack_integrations.document_stores.pinecone import PineconeDocumentStore
+from local_pinecone import pinecone_document_store
 
-# Make sure you have the PINECONE_API_KEY environment variable set
-document_store = PineconeDocumentStore(
+# Make sure you have the PINECONE_API_KEY environment variable set, or PINECONE_BACKEND=local to run offline
+document_store = pinecone_document_store(
   index="pinecone-integration",
   metric="cosine",
   dimension=768,
@@ -31,7 +32,8 @@ document_joiner = DocumentJoiner()
 document_cleaner = DocumentCleaner()
 document_splitter = DocumentSplitter(split_by='word', split_overlap=50)
 document_embedder = SentenceTransformersDocumentEmbedder()
-document_writer = DocumentWriter(document_store)
+# Upserts in concurrent batches, set PINECONE_INDEX_HOST to write to a Pinecone Local server instead
+document_writer = PineconeBatchWriter(document_store)
 
 indexing = Pipeline()
 # indexing.add_component("converter", MarkdownToDocument())
@@ -86,7 +88,7 @@ from haystack_integrations.document_stores.pinecone import PineconeDocumentStore
 from haystack_integrations.components.retrievers.pinecone import PineconeEmbeddingRetriever
 
 # Make sure you have the PINECONE_API_KEY environment variable set
-document_store = PineconeDocumentStore(
+document_store = pinecone_document_store(
   index="pinecone-integration",
   metric="cosine",
   dimension=768,
@@ -0,0 +1,141 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from haystack import Document, component
+from haystack.document_stores.errors import DuplicateDocumentError
+from haystack.document_stores.types import DuplicatePolicy
+
+logger = logging.getLogger(__name__)
+
+PINECONE_UPSERT_BATCH_SIZE = int(os.getenv('PINECONE_UPSERT_BATCH_SIZE', '100'))
+PINECONE_MAX_IN_FLIGHT = int(os.getenv('PINECONE_MAX_IN_FLIGHT', '4'))
+PINECONE_MAX_RETRIES = int(os.getenv('PINECONE_MAX_RETRIES', '5'))
+# Point this at a Pinecone Local server (e.g. http://localhost:5080) to index without the hosted service
+PINECONE_INDEX_HOST = os.getenv('PINECONE_INDEX_HOST')
+
+# gRPC status codes and HTTP statuses worth another try: throttling and transient server trouble
+_RETRYABLE_CODES = {'RESOURCE_EXHAUSTED', 'UNAVAILABLE', 'DEADLINE_EXCEEDED', 'ABORTED', 'INTERNAL'}
+_RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def is_retryable(error: Exception) -> bool:
+  code = getattr(error, 'code', None)
+  if callable(code):
+    try:
+      return getattr(code(), 'name', str(code())) in _RETRYABLE_CODES
+    except Exception:
+      return False
+  status = getattr(error, 'status', None) or getattr(error, 'status_code', None)
+  return status in _RETRYABLE_STATUSES or isinstance(error, (ConnectionError, TimeoutError))
+
+
+@component
+class PineconeBatchWriter:
+  """
+  Writes documents to a PineconeDocumentStore's index in batches of `batch_size`, with up to `max_in_flight`
+  upserts running at once over the gRPC client. Throttled or failed batches are retried with exponential
+  backoff. Upserts overwrite, so the default policy is DuplicatePolicy.OVERWRITE; with SKIP or FAIL the ids are
+  fetched first and existing ones are left out or raise DuplicateDocumentError.
+
+  `index_host` (with `secure=False`) targets a local stand-in such as Pinecone Local; `index` takes any object
+  with an `upsert(vectors, namespace)` method instead of connecting at all.
+  """
+
+  def __init__(self, document_store, batch_size: int = PINECONE_UPSERT_BATCH_SIZE,
+               max_in_flight: int = PINECONE_MAX_IN_FLIGHT, max_retries: int = PINECONE_MAX_RETRIES,
+               backoff: float = 0.5, max_backoff: float = 30.0, index_host: Optional[str] = PINECONE_INDEX_HOST,
+               secure: bool = True, index=None, policy: DuplicatePolicy = DuplicatePolicy.OVERWRITE):
+    self.document_store = document_store
+    self.batch_size = batch_size
+    self.max_in_flight = max_in_flight
+    self.max_retries = max_retries
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.index_host = index_host
+    self.secure = secure
+    self.policy = policy
+    self._index = index
+    self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='pinecone-upsert')
+    self.counts = {'batches': 0, 'retries': 0, 'chunks': 0, 'seconds': 0.0}
+    self._lock = threading.Lock()
+
+  def _connect(self):
+    if getattr(self.document_store, 'is_local', False):
+      return self.document_store.index
+    from pinecone.grpc import PineconeGRPC, GRPCClientConfig
+
+    api_key = self.document_store.api_key.resolve_value()
+    if self.index_host:
+      client = PineconeGRPC(api_key=api_key or 'pclocal', host=self.index_host)
+      return client.Index(host=self.index_host, grpc_config=GRPCClientConfig(secure=self.secure))
+    # The document store creates the index on first access, so a new index exists before connecting over gRPC
+    self.document_store.index
+    return PineconeGRPC(api_key=api_key).Index(name=self.document_store.index_name)
+
+  @property
+  def index(self):
+    if self._index is None:
+      with self._lock:
+        if self._index is None:
+          self._index = self._connect()
+    return self._index
+
+  def _upsert(self, vectors: List[Dict[str, Any]]) -> int:
+    attempt = 0
+    while True:
+      try:
+        self.index.upsert(vectors=vectors, namespace=self.document_store.namespace)
+        return len(vectors)
+      except Exception as error:
+        if attempt >= self.max_retries or not is_retryable(error):
+          raise
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+        attempt += 1
+        with self._lock:
+          self.counts['retries'] += 1
+        logger.warning("Upsert of %d vectors failed (%s), retry %d in %.1fs", len(vectors), error, attempt, delay)
+        time.sleep(delay)
+
+  def _existing_ids(self, ids: List[str]) -> set:
+    existing = set()
+    for i in range(0, len(ids), self.batch_size):
+      response = self.index.fetch(ids=ids[i:i + self.batch_size], namespace=self.document_store.namespace)
+      existing.update(response.vectors.keys())
+    return existing
+
+  @component.output_types(documents_written=int, chunks_per_second=float)
+  def run(self, documents: List[Document], policy: Optional[DuplicatePolicy] = None):
+    policy = policy or self.policy
+    start = time.perf_counter()
+    if documents and policy in (DuplicatePolicy.SKIP, DuplicatePolicy.FAIL):
+      existing = self._existing_ids([doc.id for doc in documents])
+      if existing and policy == DuplicatePolicy.FAIL:
+        raise DuplicateDocumentError(f"IDs {sorted(existing)} already exist in the document store.")
+      documents = [doc for doc in documents if doc.id not in existing]
+    if not documents:
+      return {'documents_written': 0, 'chunks_per_second': 0.0}
+
+    vectors = self.document_store._convert_documents_to_pinecone_format(documents)
+    batches = [vectors[i:i + self.batch_size] for i in range(0, len(vectors), self.batch_size)]
+    # Submitting everything at once is fine, the pool size is what bounds the upserts in flight
+    futures = [self._executor.submit(self._upsert, batch) for batch in batches]
+    written = sum(future.result() for future in futures)
+    elapsed = time.perf_counter() - start
+
+    with self._lock:
+      self.counts['batches'] += len(batches)
+      self.counts['chunks'] += written
+      self.counts['seconds'] += elapsed
+    rate = written / elapsed if elapsed else 0.0
+    logger.info("Upserted %d chunks in %d batches in %.2fs (%.0f chunks/s)", written, len(batches), elapsed, rate)
+    return {'documents_written': written, 'chunks_per_second': rate}
+
+  def stats(self) -> Dict[str, Any]:
+    with self._lock:
+      seconds = self.counts['seconds']
+      return {**self.counts, 'chunks_per_second': self.counts['chunks'] / seconds if seconds else 0.0}
@@ -0,0 +1,79 @@
+from haystack import Document
+from haystack.dataclasses import ChatMessage
+
+from answer_cache import SemanticAnswerCache, SemanticCacheLookup, SemanticCacheWriter
+from vector_index import IndexedInMemoryDocumentStore
+
+VECTORS = {
+  'what is rag': [1.0, 0.0, 0.0],
+  'what is rag?': [0.99, 0.1, 0.0],
+  'who wrote it': [0.0, 1.0, 0.0],
+}
+
+
+class StubTextEmbedder:
+  def run(self, text):
+    return {'embedding': VECTORS[text]}
+
+
+DOCUMENTS = [Document(id='1', content='RAG combines retrieval and generation', embedding=[1.0, 0.0, 0.0])]
+
+
+def make_cache(store=None, **kwargs):
+  cache = SemanticAnswerCache(store, **kwargs)
+  return cache, SemanticCacheLookup(cache, StubTextEmbedder()), SemanticCacheWriter(cache)
+
+
+def ask(lookup, writer, query, memories=None, documents=DOCUMENTS, answer='answer'):
+  # One turn of the pipeline: a miss stores what the LLM would have said
+  result = lookup.run(query=query, documents=documents, memories=memories)
+  if 'replies' in result:
+    return result['replies'][0].text, True
+  writer.run(cache_key=result['cache_key'], replies=[ChatMessage.from_assistant(answer)])
+  return answer, False
+
+
+def test_first_turns_share_answers_across_sessions_on_the_same_documents():
+  cache, lookup, writer = make_cache()
+  assert ask(lookup, writer, 'what is rag', answer='first') == ('first', False)
+  # Another session, no history, a near-identical question over the same documents
+  assert ask(lookup, writer, 'what is rag?', answer='second') == ('first', True)
+  assert ask(lookup, writer, 'who wrote it', answer='other') == ('other', False)
+  assert ask(lookup, writer, 'what is rag', documents=[Document(id='2', content='x')], answer='third') == ('third', False)
+  assert cache.stats()['hits'] == 1
+
+
+def test_a_different_history_misses():
+  cache, lookup, writer = make_cache()
+  history_a = [ChatMessage.from_user('tell me about haystack'), ChatMessage.from_assistant('it is a framework')]
+  history_b = [ChatMessage.from_user('tell me about pinecone'), ChatMessage.from_assistant('it is a database')]
+  assert ask(lookup, writer, 'what is rag', history_a, answer='a') == ('a', False)
+  assert ask(lookup, writer, 'what is rag', history_b, answer='b') == ('b', False)
+  assert ask(lookup, writer, 'what is rag', answer='none') == ('none', False)
+  assert ask(lookup, writer, 'what is rag', list(history_a), answer='again') == ('a', True)
+
+
+def test_a_write_to_the_store_invalidates_the_cache():
+  store = IndexedInMemoryDocumentStore()
+  store.write_documents(DOCUMENTS)
+  cache, lookup, writer = make_cache(store)
+  ask(lookup, writer, 'what is rag', answer='before')
+  assert ask(lookup, writer, 'what is rag', answer='unused') == ('before', True)
+  store.write_documents([Document(id='3', content='new', embedding=[0.0, 0.0, 1.0])])
+  assert ask(lookup, writer, 'what is rag', answer='after') == ('after', False)
+  assert cache.stats()['invalidations'] == 1
+
+
+def test_expired_and_least_recently_used_entries_are_dropped(monkeypatch):
+  import answer_cache
+
+  now = [1000.0]
+  monkeypatch.setattr(answer_cache.time, 'monotonic', lambda: now[0])
+  cache, lookup, writer = make_cache(ttl=60, max_entries=1)
+  ask(lookup, writer, 'what is rag', answer='rag')
+  ask(lookup, writer, 'who wrote it', answer='author')
+  assert cache.stats()['evicted'] == 1
+  assert ask(lookup, writer, 'what is rag', answer='rag again') == ('rag again', False)
+  now[0] += 61
+  assert ask(lookup, writer, 'what is rag', answer='later') == ('later', False)
+  assert cache.stats()['expired'] == 1
@@ -0,0 +1,70 @@
+import threading
+import time
+
+from haystack import Document
+from haystack.components.retrievers.in_memory import InMemoryBM25Retriever
+from haystack.dataclasses import ChatMessage
+from haystack.document_stores.in_memory import InMemoryDocumentStore
+
+from batch_qa import BatchQuestionAnswerer
+from chat_memory import SessionChatMessageStore
+
+TEMPLATE = [ChatMessage.from_user("{{ query }}|{% for memory in memories %}{{ memory.text }};{% endfor %}")]
+
+
+class StubChatGenerator:
+  # Answers with the question and the history it was given, fails on 'boom' and records how many calls overlap
+  def __init__(self):
+    self.running = 0
+    self.max_running = 0
+    self._lock = threading.Lock()
+
+  def run(self, messages):
+    with self._lock:
+      self.running += 1
+      self.max_running = max(self.max_running, self.running)
+    try:
+      time.sleep(0.02)
+      question, history = messages[-1].text.split('|')
+      if question == 'boom':
+        raise RuntimeError('generator failed')
+      return {'replies': [ChatMessage.from_assistant(f"{question} after [{history}]")]}
+    finally:
+      with self._lock:
+        self.running -= 1
+
+
+def make_answerer(document_store, max_llm_concurrency=2):
+  llm = StubChatGenerator()
+  answerer = BatchQuestionAnswerer(InMemoryBM25Retriever(document_store=document_store, top_k=1), llm, TEMPLATE,
+                                   memory_store=SessionChatMessageStore(), max_llm_concurrency=max_llm_concurrency)
+  return answerer, llm
+
+
+def test_a_failing_question_does_not_stop_the_others():
+  store = InMemoryDocumentStore()
+  store.write_documents([Document(content='The lighthouse of Alexandria'), Document(content='The pyramid of Giza')])
+  answerer, llm = make_answerer(store)
+  questions = ['q1', 'boom', 'q2', 'q3', 'q4', 'q5']
+  results = answerer.run(questions)
+
+  assert [item['question'] for item in results] == questions
+  assert results[1]['answer'] is None and results[1]['error'] == 'RuntimeError: generator failed'
+  assert [item['answer'] for item in results if item['error'] is None] == [f"{q} after []" for q in ['q1', 'q2', 'q3', 'q4', 'q5']]
+  assert all(item['documents'] is not None for item in results)
+  # The LLM pool runs calls side by side, but never more than its size
+  assert llm.max_running == 2
+
+
+def test_questions_of_one_session_see_the_earlier_turns():
+  store = InMemoryDocumentStore()
+  store.write_documents([Document(content='The lighthouse of Alexandria')])
+  answerer, _ = make_answerer(store, max_llm_concurrency=4)
+  results = answerer.run(['a1', 'b1', 'a2', 'a3', 'b2'], session_ids=['a', 'b', 'a', 'a', 'b'])
+
+  answers = {item['question']: item['answer'] for item in results}
+  assert answers['a1'] == 'a1 after []'
+  assert answers['a2'] == 'a2 after [a1;a1 after [];]'
+  assert answers['a3'] == 'a3 after [a1;a1 after [];a2;a2 after [a1;a1 after [];];]'
+  assert answers['b2'] == 'b2 after [b1;b1 after [];]'
+  assert [item['question'] for item in results] == ['a1', 'b1', 'a2', 'a3', 'b2']
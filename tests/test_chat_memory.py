@@ -0,0 +1,63 @@
+from haystack.dataclasses import ChatMessage
+
+from chat_memory import SessionChatMessageStore, chat_session
+
+
+def turn(store, session_id, question, answer):
+  with chat_session(session_id):
+    store.write_messages([ChatMessage.from_user(question), ChatMessage.from_assistant(answer)])
+
+
+def texts(store, session_id):
+  with chat_session(session_id):
+    return [message.text for message in store.retrieve()]
+
+
+def test_sessions_are_isolated():
+  store = SessionChatMessageStore()
+  turn(store, 'a', 'question a', 'answer a')
+  turn(store, 'b', 'question b', 'answer b')
+  assert texts(store, 'a') == ['question a', 'answer a']
+  assert texts(store, 'b') == ['question b', 'answer b']
+  with chat_session('a'):
+    store.delete_messages()
+  assert texts(store, 'a') == [] and texts(store, 'b') == ['question b', 'answer b']
+
+
+def test_only_the_last_turns_are_kept():
+  store = SessionChatMessageStore(max_turns=2)
+  for i in range(5):
+    turn(store, 'a', f"q{i}", f"a{i}")
+  assert texts(store, 'a') == ['q3', 'a3', 'q4', 'a4']
+  assert store.stats()['chars'] == 8
+
+
+def test_reading_an_unknown_session_does_not_create_it():
+  store = SessionChatMessageStore()
+  assert texts(store, 'visitor') == []
+  with chat_session('visitor'):
+    assert store.count_messages() == 0
+  assert store.stats()['sessions'] == 0
+
+
+def test_least_recently_used_sessions_are_evicted_by_count():
+  store = SessionChatMessageStore(max_sessions=2)
+  turn(store, 'a', 'qa', 'aa')
+  turn(store, 'b', 'qb', 'ab')
+  texts(store, 'a')
+  turn(store, 'c', 'qc', 'ac')
+  assert texts(store, 'b') == []
+  assert texts(store, 'a') == ['qa', 'aa'] and texts(store, 'c') == ['qc', 'ac']
+  assert store.stats()['evicted_sessions'] == 1
+
+
+def test_least_recently_used_sessions_are_evicted_by_characters():
+  store = SessionChatMessageStore(max_chars=25)
+  turn(store, 'a', 'x' * 5, 'y' * 5)
+  turn(store, 'b', 'x' * 5, 'y' * 5)
+  turn(store, 'c', 'x' * 5, 'y' * 5)
+  assert store.stats()['sessions'] == 2 and store.stats()['chars'] == 20
+  assert texts(store, 'a') == []
+  # The last session is kept even when it alone is over the limit
+  turn(store, 'd', 'x' * 30, 'y')
+  assert store.stats()['sessions'] == 1 and texts(store, 'd') == ['x' * 30, 'y']
@@ -0,0 +1,139 @@
+import uuid
+
+import pytest
+
+from haystack import Document
+from haystack.dataclasses import ChatMessage
+
+from components import (DocumentBudget, MemoryBudget, QueryRephraseRouter, RetrievalPrefetcher, SpeculativeRetriever, TokenCounter,
+                        is_self_contained, query_similarity)
+
+HISTORY = [ChatMessage.from_user('Tell me about the lighthouse of Alexandria'), ChatMessage.from_assistant('It was built around 280 BC.')]
+
+
+@pytest.mark.parametrize('query, self_contained', [
+  ('How tall was the lighthouse of Alexandria?', True),
+  ('Who built the Hanging Gardens of Babylon', True),
+  ('When was the Colossus of Rhodes destroyed?', True),
+  ('How tall was it?', False),
+  ('What about its height?', False),
+  ('And the other one?', False),
+  ('Why was that wonder destroyed?', False),
+  ('Tell me more about the pyramids', False),
+  ('Who built them originally?', False),
+  ('Height?', False),
+  ('but who designed the statue of Zeus', False),
+])
+def test_is_self_contained(query, self_contained):
+  assert is_self_contained(query) is self_contained
+
+
+@pytest.mark.parametrize('query, memories, output', [
+  ('How tall was it?', [], 'query'),
+  ('How tall was the lighthouse of Alexandria?', HISTORY, 'query'),
+  ('How tall was it?', HISTORY, 'rephrase'),
+  ('And the other one?', HISTORY, 'rephrase'),
+])
+def test_router_only_rephrases_follow_ups(query, memories, output):
+  router = QueryRephraseRouter()
+  assert router.run(query=query, memories=memories) == {output: query}
+
+
+def test_router_without_heuristic_rephrases_whenever_there_is_history():
+  router = QueryRephraseRouter(use_heuristic=False)
+  assert router.run(query='How tall was the lighthouse of Alexandria?', memories=HISTORY) == {
+    'rephrase': 'How tall was the lighthouse of Alexandria?'}
+  router.run(query='How tall was it?', memories=[])
+  assert router.stats()['no_history'] == 1 and router.stats()['rephrased'] == 1 and router.stats()['skip_rate'] == 0.5
+
+
+class StubRetriever:
+  def __init__(self):
+    self.queries = []
+
+  def run(self, query):
+    self.queries.append(query)
+    return {'documents': [Document(content=f"about {query}")]}
+
+
+@pytest.mark.parametrize('original, rephrased, reused', [
+  ('How tall was the lighthouse of Alexandria?', 'How tall was the lighthouse of Alexandria?', True),
+  ('how tall was the lighthouse of alexandria', 'How tall was the Lighthouse of Alexandria?', True),
+  ('How tall was the great lighthouse of ancient Alexandria in Egypt?', 'How tall was the great lighthouse of ancient Alexandria, Egypt?', True),
+  ('How tall was it?', 'How tall was the lighthouse of Alexandria?', False),
+  ('What about its height?', 'What was the height of the Colossus of Rhodes?', False),
+])
+def test_speculative_retrieval_reuses_only_close_rewrites(original, rephrased, reused):
+  retriever = StubRetriever()
+  prefetcher = RetrievalPrefetcher(retriever)
+  speculative = SpeculativeRetriever(prefetcher)
+  ticket = prefetcher.run(query=original)['ticket']
+  documents = speculative.run(query=rephrased, ticket=ticket)['documents']
+
+  assert (query_similarity(original, rephrased) >= 0.9) is reused
+  assert documents[0].content == f"about {original if reused else rephrased}"
+  assert speculative.stats() == {'prefetch_used': int(reused), 'prefetch_discarded': int(not reused), 'not_prefetched': 0}
+  assert prefetcher.take(ticket) is None
+
+
+def test_speculative_retrieval_without_a_ticket_retrieves_directly():
+  retriever = StubRetriever()
+  prefetcher = RetrievalPrefetcher(retriever, enabled=False)
+  speculative = SpeculativeRetriever(prefetcher)
+  assert prefetcher.run(query='How tall was it?') == {'query': 'How tall was it?', 'ticket': ''}
+  assert speculative.run(query='How tall was the lighthouse?', ticket='')['documents'][0].content == 'about How tall was the lighthouse?'
+  assert retriever.queries == ['How tall was the lighthouse?'] and speculative.stats()['not_prefetched'] == 1
+
+
+@pytest.fixture
+def estimated():
+  # A tokenizer that can not be loaded, so counts fall back to one token per four characters
+  return f"/missing-tokenizer-{uuid.uuid4().hex}"
+
+
+@pytest.fixture(scope='module')
+def word_tokenizer(tmp_path_factory):
+  from transformers import BertTokenizerFast
+
+  path = tmp_path_factory.mktemp('tokenizer')
+  words = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + [f"w{i}" for i in range(50)]
+  path.joinpath('vocab.txt').write_text('\n'.join(words), encoding='utf-8')
+  BertTokenizerFast(vocab_file=str(path.joinpath('vocab.txt'))).save_pretrained(str(path))
+  return str(path)
+
+
+def test_token_counter_estimates_without_a_tokenizer(estimated):
+  counter = TokenCounter(estimated)
+  assert [counter.count(text) for text in ['', 'abc', 'abcd', 'abcde']] == [0, 1, 1, 2]
+  assert counter.truncate('x' * 100, 5) == 'x' * 20
+
+
+def test_memory_budget_keeps_the_newest_turns(estimated):
+  memories = [ChatMessage.from_user(f"{i}" * 40) if i % 2 == 0 else ChatMessage.from_assistant(f"{i}" * 40) for i in range(6)]
+  result = MemoryBudget(budget=25, min_tokens=3, tokenizer=estimated).run(memories=memories)
+  # 10 tokens each: the two newest fit, the one before is cut to the 5 tokens left, the rest is dropped
+  assert [message.text for message in result['memories']] == ['3' * 20, '4' * 40, '5' * 40]
+  assert result['memories'][0].role == memories[3].role
+  assert result['token_count'] == 25
+
+  result = MemoryBudget(budget=25, min_tokens=6, tokenizer=estimated).run(memories=memories)
+  assert [message.text for message in result['memories']] == ['4' * 40, '5' * 40] and result['token_count'] == 20
+
+
+def test_document_budget_keeps_the_highest_scored_documents_in_order(estimated):
+  documents = [Document(id='low', content='a' * 40, score=0.1), Document(id='best', content='b' * 40, score=0.9),
+               Document(id='none', content='c' * 40, score=None), Document(id='good', content='d' * 80, score=0.5)]
+  result = DocumentBudget(budget=25, min_tokens=2, tokenizer=estimated).run(documents=documents)
+  # best (10 tokens) fits, good (20) is cut to the 15 left, low and the unscored one are dropped
+  assert [(doc.id, doc.content) for doc in result['documents']] == [('best', 'b' * 40), ('good', 'd' * 60)]
+  assert result['token_count'] == 25
+  assert documents[3].content == 'd' * 80
+
+
+def test_budgets_count_with_the_tokenizer(word_tokenizer):
+  counter = TokenCounter(word_tokenizer)
+  assert counter.count('w1 w2 w3') == 3 and counter.truncate('w1 w2 w3 w4', 2) == 'w1 w2'
+  memories = [ChatMessage.from_user(' '.join(f"w{i}" for i in range(10))) for _ in range(4)]
+  result = MemoryBudget(budget=25, min_tokens=3, tokenizer=word_tokenizer).run(memories=memories)
+  assert result['token_count'] == 25
+  assert [counter.count(message.text) for message in result['memories']] == [5, 10, 10]
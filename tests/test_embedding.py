@@ -0,0 +1,144 @@
+import json
+
+import numpy as np
+import pytest
+
+from embedding import SLOT_RECORD, EmbeddingCache, text_key
+
+
+def keys(count, start=0):
+  return [text_key(str(i)) for i in range(start, start + count)]
+
+
+def vectors(count, start=0, dim=4):
+  return [[float(i)] * dim for i in range(start, start + count)]
+
+
+def test_cache_round_trip_through_a_new_instance(tmp_path):
+  cache = EmbeddingCache(str(tmp_path), 'model', max_entries=100)
+  cache.put_many(keys(10), vectors(10))
+  reopened = EmbeddingCache(str(tmp_path), 'model', max_entries=100)
+  found = reopened.get_many(keys(11))
+  assert [vector[0] for vector in found[:10]] == [float(i) for i in range(10)]
+  assert found[10] is None
+
+
+def test_put_many_appends_to_the_log_instead_of_rewriting_the_index(tmp_path):
+  cache = EmbeddingCache(str(tmp_path), 'model', max_entries=100)
+  cache.put_many(keys(10), vectors(10))
+  index_json = cache._meta_file().read_bytes()
+  cache.put_many(keys(5, 10), vectors(5, 10))
+  assert cache._meta_file().read_bytes() == index_json
+  assert cache._log_file().stat().st_size == 15 * SLOT_RECORD.itemsize
+
+
+def test_instances_sharing_a_directory_see_each_others_rows(tmp_path):
+  # Two instances on one directory stand in for two processes
+  first = EmbeddingCache(str(tmp_path), 'model', max_entries=10)
+  second = EmbeddingCache(str(tmp_path), 'model', max_entries=10)
+  for start in range(0, 30, 3):
+    (first if start % 2 else second).put_many(keys(3, start), vectors(3, start))
+  # Full at 10 entries, the oldest rows were reused and the log compacted along the way
+  assert [vector is None for vector in first.get_many(keys(20))] == [True] * 20
+  assert [vector[0] for vector in first.get_many(keys(10, 20))] == [float(i) for i in range(20, 30)]
+  second.get_many([])
+  assert dict(first._entries) == dict(second._entries)
+  assert sorted(first._entries.values()) == list(range(10))
+
+
+def test_flush_saves_the_recency_order(tmp_path):
+  cache = EmbeddingCache(str(tmp_path), 'model', max_entries=3)
+  cache.put_many(keys(3), vectors(3))
+  cache.get_many(keys(1))
+  cache.flush()
+  reopened = EmbeddingCache(str(tmp_path), 'model', max_entries=3)
+  reopened.put_many(keys(1, 3), vectors(1, 3))
+  # Key 0 was read last, so key 1 was the least recently used one
+  found = reopened.get_many(keys(4))
+  assert [vector is None for vector in found] == [False, True, False, False]
+  assert np.array_equal(found[3], np.full(4, 3.0, dtype=np.float32))
+
+
+def test_legacy_index_json_entries_are_loaded(tmp_path):
+  cache = EmbeddingCache(str(tmp_path), 'model', max_entries=10)
+  cache.put_many(keys(2), vectors(2))
+  meta = {'model': 'model', 'dim': 4, 'capacity': 10, 'entries': [[key, slot] for key, slot in cache._entries.items()]}
+  cache._log_file().unlink()
+  cache._meta_file().write_text(json.dumps(meta), encoding='utf-8')
+  reopened = EmbeddingCache(str(tmp_path), 'model', max_entries=10)
+  assert [vector[0] for vector in reopened.get_many(keys(2))] == [0.0, 1.0]
+
+
+class StubModel:
+  def __init__(self):
+    self.calls = 0
+
+  def encode(self, text, **kwargs):
+    self.calls += 1
+    return np.full(4, float(len(text)), dtype=np.float32)
+
+
+def test_query_misses_are_written_to_disk_in_batches(tmp_path, monkeypatch):
+  from embedding import CachedTextEmbedder, EmbeddingLRU, model_pool
+
+  model = StubModel()
+  monkeypatch.setitem(model_pool._models, ('stub', None, 'torch'), (model, 0))
+  embedder = CachedTextEmbedder(model='stub', cache_dir=str(tmp_path), lru=EmbeddingLRU(), flush_every=3, backend='torch')
+  embedder.run(text='a')
+  embedder.run(text='bb')
+  assert embedder.disk.stats()['entries'] == 0
+  embedder.run(text='ccc')
+  assert embedder.disk.stats()['entries'] == 3
+  embedder.run(text='dddd')
+  embedder.flush()
+  assert embedder.disk.stats()['entries'] == 4
+
+  # A fresh LRU still finds them on disk, without calling the model
+  again = CachedTextEmbedder(model='stub', cache_dir=str(tmp_path), lru=EmbeddingLRU(), backend='torch')
+  assert again.run(text='dddd')['embedding'] == [4.0] * 4
+  assert model.calls == 4 and again.counts['disk_hits'] == 1
+
+
+@pytest.fixture(scope='module')
+def tiny_model(tmp_path_factory):
+  # A small random BERT with a lower-case vocabulary whose tokenizer does not lower-case itself, so only the
+  # Transformer module's do_lower_case makes upper-case text known
+  import torch
+  from sentence_transformers import SentenceTransformer, models
+  from transformers import BertConfig, BertModel, BertTokenizerFast
+
+  path = tmp_path_factory.mktemp('tiny-bert')
+  words = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + [f"w{i}" for i in range(200)]
+  path.joinpath('vocab.txt').write_text('\n'.join(words), encoding='utf-8')
+  BertTokenizerFast(vocab_file=str(path.joinpath('vocab.txt')), do_lower_case=False).save_pretrained(str(path))
+  torch.manual_seed(0)
+  BertModel(BertConfig(vocab_size=len(words), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+                       intermediate_size=64, max_position_embeddings=128)).save_pretrained(str(path))
+  transformer = models.Transformer(str(path), max_seq_length=64, do_lower_case=True)
+  model = SentenceTransformer(modules=[transformer, models.Pooling(transformer.get_word_embedding_dimension())], device='cpu')
+  model.eval()
+  return model
+
+
+def test_tokenize_unpadded_matches_the_model_tokenizer(tiny_model):
+  from embedding import tokenize_unpadded
+
+  texts = ['  W1 W2 w3 ', 'W10 W11 W12 W13 W14 W15', 'w7']
+  features = tiny_model.tokenize(texts)
+  expected = [ids[mask.bool()].tolist() for ids, mask in zip(features['input_ids'], features['attention_mask'])]
+  assert tokenize_unpadded(tiny_model, texts)['input_ids'] == expected
+  assert 1 not in expected[0]
+
+
+def test_token_budget_batches_return_embeddings_in_the_original_order(tiny_model, tmp_path, monkeypatch):
+  from embedding import CachedDocumentEmbedder, model_pool
+
+  monkeypatch.setitem(model_pool._models, ('tiny', None, 'torch'), (tiny_model, 0))
+  rng = np.random.default_rng(0)
+  texts = [' '.join(f"W{i}" for i in rng.integers(0, 200, length)) for length in rng.integers(1, 60, 40)]
+  embedder = CachedDocumentEmbedder(model='tiny', cache_dir=str(tmp_path), backend='torch', token_budget=128, max_batch_size=8)
+  embeddings = np.array(embedder.embed(texts))
+
+  assert embedder.stats()['batches'] > 5
+  expected = tiny_model.encode(texts, batch_size=len(texts))
+  assert np.allclose(embeddings, expected, atol=1e-5)
@@ -0,0 +1,113 @@
+import uuid
+
+import pytest
+
+from haystack import Document
+from haystack.components.writers import DocumentWriter
+from haystack.document_stores.types import DuplicatePolicy
+
+from ingestion import (FILTER_PAGE_SIZE, IncrementalDocumentFilter, SourceFingerprinter, StaleDocumentRemover,
+                       chunk_fingerprint, chunk_id, existing_chunks)
+from local_pinecone import LocalPineconeDocumentStore
+from vector_index import IndexedInMemoryDocumentStore
+
+
+def embed(documents):
+  for doc in documents:
+    doc.embedding = [float(len(doc.content)), 1.0, 0.0, 0.0]
+  return documents
+
+
+def ingest(store, path):
+  # The preprocessing pipeline of module.py without conversion and splitting: one chunk per line of the file
+  fingerprinted = SourceFingerprinter(store).run(sources=[str(path)])
+  documents = [Document(content=line, meta=dict(meta)) for source, meta in zip(fingerprinted['sources'], fingerprinted['meta'])
+               for line in open(source, encoding='utf-8').read().splitlines()]
+  split = IncrementalDocumentFilter(store).run(documents=documents)
+  written = DocumentWriter(store, policy=DuplicatePolicy.OVERWRITE).run(documents=embed(split['documents']) + split['unchanged'])
+  deleted = StaleDocumentRemover(store).run(document_ids=split['stale_ids'], documents_written=written['documents_written'])
+  return {**fingerprinted, **split, **written, **deleted}
+
+
+@pytest.fixture
+def store():
+  return IndexedInMemoryDocumentStore()
+
+
+def test_unchanged_file_is_skipped(store, tmp_path):
+  path = tmp_path.joinpath('notes.txt')
+  path.write_text('alpha\nbeta\n', encoding='utf-8')
+  first = ingest(store, path)
+  assert first['documents_written'] == 2 and first['skipped'] == []
+
+  second = ingest(store, path)
+  assert second['skipped'] == ['notes.txt'] and second['sources'] == []
+  assert second['documents'] == [] and second['documents_written'] == 0
+  assert store.count_documents() == 2
+
+
+def test_changed_file_is_split_into_new_unchanged_and_stale_chunks(store, tmp_path):
+  path = tmp_path.joinpath('notes.txt')
+  path.write_text('alpha\nbeta\ngamma\n', encoding='utf-8')
+  ingest(store, path)
+  embeddings = {doc.content: doc.embedding for doc in store.filter_documents()}
+
+  path.write_text('alpha\ngamma\ndelta\n', encoding='utf-8')
+  result = ingest(store, path)
+  assert [doc.content for doc in result['documents']] == ['delta']
+  assert sorted(doc.content for doc in result['unchanged']) == ['alpha', 'gamma']
+  assert result['stale_ids'] == [chunk_id('notes.txt', chunk_fingerprint('beta'))]
+  assert result['documents_deleted'] == 1
+
+  stored = {doc.content: doc for doc in store.filter_documents()}
+  assert sorted(stored) == ['alpha', 'delta', 'gamma']
+  # Kept chunks keep their embedding and pick up the new file hash
+  assert stored['alpha'].embedding == embeddings['alpha']
+  assert len({doc.meta['source_hash'] for doc in stored.values()}) == 1
+
+
+def test_rerunning_a_changed_file_is_idempotent(store, tmp_path):
+  path = tmp_path.joinpath('notes.txt')
+  path.write_text('alpha\nbeta\n', encoding='utf-8')
+  ingest(store, path)
+  path.write_text('alpha\nbeta\nbeta\ngamma\n', encoding='utf-8')
+  ingest(store, path)
+  snapshot = {doc.id: (doc.content, doc.meta) for doc in store.filter_documents()}
+  # The repeated line maps to the same id
+  assert sorted(content for content, _ in snapshot.values()) == ['alpha', 'beta', 'gamma']
+
+  assert ingest(store, path)['skipped'] == ['notes.txt']
+  assert {doc.id: (doc.content, doc.meta) for doc in store.filter_documents()} == snapshot
+
+  # The same file ingested into an empty store gets the same ids
+  fresh = IndexedInMemoryDocumentStore()
+  ingest(fresh, path)
+  assert {doc.id: (doc.content, doc.meta) for doc in fresh.filter_documents()} == snapshot
+
+
+def test_existing_chunks_pages_past_the_pinecone_filter_limit():
+  store = LocalPineconeDocumentStore(index=f"test-{uuid.uuid4().hex[:8]}", namespace='default', dimension=4)
+  count = FILTER_PAGE_SIZE + 250
+  documents = [Document(id=chunk_id('big.txt', chunk_fingerprint(str(i))), content=str(i),
+                        meta={'source_file': 'big.txt', 'chunk_hash': chunk_fingerprint(str(i))}) for i in range(count)]
+  store.write_documents(embed(documents) + embed([Document(content='other', meta={'source_file': 'other.txt'})]))
+  assert len(store.filter_documents(filters={'field': 'meta.source_file', 'operator': '==', 'value': 'big.txt'})) == FILTER_PAGE_SIZE
+  assert sorted(doc.id for doc in existing_chunks(store, 'big.txt')) == sorted(doc.id for doc in documents)
+
+
+def test_parallel_converter_keeps_the_routed_order(tmp_path):
+  from ingestion import CONVERSION_START_METHOD, ParallelFileConverter
+
+  paths = []
+  for i in range(4):
+    paths.append(tmp_path.joinpath(f"doc_{i}.txt"))
+    paths[-1].write_text(f"text {i}", encoding='utf-8')
+  converter = ParallelFileConverter(max_workers=2)
+  assert converter.mp_context == CONVERSION_START_METHOD != 'fork'
+  try:
+    result = converter.run(text_sources=[str(path) for path in paths], pdf_sources=[str(tmp_path.joinpath('missing.pdf'))])
+  finally:
+    converter.close()
+  assert [doc.content for doc in result['documents']] == [f"text {i}" for i in range(4)]
+  assert result['failed'] == ['missing.pdf']
+  assert converter._executor is None
@@ -0,0 +1,79 @@
+import uuid
+
+import pytest
+
+from haystack import Document
+from haystack.document_stores.errors import DuplicateDocumentError
+from haystack.document_stores.types import DuplicatePolicy
+
+from local_pinecone import LocalPinecone, LocalPineconeDocumentStore
+from pinecone_writer import PineconeBatchWriter, is_retryable
+
+
+def make_store(dimension=4):
+  return LocalPineconeDocumentStore(index=f"test-{uuid.uuid4().hex[:8]}", namespace='default', dimension=dimension)
+
+
+def make_documents(count, dimension=4, prefix='doc'):
+  return [Document(id=f"{prefix}-{i}", content=f"text {i}", embedding=[float(i + 1)] + [1.0] * (dimension - 1))
+          for i in range(count)]
+
+
+def test_writes_in_batches_and_creates_the_index():
+  store = make_store()
+  writer = PineconeBatchWriter(store, batch_size=7, max_in_flight=3)
+  result = writer.run(documents=make_documents(50))
+  assert result['documents_written'] == 50
+  assert store.count_documents() == 50
+  assert writer.stats()['batches'] == 8
+  assert LocalPinecone().has_index(store.index_name)
+
+
+def test_overwrite_is_the_default():
+  store = make_store()
+  writer = PineconeBatchWriter(store)
+  writer.run(documents=make_documents(3))
+  assert writer.run(documents=make_documents(3))['documents_written'] == 3
+  assert store.count_documents() == 3
+
+
+def test_skip_and_fail_policies():
+  store = make_store()
+  PineconeBatchWriter(store).run(documents=make_documents(3))
+  documents = make_documents(5)
+
+  assert PineconeBatchWriter(store, policy=DuplicatePolicy.SKIP).run(documents=documents)['documents_written'] == 2
+  with pytest.raises(DuplicateDocumentError):
+    PineconeBatchWriter(store).run(documents=make_documents(1), policy=DuplicatePolicy.FAIL)
+  assert store.count_documents() == 5
+
+
+class FlakyIndex:
+  def __init__(self, failures):
+    self.failures = failures
+    self.upserted = []
+
+  def upsert(self, vectors, namespace=None):
+    if self.failures:
+      self.failures -= 1
+      raise ConnectionError("connection reset")
+    self.upserted.extend(vectors)
+
+
+def test_retries_transient_errors():
+  index = FlakyIndex(failures=2)
+  writer = PineconeBatchWriter(make_store(), index=index, batch_size=10, max_in_flight=1, backoff=0.001)
+  assert writer.run(documents=make_documents(10))['documents_written'] == 10
+  assert writer.stats()['retries'] == 2
+  assert len(index.upserted) == 10
+
+
+def test_gives_up_on_errors_that_are_not_transient():
+  class BrokenIndex:
+    def upsert(self, vectors, namespace=None):
+      raise ValueError("dimension mismatch")
+
+  writer = PineconeBatchWriter(make_store(), index=BrokenIndex(), backoff=0.001)
+  with pytest.raises(ValueError):
+    writer.run(documents=make_documents(2))
+  assert not is_retryable(ValueError())
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from haystack import Document
+from haystack.document_stores.types import DuplicatePolicy
+
+from benchmark_quantization import clustered_vectors, make_queries, recall
+from vector_index import DEFAULT_RESCORE_MULTIPLIERS, EmbeddingIndex, IndexedInMemoryDocumentStore, QuantizedEmbeddingIndex
+
+TOP_K = 10
+
+
+@pytest.fixture(scope='module')
+def corpus():
+  vectors = clustered_vectors(5000, 384, 100, seed=0)
+  queries = make_queries(vectors, 100, 0.5, seed=0)
+  ids = [str(i) for i in range(len(vectors))]
+  exact = EmbeddingIndex(dim=384)
+  exact.attach(ids, vectors.copy())
+  expected = [[doc_id for doc_id, _ in hits] for hits in exact.search(queries, TOP_K)]
+  return vectors, queries, ids, expected
+
+
+def quantized_recall(corpus, mode, multiplier):
+  vectors, queries, ids, expected = corpus
+  index = QuantizedEmbeddingIndex(mode, rescore_multiplier=multiplier)
+  index.attach(ids, vectors)
+  found = [[doc_id for doc_id, _ in hits] for hits in index.search(queries, TOP_K)]
+  return recall(found, expected)
+
+
+@pytest.mark.parametrize('mode, multiplier, floor', [
+  ('int8', 1, 0.95),
+  ('int8', DEFAULT_RESCORE_MULTIPLIERS['int8'], 0.99),
+  ('binary', DEFAULT_RESCORE_MULTIPLIERS['binary'], 0.97),
+])
+def test_recall_against_exact_search(corpus, mode, multiplier, floor):
+  assert quantized_recall(corpus, mode, multiplier) >= floor
+
+
+def test_binary_needs_its_larger_default_shortlist(corpus):
+  # Documents why binary does not share int8's default: at 4x it loses a noticeable share of the neighbours
+  assert quantized_recall(corpus, 'binary', 4) < quantized_recall(corpus, 'binary', DEFAULT_RESCORE_MULTIPLIERS['binary'])
+
+
+@pytest.mark.parametrize('mode', ['int8', 'binary'])
+def test_scores_are_exact_after_rescoring(corpus, mode):
+  vectors, queries, ids, _ = corpus
+  index = QuantizedEmbeddingIndex(mode)
+  index.attach(ids[:500], vectors[:500])
+  for doc_id, score in index.search(queries[:5], TOP_K)[0]:
+    assert score == pytest.approx(float(vectors[int(doc_id)] @ queries[0]), abs=1e-5)
+
+
+@pytest.mark.parametrize('mode', ['int8', 'binary'])
+def test_rescoring_after_delete_and_insert(mode):
+  vectors = clustered_vectors(300, 64, 10, seed=1)
+  index = QuantizedEmbeddingIndex(mode, initial_capacity=8)
+  index.add([str(i) for i in range(300)], vectors)
+  index.remove([str(i) for i in range(0, 300, 3)])
+  assert len(index) == 200 and '0' not in index
+
+  # Rows moved into the holes carry their own full-precision vectors in the memory-mapped file
+  for i in (1, 2, 298, 299):
+    assert index.vector(str(i)) == pytest.approx(vectors[i].tolist(), abs=1e-6)
+    assert index.search([vectors[i]], top_k=1)[0][0] == (str(i), pytest.approx(1.0, abs=1e-5))
+  assert all(doc_id != '0' for doc_id, _ in index.search([vectors[0]], top_k=20)[0])
+
+  index.add(['new', '1'], [vectors[0], vectors[3]])
+  assert index.search([vectors[0]], top_k=1)[0][0][0] == 'new'
+  assert index.vector('1') == pytest.approx(vectors[3].tolist(), abs=1e-6)
+  assert {doc_id for doc_id, _ in index.search_ids(vectors[3], ['1', '2', 'missing'], top_k=5)} == {'1', '2'}
+
+
+def test_quantized_store_round_trip(tmp_path):
+  vectors = clustered_vectors(200, 32, 5, seed=2)
+  documents = [Document(id=str(i), content=f"text {i}", embedding=vector.tolist()) for i, vector in enumerate(vectors)]
+  store = IndexedInMemoryDocumentStore(quantization='int8')
+  store.write_documents(documents)
+  # Stored documents drop their float lists, reads fill them in from the index
+  assert all(doc.embedding is None for doc in store.storage.values())
+  assert store.filter_documents()[0].embedding is not None
+  assert store.embedding_retrieval(vectors[7].tolist(), top_k=1)[0].id == '7'
+
+  store.save(str(tmp_path.joinpath('snapshot')))
+  restored = IndexedInMemoryDocumentStore.load(str(tmp_path.joinpath('snapshot')), quantization='binary')
+  assert isinstance(restored.embedding_index, QuantizedEmbeddingIndex)
+  assert restored.embedding_retrieval(vectors[7].tolist(), top_k=1)[0].id == '7'
+  restored.write_documents(documents[:5], policy=DuplicatePolicy.OVERWRITE)
+  assert restored.count_documents() == 200 and len(restored.embedding_index) == 200
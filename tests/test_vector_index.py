@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+from haystack import Document
+from haystack.document_stores.in_memory import InMemoryDocumentStore
+from haystack.document_stores.types import DuplicatePolicy
+
+from vector_index import EmbeddingIndex, IndexedInMemoryDocumentStore
+
+
+def clustered(count, dim=16, clusters=8, seed=0):
+  rng = np.random.default_rng(seed)
+  centers = rng.standard_normal((clusters, dim))
+  return (centers[rng.integers(0, clusters, count)] + 0.5 * rng.standard_normal((count, dim))).astype(np.float32)
+
+
+def make_documents(vectors, prefix='doc'):
+  return [Document(id=f"{prefix}-{i}", content=f"text {i}", embedding=vector.tolist(), meta={'group': i % 3})
+          for i, vector in enumerate(vectors)]
+
+
+def ids(documents):
+  return [doc.id for doc in documents]
+
+
+@pytest.fixture
+def stores():
+  documents = make_documents(clustered(300))
+  reference = InMemoryDocumentStore(embedding_similarity_function='cosine')
+  reference.write_documents(documents)
+  indexed = IndexedInMemoryDocumentStore()
+  indexed.write_documents(documents)
+  return reference, indexed
+
+
+def test_exact_retrieval_matches_in_memory_store(stores):
+  reference, indexed = stores
+  for query in clustered(10, seed=1):
+    expected = reference.embedding_retrieval(query.tolist(), top_k=5)
+    found = indexed.embedding_retrieval(query.tolist(), top_k=5)
+    assert ids(found) == ids(expected)
+    assert [doc.score for doc in found] == pytest.approx([doc.score for doc in expected], abs=1e-5)
+
+
+def test_filtered_retrieval_matches_in_memory_store(stores):
+  reference, indexed = stores
+  filters = {'field': 'meta.group', 'operator': '==', 'value': 1}
+  for query in clustered(10, seed=2):
+    expected = reference.embedding_retrieval(query.tolist(), filters=filters, top_k=5)
+    assert ids(indexed.embedding_retrieval(query.tolist(), filters=filters, top_k=5)) == ids(expected)
+
+
+def test_batch_retrieval_matches_single_queries(stores):
+  _, indexed = stores
+  queries = clustered(5, seed=3).tolist()
+  batched = indexed.embedding_retrieval_batch(queries, top_k=4)
+  assert [ids(result) for result in batched] == [ids(indexed.embedding_retrieval(query, top_k=4)) for query in queries]
+
+
+def test_ivf_search_recall():
+  vectors = clustered(2000, seed=4)
+  doc_ids = [str(i) for i in range(len(vectors))]
+  exact = EmbeddingIndex()
+  exact.add(doc_ids, vectors)
+  approximate = EmbeddingIndex(approximate=True, n_lists=16, n_probe=6, ivf_min_size=500)
+  approximate.add(doc_ids, vectors)
+  assert approximate._centroids is not None
+
+  queries = clustered(50, seed=5)
+  expected = exact.search(queries, top_k=10)
+  found = approximate.search(queries, top_k=10)
+  recall = np.mean([len({i for i, _ in a} & {i for i, _ in b}) / 10 for a, b in zip(found, expected)])
+  assert recall >= 0.9
+
+  # Probing every list is exact search
+  approximate.n_probe = 16
+  assert [[i for i, _ in hits] for hits in approximate.search(queries, top_k=10)] == \
+    [[i for i, _ in hits] for hits in expected]
+
+
+def test_delete_and_overwrite_after_growth():
+  index = EmbeddingIndex(initial_capacity=4)
+  vectors = clustered(50, seed=6)
+  index.add([str(i) for i in range(50)], vectors)
+  assert index.size == 50 and index._matrix.shape[0] >= 50
+
+  index.remove([str(i) for i in range(0, 50, 2)])
+  assert index.size == 25 and '0' not in index and '1' in index
+  # The rows moved into the holes still belong to their ids
+  for i in range(1, 50, 2):
+    assert index.vector(str(i)) == pytest.approx((vectors[i] / np.linalg.norm(vectors[i])).tolist(), abs=1e-6)
+
+  index.add(['1'], [vectors[10]])
+  assert index.size == 25
+  assert index.search([vectors[10]], top_k=1)[0][0][0] == '1'
+
+
+def test_store_overwrite_and_delete_update_the_index():
+  store = IndexedInMemoryDocumentStore()
+  vectors = clustered(20, seed=7)
+  store.write_documents(make_documents(vectors))
+  store.write_documents([Document(id='doc-0', content='moved', embedding=vectors[5].tolist())], policy=DuplicatePolicy.OVERWRITE)
+  assert {doc.id for doc in store.embedding_retrieval(vectors[5].tolist(), top_k=2)} == {'doc-0', 'doc-5'}
+
+  store.delete_documents(['doc-5'])
+  assert 'doc-5' not in ids(store.embedding_retrieval(vectors[5].tolist(), top_k=20))
+  assert len(store.embedding_index) == 19
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float16'])
+def test_snapshot_round_trip_then_write(tmp_path, dtype):
+  vectors = clustered(30, seed=8)
+  store = IndexedInMemoryDocumentStore()
+  store.write_documents(make_documents(vectors))
+  store.save(str(tmp_path.joinpath('snapshot')), dtype=dtype)
+
+  restored = IndexedInMemoryDocumentStore.load(str(tmp_path.joinpath('snapshot')))
+  assert restored.count_documents() == 30
+  query = vectors[3].tolist()
+  assert ids(restored.embedding_retrieval(query, top_k=3)) == ids(store.embedding_retrieval(query, top_k=3))
+  assert restored.filter_documents()[0].embedding is not None
+
+  # Re-uploading documents that are already in the snapshot, as the preprocessing pipeline does
+  restored.write_documents(make_documents(vectors[:10]), policy=DuplicatePolicy.OVERWRITE)
+  restored.write_documents(make_documents(clustered(5, seed=9), prefix='new'))
+  assert restored.count_documents() == 35
+  assert restored.embedding_retrieval(query, top_k=1)[0].id == 'doc-3'
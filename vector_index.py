@@ -0,0 +1,577 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from dataclasses import replace
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from haystack import Document
+from haystack.document_stores.in_memory import InMemoryDocumentStore
+from haystack.document_stores.in_memory.document_store import BM25DocumentStats
+from haystack.document_stores.types import DuplicatePolicy
+
+
+IVF_MIN_SIZE = int(os.getenv('IVF_MIN_SIZE', '50000'))
+SCORE_BLOCK_ROWS = 65536
+# Where quantized indexes keep their full-precision vectors for rescoring, the system temp directory by default
+QUANTIZED_RESCORE_DIR = os.getenv('QUANTIZED_RESCORE_DIR')
+# Shortlist sizes (times top_k) that keep recall@k near 1.0 on 384-d sentence embeddings. Sign bits rank far more
+# coarsely than int8 codes: binary recall is about 0.35 at 1x and 0.76 at 4x, so 10x is its floor
+DEFAULT_RESCORE_MULTIPLIERS = {'int8': 4, 'binary': 10}
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+  norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+  norms[norms == 0] = 1.0
+  return vectors / norms
+
+
+def top_k_rows(scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+  # argpartition finds the k best columns per row in linear time, only those k get sorted
+  top_k = min(top_k, scores.shape[1])
+  if top_k == 0:
+    return np.empty((scores.shape[0], 0), dtype=np.int64), np.empty((scores.shape[0], 0), dtype=scores.dtype)
+  best = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+  best_scores = np.take_along_axis(scores, best, axis=1)
+  order = np.argsort(-best_scores, axis=1)
+  return np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+class EmbeddingIndex:
+  """
+  Cosine-similarity index over one contiguous, row-normalized float32 matrix. Appends grow the matrix
+  by doubling its capacity, deletes move the last row into the hole, and queries are scored in batches
+  with a single matrix product. With `approximate=True`, once the index holds `ivf_min_size` vectors,
+  searches only score the rows of the `n_probe` inverted lists whose centroids are closest to the query.
+  """
+
+  def __init__(self, dim: Optional[int] = None, initial_capacity: int = 1024, approximate: bool = False,
+               n_lists: Optional[int] = None, n_probe: int = 8, ivf_min_size: int = IVF_MIN_SIZE):
+    self.dim = dim
+    self.size = 0
+    self.ids: List[str] = []
+    self.approximate = approximate
+    self.n_lists = n_lists
+    self.n_probe = n_probe
+    self.ivf_min_size = ivf_min_size
+    self._initial_capacity = initial_capacity
+    self._rows: Dict[str, int] = {}
+    self._matrix: Optional[np.ndarray] = None
+    self._centroids: Optional[np.ndarray] = None
+    self._assignments: Optional[np.ndarray] = None
+    self._trained_size = 0
+    self._lock = threading.RLock()
+
+  @property
+  def matrix(self) -> np.ndarray:
+    if self._matrix is None:
+      return np.empty((0, self.dim or 0), dtype=np.float32)
+    return self._matrix[:self.size]
+
+  def __len__(self):
+    return self.size
+
+  def __contains__(self, doc_id: str):
+    return doc_id in self._rows
+
+  def vector(self, doc_id: str) -> Optional[List[float]]:
+    row = self._rows.get(doc_id)
+    return None if row is None else self._matrix[row].astype(np.float32).tolist()
+
+  def attach(self, ids: List[str], matrix: np.ndarray):
+    # Adopts an existing matrix as is, e.g. a memory-mapped snapshot, rows must already be normalized
+    with self._lock:
+      self.dim = matrix.shape[1]
+      self.size = len(ids)
+      self.ids = list(ids)
+      self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+      self._matrix = matrix
+      self._assignments = np.zeros(len(ids), dtype=np.int32)
+      self._centroids = None
+      self._trained_size = 0
+      self._maybe_train()
+
+  def _reserve(self, rows: int):
+    if self._matrix is None:
+      capacity = max(self._initial_capacity, rows)
+      self._matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+      self._assignments = np.zeros(capacity, dtype=np.int32)
+      return
+    needed = self.size + rows
+    if needed <= self._matrix.shape[0]:
+      return
+    capacity = self._matrix.shape[0]
+    while capacity < needed:
+      capacity *= 2
+    matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+    matrix[:self.size] = self._matrix[:self.size]
+    assignments = np.zeros(capacity, dtype=np.int32)
+    assignments[:self.size] = self._assignments[:self.size]
+    self._matrix, self._assignments = matrix, assignments
+
+  def add(self, ids: List[str], embeddings: Iterable[List[float]]):
+    if not len(ids):
+      return
+    vectors = normalize_rows(np.asarray(list(embeddings), dtype=np.float32).reshape(len(ids), -1))
+    with self._lock:
+      if self.dim is None:
+        self.dim = vectors.shape[1]
+      new_ids, new_rows = [], []
+      for doc_id, vector in zip(ids, vectors):
+        row = self._rows.get(doc_id)
+        if row is not None:
+          self._matrix[row] = vector
+          if self._centroids is not None:
+            self._assignments[row] = self._nearest_lists(vector[None, :])[0]
+        else:
+          new_ids.append(doc_id)
+          new_rows.append(vector)
+      if new_ids:
+        self._reserve(len(new_ids))
+        start = self.size
+        self._matrix[start:start + len(new_ids)] = np.stack(new_rows)
+        for offset, doc_id in enumerate(new_ids):
+          self._rows[doc_id] = start + offset
+        self.ids.extend(new_ids)
+        self.size += len(new_ids)
+        if self._centroids is not None:
+          self._assignments[start:self.size] = self._nearest_lists(self._matrix[start:self.size])
+      self._maybe_train()
+
+  def remove(self, ids: Iterable[str]):
+    with self._lock:
+      for doc_id in ids:
+        row = self._rows.pop(doc_id, None)
+        if row is None:
+          continue
+        last = self.size - 1
+        if row != last:
+          self._matrix[row] = self._matrix[last]
+          self._assignments[row] = self._assignments[last]
+          moved_id = self.ids[last]
+          self.ids[row] = moved_id
+          self._rows[moved_id] = row
+        self.ids.pop()
+        self.size -= 1
+
+  def clear(self):
+    with self._lock:
+      self.size = 0
+      self.ids = []
+      self._rows = {}
+      self._centroids = None
+      self._trained_size = 0
+
+  def _nearest_lists(self, vectors: np.ndarray) -> np.ndarray:
+    return np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+
+  def _maybe_train(self):
+    # (Re)build the inverted lists when the index first gets big enough and whenever it has doubled since
+    if not self.approximate or self.size < self.ivf_min_size:
+      return
+    if self._centroids is not None and self.size < 2 * self._trained_size:
+      return
+    self.train()
+
+  def train(self, iterations: int = 10, seed: int = 0):
+    with self._lock:
+      n_lists = self.n_lists or max(1, int(np.sqrt(self.size)))
+      rng = np.random.default_rng(seed)
+      sample = self.matrix[rng.choice(self.size, size=min(self.size, 64 * n_lists), replace=False)]
+      centroids = sample[rng.choice(len(sample), size=min(n_lists, len(sample)), replace=False)].copy()
+      # Spherical k-means: assign by dot product, re-normalize the means
+      for _ in range(iterations):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        for list_id in range(len(centroids)):
+          members = sample[labels == list_id]
+          if len(members):
+            centroids[list_id] = members.mean(axis=0)
+        centroids = normalize_rows(centroids)
+      self._centroids = centroids.astype(np.float32)
+      self._assignments[:self.size] = self._nearest_lists(self.matrix)
+      self._trained_size = self.size
+
+  def search(self, query_embeddings: Iterable[List[float]], top_k: int = 10) -> List[List[Tuple[str, float]]]:
+    queries = np.asarray(list(query_embeddings), dtype=np.float32)
+    queries = normalize_rows(queries.reshape(len(queries), -1))
+    with self._lock:
+      if self.size == 0:
+        return [[] for _ in range(len(queries))]
+      if self._centroids is None:
+        rows, scores = top_k_rows(self._scores(queries), top_k)
+        return [[(self.ids[row], float(score)) for row, score in zip(row_ids, row_scores)]
+                for row_ids, row_scores in zip(rows, scores)]
+
+      results = []
+      probes = np.argsort(-(queries @ self._centroids.T), axis=1)[:, :self.n_probe]
+      assignments = self._assignments[:self.size]
+      for query, query_probes in zip(queries, probes):
+        candidates = np.flatnonzero(np.isin(assignments, query_probes))
+        rows, scores = top_k_rows(self._scores(query[None, :], candidates), top_k)
+        results.append([(self.ids[candidates[row]], float(score)) for row, score in zip(rows[0], scores[0])])
+      return results
+
+  def search_ids(self, query_embedding: List[float], ids: Iterable[str], top_k: int = 10) -> List[Tuple[str, float]]:
+    query = normalize_rows(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))
+    with self._lock:
+      candidates = np.array([self._rows[doc_id] for doc_id in ids if doc_id in self._rows], dtype=np.int64)
+      if not len(candidates):
+        return []
+      rows, scores = top_k_rows(self._scores(query, candidates), top_k)
+      return [(self.ids[candidates[row]], float(score)) for row, score in zip(rows[0], scores[0])]
+
+  def _scores(self, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+    matrix = self.matrix if rows is None else self._matrix[rows]
+    if matrix.dtype == np.float32:
+      return queries @ matrix.T
+    # float16 snapshots are converted one block at a time instead of all at once
+    scores = np.empty((len(queries), len(matrix)), dtype=np.float32)
+    for start in range(0, len(matrix), SCORE_BLOCK_ROWS):
+      block = np.asarray(matrix[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+      scores[:, start:start + len(block)] = queries @ block.T
+    return scores
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+  # Symmetric scaling per row, so every row uses the full int8 range without a calibration set
+  scales = np.abs(vectors).max(axis=1) / 127
+  scales[scales == 0] = 1.0
+  return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+  return np.packbits(vectors > 0, axis=1)
+
+
+class QuantizedEmbeddingIndex:
+  """
+  Alternative to EmbeddingIndex that keeps only compact codes in RAM: int8 codes with one scale per row
+  (`mode='int8'`, about 4x smaller than float32) or sign bits compared by Hamming distance (`mode='binary'`,
+  32x smaller). A search scores the codes to shortlist `rescore_multiplier * top_k` rows and rescores those
+  exactly against the full-precision vectors, which live in a memory-mapped file and are only paged in for
+  the shortlist. `rescore_multiplier` defaults per mode to DEFAULT_RESCORE_MULTIPLIERS.
+  """
+
+  def __init__(self, mode: str = 'int8', dim: Optional[int] = None, initial_capacity: int = 1024,
+               rescore_multiplier: Optional[int] = None, directory: Optional[str] = QUANTIZED_RESCORE_DIR):
+    if mode not in ('int8', 'binary'):
+      raise ValueError(f"Unknown quantization mode {mode}, use 'int8' or 'binary'")
+    self.mode = mode
+    self.dim = dim
+    self.size = 0
+    self.ids: List[str] = []
+    self.rescore_multiplier = rescore_multiplier or DEFAULT_RESCORE_MULTIPLIERS[mode]
+    self._initial_capacity = initial_capacity
+    self._rows: Dict[str, int] = {}
+    self._codes: Optional[np.ndarray] = None
+    self._scales: Optional[np.ndarray] = None
+    self._floats: Optional[np.ndarray] = None
+    self._directory = tempfile.mkdtemp(prefix='quantized-index-', dir=directory)
+    self._float_path = Path(self._directory).joinpath('vectors.f32')
+    self._lock = threading.RLock()
+    weakref.finalize(self, shutil.rmtree, self._directory, True)
+
+  @property
+  def matrix(self) -> np.ndarray:
+    if self._floats is None:
+      return np.empty((0, self.dim or 0), dtype=np.float32)
+    return self._floats[:self.size]
+
+  def __len__(self):
+    return self.size
+
+  def __contains__(self, doc_id: str):
+    return doc_id in self._rows
+
+  def memory_bytes(self) -> int:
+    # RAM held by the codes, the full-precision vectors are on disk
+    return sum(array[:self.size].nbytes for array in (self._codes, self._scales) if array is not None)
+
+  def vector(self, doc_id: str) -> Optional[List[float]]:
+    row = self._rows.get(doc_id)
+    return None if row is None else np.array(self._floats[row]).tolist()
+
+  def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    if self.mode == 'int8':
+      return quantize_int8(vectors)
+    return quantize_binary(vectors), None
+
+  def _reserve(self, rows: int):
+    needed = self.size + rows
+    capacity = 0 if self._codes is None else self._codes.shape[0]
+    if needed <= capacity:
+      return
+    new_capacity = max(capacity or self._initial_capacity, 1)
+    while new_capacity < needed:
+      new_capacity *= 2
+    width = self.dim if self.mode == 'int8' else (self.dim + 7) // 8
+    codes = np.zeros((new_capacity, width), dtype=np.int8 if self.mode == 'int8' else np.uint8)
+    scales = np.ones(new_capacity, dtype=np.float32) if self.mode == 'int8' else None
+    if self._codes is not None:
+      codes[:self.size] = self._codes[:self.size]
+      if scales is not None:
+        scales[:self.size] = self._scales[:self.size]
+      self._floats.flush()
+    # Growing the file keeps the rows already written, only the mapping is renewed
+    with open(self._float_path, 'ab') as handle:
+      handle.truncate(new_capacity * self.dim * 4)
+    self._floats = np.memmap(self._float_path, dtype=np.float32, mode='r+', shape=(new_capacity, self.dim))
+    self._codes, self._scales = codes, scales
+
+  def _write(self, rows: np.ndarray, vectors: np.ndarray):
+    codes, scales = self._encode(vectors)
+    self._codes[rows] = codes
+    if scales is not None:
+      self._scales[rows] = scales
+    self._floats[rows] = vectors
+
+  def add(self, ids: List[str], embeddings: Iterable[List[float]]):
+    if not len(ids):
+      return
+    vectors = normalize_rows(np.asarray(list(embeddings), dtype=np.float32).reshape(len(ids), -1))
+    with self._lock:
+      if self.dim is None:
+        self.dim = vectors.shape[1]
+      existing = [(row, i) for i, row in enumerate(self._rows.get(doc_id) for doc_id in ids) if row is not None]
+      if existing:
+        self._write(np.array([row for row, _ in existing]), vectors[[i for _, i in existing]])
+      new = [i for i, doc_id in enumerate(ids) if doc_id not in self._rows]
+      if new:
+        self._reserve(len(new))
+        start = self.size
+        self._write(np.arange(start, start + len(new)), vectors[new])
+        for offset, i in enumerate(new):
+          self._rows[ids[i]] = start + offset
+          self.ids.append(ids[i])
+        self.size += len(new)
+
+  def attach(self, ids: List[str], matrix: np.ndarray):
+    # Quantizes an existing float matrix (e.g. a snapshot) block by block instead of adopting it
+    with self._lock:
+      self.clear()
+      if self.dim != matrix.shape[1]:
+        self._codes = self._scales = self._floats = None
+      self.dim = matrix.shape[1]
+      for start in range(0, len(ids), SCORE_BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+        self.add(list(ids[start:start + SCORE_BLOCK_ROWS]), block)
+
+  def remove(self, ids: Iterable[str]):
+    with self._lock:
+      for doc_id in ids:
+        row = self._rows.pop(doc_id, None)
+        if row is None:
+          continue
+        last = self.size - 1
+        if row != last:
+          self._codes[row] = self._codes[last]
+          if self._scales is not None:
+            self._scales[row] = self._scales[last]
+          self._floats[row] = self._floats[last]
+          moved_id = self.ids[last]
+          self.ids[row] = moved_id
+          self._rows[moved_id] = row
+        self.ids.pop()
+        self.size -= 1
+
+  def clear(self):
+    with self._lock:
+      self.size = 0
+      self.ids = []
+      self._rows = {}
+
+  def train(self, *args, **kwargs):
+    # Codes are scanned in full, there are no inverted lists to build
+    pass
+
+  def _code_scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+    count = self.size if rows is None else len(rows)
+    scores = np.empty(count, dtype=np.float32)
+    query_bits = quantize_binary(query[None, :])[0] if self.mode == 'binary' else None
+    for start in range(0, count, SCORE_BLOCK_ROWS):
+      block_rows = slice(start, min(count, start + SCORE_BLOCK_ROWS)) if rows is None else rows[start:start + SCORE_BLOCK_ROWS]
+      codes = self._codes[block_rows]
+      if self.mode == 'int8':
+        scores[start:start + len(codes)] = (codes.astype(np.float32) @ query) * self._scales[block_rows]
+      else:
+        # Fewer differing sign bits is better, so the negated Hamming distance is the score
+        scores[start:start + len(codes)] = -_POPCOUNT[np.bitwise_xor(codes, query_bits)].sum(axis=1, dtype=np.int32)
+    return scores
+
+  def _search_one(self, query: np.ndarray, top_k: int, rows: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+    count = self.size if rows is None else len(rows)
+    shortlist_size = min(count, top_k * self.rescore_multiplier)
+    if shortlist_size == 0:
+      return []
+    if shortlist_size < count:
+      shortlist = top_k_rows(self._code_scores(query, rows)[None, :], shortlist_size)[0][0]
+      candidates = np.sort(shortlist if rows is None else rows[shortlist])
+    else:
+      candidates = np.sort(np.arange(count) if rows is None else rows)
+    # Exact rescoring, reading the shortlisted rows in file order
+    exact = np.asarray(self._floats[candidates]) @ query
+    best, scores = top_k_rows(exact[None, :], top_k)
+    return [(self.ids[candidates[i]], float(score)) for i, score in zip(best[0], scores[0])]
+
+  def search(self, query_embeddings: Iterable[List[float]], top_k: int = 10) -> List[List[Tuple[str, float]]]:
+    queries = np.asarray(list(query_embeddings), dtype=np.float32)
+    queries = normalize_rows(queries.reshape(len(queries), -1))
+    with self._lock:
+      return [self._search_one(query, top_k) for query in queries]
+
+  def search_ids(self, query_embedding: List[float], ids: Iterable[str], top_k: int = 10) -> List[Tuple[str, float]]:
+    query = normalize_rows(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+    with self._lock:
+      rows = np.array([self._rows[doc_id] for doc_id in ids if doc_id in self._rows], dtype=np.int64)
+      return self._search_one(query, top_k, rows) if len(rows) else []
+
+
+class IndexedInMemoryDocumentStore(InMemoryDocumentStore):
+  """
+  InMemoryDocumentStore that keeps every written embedding in an EmbeddingIndex, so InMemoryEmbeddingRetriever
+  scores all documents with one matrix product instead of a Python loop. Similarity is always cosine.
+  With filters, only the embeddings of the matching documents are scored.
+
+  `save` writes a snapshot directory: `documents.feather` holds ids, content, metadata and BM25 statistics as
+  columns, `embeddings.f32` (or `.f16`) the raw index matrix and `store.json` the rest. `load` memory-maps the
+  embeddings copy-on-write, so restoring costs no upfront RAM and the pages are shared through the OS page cache.
+
+  With `quantization` set to 'int8' or 'binary' the embeddings go into a QuantizedEmbeddingIndex instead, and the
+  stored documents no longer carry their embedding lists; they are filled in from the index when read back.
+  """
+
+  def __init__(self, approximate: bool = False, n_lists: Optional[int] = None, n_probe: int = 8,
+               quantization: Optional[str] = None, rescore_multiplier: Optional[int] = None, **kwargs):
+    kwargs['embedding_similarity_function'] = 'cosine'
+    super().__init__(**kwargs)
+    self.quantization = quantization
+    if quantization:
+      self.embedding_index = QuantizedEmbeddingIndex(quantization, rescore_multiplier=rescore_multiplier)
+    else:
+      self.embedding_index = EmbeddingIndex(approximate=approximate, n_lists=n_lists, n_probe=n_probe)
+    # Bumped on every write and delete, so caches of answers over the stored documents know when to drop them
+    self.generation = 0
+
+  def write_documents(self, documents: List[Document], policy: DuplicatePolicy = DuplicatePolicy.NONE) -> int:
+    written = super().write_documents(documents, policy=policy)
+    stored = [doc for doc in documents if self.storage.get(doc.id) is doc]
+    self.embedding_index.remove(doc.id for doc in stored if doc.embedding is None)
+    with_embedding = [doc for doc in stored if doc.embedding is not None]
+    self.embedding_index.add([doc.id for doc in with_embedding], [doc.embedding for doc in with_embedding])
+    if self.quantization:
+      for doc in with_embedding:
+        self.storage[doc.id] = replace(doc, embedding=None)
+    self.generation += 1
+    return written
+
+  def filter_documents(self, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+    # Snapshot restores and quantized stores keep embeddings in the index only, callers still get them back
+    documents = super().filter_documents(filters=filters)
+    return [replace(doc, embedding=self.embedding_index.vector(doc.id)) if doc.embedding is None and doc.id in self.embedding_index
+            else doc for doc in documents]
+
+  def delete_documents(self, document_ids: List[str]) -> None:
+    super().delete_documents(document_ids)
+    self.embedding_index.remove(document_ids)
+    self.generation += 1
+
+  def _to_results(self, hits: List[Tuple[str, float]], scale_score: bool, return_embedding: bool) -> List[Document]:
+    documents = []
+    for doc_id, score in hits:
+      doc = self.storage.get(doc_id)
+      if doc is None:
+        continue
+      if scale_score:
+        score = (score + 1) / 2
+      embedding = (doc.embedding or self.embedding_index.vector(doc_id)) if return_embedding else None
+      documents.append(replace(doc, score=score, embedding=embedding))
+    return documents
+
+  def embedding_retrieval(self, query_embedding: List[float], filters: Optional[Dict[str, Any]] = None, top_k: int = 10,
+                          scale_score: bool = False, return_embedding: bool = False) -> List[Document]:
+    if filters:
+      ids = [doc.id for doc in super().filter_documents(filters=filters)]
+      return self._to_results(self.embedding_index.search_ids(query_embedding, ids, top_k), scale_score, return_embedding)
+    return self.embedding_retrieval_batch([query_embedding], top_k, scale_score, return_embedding)[0]
+
+  def embedding_retrieval_batch(self, query_embeddings: List[List[float]], top_k: int = 10, scale_score: bool = False,
+                                return_embedding: bool = False) -> List[List[Document]]:
+    return [self._to_results(hits, scale_score, return_embedding) for hits in self.embedding_index.search(query_embeddings, top_k)]
+
+  def save(self, path: str, dtype: str = 'float32'):
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+
+    with self.embedding_index._lock:
+      matrix = self.embedding_index.matrix
+      ids = list(self.embedding_index.ids)
+      np.asarray(matrix, dtype=dtype).tofile(tmp_path.joinpath(f"embeddings.{'f16' if dtype == 'float16' else 'f32'}"))
+
+    documents = list(self.storage.values())
+    bm25 = self._bm25_attr
+    rows = {doc_id: row for row, doc_id in enumerate(ids)}
+    table = pa.table({
+      'id': [doc.id for doc in documents],
+      'content': [doc.content for doc in documents],
+      'meta': [json.dumps(doc.meta) for doc in documents],
+      'row': [rows.get(doc.id, -1) for doc in documents],
+      'bm25_freq': [json.dumps(bm25[doc.id].freq_token) if doc.id in bm25 else None for doc in documents],
+      'bm25_len': [bm25[doc.id].doc_len if doc.id in bm25 else 0 for doc in documents],
+    })
+    feather.write_feather(table, tmp_path.joinpath('documents.feather'), compression='zstd')
+    with open(tmp_path.joinpath('store.json'), 'w', encoding='utf-8') as handle:
+      json.dump({'count': len(documents), 'embeddings': len(ids), 'dim': self.embedding_index.dim, 'dtype': dtype,
+                 'avg_doc_len': self._avg_doc_len, 'freq_vocab_for_idf': dict(self._freq_vocab_for_idf)}, handle)
+
+    # Swap directories so a crash mid-save never leaves a half-written snapshot in place
+    old_path = path.with_name(path.name + '.old')
+    if path.exists():
+      os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+  @classmethod
+  def load(cls, path: str, mmap: bool = True, **kwargs) -> 'IndexedInMemoryDocumentStore':
+    import pyarrow.feather as feather
+
+    path = Path(path)
+    with open(path.joinpath('store.json'), 'r', encoding='utf-8') as handle:
+      manifest = json.load(handle)
+    store = cls(**kwargs)
+
+    columns = feather.read_table(path.joinpath('documents.feather'), memory_map=True).to_pydict()
+    ids = [None] * manifest['embeddings']
+    storage, bm25 = store.storage, store._bm25_attr
+    for doc_id, content, meta, row, freq, doc_len in zip(columns['id'], columns['content'], columns['meta'],
+                                                          columns['row'], columns['bm25_freq'], columns['bm25_len']):
+      # Embeddings stay in the index matrix only, Document.embedding is filled in on demand
+      storage[doc_id] = Document(id=doc_id, content=content, meta=json.loads(meta))
+      if row >= 0:
+        ids[row] = doc_id
+      if freq is not None:
+        bm25[doc_id] = BM25DocumentStats(freq_token=json.loads(freq), doc_len=doc_len)
+    store._freq_vocab_for_idf.update(manifest['freq_vocab_for_idf'])
+    store._avg_doc_len = manifest['avg_doc_len']
+
+    if manifest['embeddings']:
+      dtype = np.float16 if manifest['dtype'] == 'float16' else np.float32
+      embeddings_file = path.joinpath(f"embeddings.{'f16' if dtype == np.float16 else 'f32'}")
+      shape = (manifest['embeddings'], manifest['dim'])
+      if mmap:
+        matrix = np.memmap(embeddings_file, dtype=dtype, mode='c', shape=shape)
+      else:
+        matrix = np.fromfile(embeddings_file, dtype=dtype).reshape(shape)
+      store.embedding_index.attach(ids, matrix)
+    return store